@@ -4,10 +4,26 @@ import time
 
 from vispy import app, gloo, util
 from vispy.gloo import Program
-from vispy.util.transforms import perspective
-from matplotlib import cm
+from vispy.util.transforms import perspective, translate
+from vispy.color import get_colormap
 
 from camera import Camera, CameraInputHandler
+from particleBuffer import ParticleBuffer
+from packing import PackedParticleBuffer
+from snapshots import SnapshotSeries, SnapshotPrefetcher
+from liveFeed import LiveFeedReader
+from spatialIndex import GridIndex, frustumPlanes, boxesInFrustum
+from depthSort import DepthSorter
+from densitySplat import DENSITY_MODES, DENSITY_SCALINGS, ReductionReadback, reductionSize, scalingFromReduction
+from picking import buildInBackground, cursorRay
+from filtering import ParticleFilter, filterKey
+from trails import ParticleTrails
+from residency import ResidencyManager
+from fieldStatistics import FieldStatistics
+from profiler import FrameProfiler
+from frameCapture import FrameCapture
+from shaderCache import loadShader, installProgramCache
+from transform import glmToNumpy
 
 def _checkerboard(size=64,tiles=4):
     return np.reshape(
@@ -17,24 +33,40 @@ def _checkerboard(size=64,tiles=4):
             (2*tiles*size,2*tiles*size,3) )
 
 class Canvas(app.Canvas):
-    def __init__(self):
-        app.Canvas.__init__(self, size=(512, 512), title='Particle Renderer', keys='interactive')
+    def __init__(self, size=(512, 512), show=True, programCache=False):
+        """set show to False for headless rendering with renderOffscreen()
+        programCache stores compiled shader programs on disk (see shaderCache.py), so later starts do not compile.
+        It depends on vispy internals and only works with the vispy versions it was checked against."""
+        app.Canvas.__init__(self, size=size, title='Particle Renderer', keys='interactive')
 
         # enable geometry shader
         gloo.gl.use_gl('gl+')
 
-        # load and compile shader
-        with open('shader/particleRenderer.frag', 'r') as file:
-            fragmentString = file.read()
-
-        with open('shader/particleRenderer.geom', 'r') as file:
-            geomString = file.read()
-
-        with open('shader/particleRenderer.vert', 'r') as file:
-            vertexString = file.read()
+        if programCache:
+            installProgramCache(self)
 
+        # load and compile shader, _useRenderPath() switches to the instanced quads if needed
         self.program = Program()
-        self.program.set_shaders(vertexString, fragmentString, geomString, True)
+        self.program.set_shaders(loadShader('particleRenderer.vert'), loadShader('particleRenderer.frag'),
+                                 loadShader('particleRenderer.geom'), True)
+        self._activeRenderPath = 'geometry'
+        self._quadCorners = gloo.VertexBuffer(np.array([(-1, -1), (-1, 1), (1, -1), (1, 1)], dtype=np.float32))
+
+        # programs of the aggregated density rendering, see densityMode below
+        self._densityProgram = Program(loadShader('particleRenderer.vert', ['DENSITY_SPLAT']),
+                                       loadShader('densityAccumulate.frag'))
+        self._resolveProgram = Program(loadShader('densityResolve.vert'), loadShader('densityResolve.frag'))
+        self._resolveProgram['input_position'] = self._quadCorners
+        self._reduceProgram = Program(loadShader('densityResolve.vert'), loadShader('densityReduce.frag'))
+        self._reduceProgram['input_position'] = self._quadCorners
+        self._equalizeTable = gloo.Texture1D(shape=(1, 1), format='luminance', internalformat='r32f',
+                                             interpolation='nearest')
+        self._resolveProgram['equalizeTable'] = self._equalizeTable
+        self._densityTarget = None
+        self._densityTargetSize = None
+        self._reduceTarget = None
+        self._densityReadback = ReductionReadback()
+        self._densityScale = None  # (densityMode, (low, high, table)) read back from an earlier frame
 
         ######################################
         # settings
@@ -58,31 +90,114 @@ class Canvas(app.Canvas):
         # the CameraInputHandler links the camera to keybiard and mouse input, you can also change keybindings there
         self.camInputHandler = CameraInputHandler(self.cam)
 
-        # // positions where spheres are rendered
-        self.program['input_position'] = [(0, 0, 0), (1, 1, 1),
-                                          (1,1,-1), (1,-1,1), (1,-1,-1),
-                                          (-1,1,1), (-1,1,-1), (-1,-1,1),
-                                          (-1,-1,-1)]
+        # how particles are expanded into sprites: 'geometry' uses the geometry shader, 'instanced' draws one
+        # instanced quad per particle which is faster on many drivers and software renderers,
+        # 'auto' uses instanced quads unless culling or sorting is enabled (those always use the geometry shader)
+        self.renderPath = 'auto'
+
+        # aggregated rendering for far more particles than pixels: instead of spheres a histogram of the particles
+        # per pixel is drawn, colored with the transfer function. The cost per frame is one point per particle
+        # and a constant amount of work per pixel. For rendering without opengl see densitySplat.densityImage()
+        # densityMode None: draw spheres, 'count': particles per pixel, 'scalar' / 'meanScalar': sum / mean of the scalar
+        self.densityMode = None
+        self.densityScaling = 'log'  # how values are mapped to the transfer function: 'linear', 'log' or 'equalize'
+
+        # frustum culling and level of detail, the spatial index is built from the positions when culling needs it
+        self.enableCulling = False  # only draw particles in grid cells that are inside the view frustum
+        self.lodDistance = None  # grid cells further away than this are subsampled, None draws everything
+
+        # draw particles back to front with alpha blending, so materialAlpha < 1 works with depth testing
+        # the particles are sorted again when the camera turned or moved more than the thresholds of self.depthSorter,
+        # which is created from the positions when sorting needs it
+        self.sortTransparent = False
+
+        # picking, click on a particle with the left mouse button to get its index and attributes, see pick()
+        # the picking tree is built in a background thread from the positions when picking needs it
+        self.enablePicking = False
+        self.pickOnHover = False  # also pick while the mouse moves
+        self.onPick = None  # called with the result of pick() on every click (and mouse move if pickOnHover is set)
 
-        # vector field for color
-        # self.program['input_vector'] =
+        # only draw particles in a scalar range, vector magnitude range or region, see setFilter()
+        # the filter is evaluated on the particle data the first time it is drawn after setParticles()
+        self.enableFiltering = False
+
+        # out of core rendering of more particles than fit into gpu memory: with a budget (in bytes) setParticles()
+        # splits the particles into spatial chunks and only the chunks most important for the view are uploaded,
+        # see residency.py. Set it before setParticles(), self.residency.statistics() shows what is resident
+        self.gpuMemoryBudget = None
+
+        # set lowerBound and upperBound automatically from percentiles of the scalar field / vector field magnitude
+        # for snapshot series the histograms of all snapshots loaded so far are used and cached next to the file,
+        # other data is only analyzed in setParticles() if this is enabled before
+        self.autoBounds = False
+        self.autoBoundsPercentiles = (1.0, 99.0)
+
+        # trails, the last trailLength positions of every particle are kept in a ring buffer on the gpu and drawn as
+        # fading lines ('lines') or shrinking spheres ('spheres'), None draws no trails. Every setParticles() call
+        # with all positions (eg. every snapshot or live feed frame) adds one position to the trails. Trails are
+        # colored by the scalar field in color mode 3 and with the default color otherwise
+        self.trailMode = None
+        self.trailLength = 32  # changing it starts new trails
+        self.trailLineWidth = 1.0
+
+        # periodic boundaries: images of the particles shifted by multiples of the box size are drawn with a different
+        # model matrix, so they need no memory. periodicBox is the size of the box (3 floats) or None for no images,
+        # periodicImages the number of images on each side of the original (int or 3 ints), 1 gives 3x3x3 images.
+        # Images outside the view frustum are skipped. With images, frustum culling only works per image
+        # and with a gpuMemoryBudget the resident chunks are chosen for the original particles
+        self.periodicBox = None
+        self.periodicImages = 1
+
+        # particle data lives in preallocated vertex buffers, use setParticles() to change it
+        self._particles = ParticleBuffer()
+        self._compactLayout = None  # quantizePositions of the compact layout, None for the float layout
+        self._spatialIndex = None
+        self.depthSorter = None
+        self.residency = None  # ResidencyManager if a gpuMemoryBudget is set
+        self._nextParticles = None  # ParticleBuffer with the snapshot after the current one, for interpolation
+        self._nextSnapshot = None
+        self._drawIndices = gloo.IndexBuffer(np.zeros(0, dtype=np.uint32))
+        self._drawIndicesSource = None  # (culling, sorting) of the indices in _drawIndices
+        self._drawIndexCount = 0
+        self._pickTree = None  # future of the picking.ParticleTree
+        self._particleData = {}  # particle attributes on the cpu, for culling, sorting, picking and filtering
+        self._ownedParticleData = set()  # names of the arrays in _particleData that are private copies
+        self._filterKey = None  # filter set with setFilter(), see filtering.filterKey()
+        self._particleFilter = None  # filtering.ParticleFilter of the current particles, created on first use
+        self.trails = None  # ParticleTrails while a trailMode is set
+        self._trailProgram = None  # draws trails as lines, created on first use
+        self.pickedParticle = None  # result of the last pick, see pick()
+        self._maxParticleRadius = 0.0
+        self._particleBounds = None  # (lower, upper) of the positions, for culling periodic images, see _bounds()
+        self._statistics = FieldStatistics()  # statistics of the data shown, for autoBounds
+        self._seriesStatistics = None  # statistics of the opened snapshot series, cached on disk
+        self._givenStatistics = None  # statistics set with setStatistics(), used instead of the two above
+
+        # positions where spheres are rendered
+        position = np.array([(0, 0, 0), (1, 1, 1),
+                             (1, 1, -1), (1, -1, 1), (1, -1, -1),
+                             (-1, 1, 1), (-1, 1, -1), (-1, -1, 1),
+                             (-1, -1, -1)], dtype=np.float32)
+        # vector field for color in color mode 1 and 2, pass vector= to setParticles to set it
         # scalar field, used for color in color mode 3
-        self.program['input_scalar'] = np.array([0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9], dtype=np.float32)
+        scalar = np.array([0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9], dtype=np.float32)
         # radius per particle, set self.program['enableSizePerParticle']  = True to enable
-        self.program['input_radius'] = [[0.15], [0.1], [0.2], [0.1], [0.2], [0.05], [0.1], [0.15], [0.1]]
+        radius = np.array([0.15, 0.1, 0.2, 0.1, 0.2, 0.05, 0.1, 0.15, 0.1], dtype=np.float32)
+        self.setParticles(position=position, scalar=scalar, radius=radius)
 
         # size
         self.program['enableSizePerParticle'] = False  # enable this and set a size for each particle above
         self.program['sphereRadius'] = 0.15  # radius of the spheres if "size per particle" is disabled
 
         # background
-        gloo.set_state(clear_color=(0.30, 0.30, 0.35, 1.00))  # background color
+        self.backgroundColor = (0.30, 0.30, 0.35, 1.00)  # background color
 
         # transfer function / color
         self.program['colorMode'] = 3  # 1: color by vector field direction, 2: color by vector field magnitude, 3: color by scalar field, 0: constant color
         self.program['defaultColor'] = (1, 1, 1)  # particle color in color mode 0
         self.program['lowerBound'] = 0.0  # lowest value of scalar field / vector field magnitude
         self.program['upperBound'] = 1.0  # lowest value of scalar field / vector field magnitude
+        # lower and upper bound can also be set automatically, see autoBounds above
         self.program['customTransferFunc'] = True  # set to true to use a custom transfer function
         # Transfer function uses a 1D Texture.
         # Provide 1D list of colors (r,g,b) as the textures data attribute, colors will be evenly spread over
@@ -90,7 +205,7 @@ class Canvas(app.Canvas):
         # have the first specified color, the one with a scalar equal to lowerBound will have the last. Values that
         # lie in between the colors are interpolated linearly
         self.program['transferFunc'] = gloo.Texture1D(format='rgba', interpolation='linear', internalformat='rgba8',
-                                                        data=cm.viridis(range(256)).astype(np.float32))
+                                                        data=get_colormap('viridis').map(np.linspace(0, 1, 256)).astype(np.float32))
         # sphere look
         self.program['brightness'] = 1  # additional brightness control
         self.program['materialAlpha'] = 1.0  # set lower than one to make spheres
@@ -123,6 +238,27 @@ class Canvas(app.Canvas):
         self.enableOriginIndicator = True  # enable / disable orientation indicator at the origin
         self.originIndicatorSize = 1.0  # change size of the origin indicator
 
+        # snapshot playback, call openSnapshots() to load a time series, press "P" to play / pause, "N" / "B" to step
+        self.playing = False  # advance snapshots automatically
+        self.snapshotsPerSecond = 10.0  # playback speed, the actual speed is limited by how fast snapshots can be read
+        self.prefetchSnapshots = 4  # number of snapshots read in the background ahead of the current one
+        # interpolated playback, the current and the next snapshot are both on the gpu and the vertex shader blends
+        # between them, so playback is smooth even if only every n-th step was saved and only one snapshot is
+        # uploaded per interval. 'linear', 'hermite' (uses the vector field as velocity, scaled by the time between
+        # the snapshots, see particleRenderer.vert) or None to show each snapshot as it is. Picking, filtering and
+        # sorting use the current snapshot while the particles move towards the next one, culling is off meanwhile
+        self.interpolateSnapshots = None
+
+        # frame time measurement, self.profiler.summary() / percentiles() / writeCsv() give the results
+        # set self.profiler.recordTrace = True to keep every frame for writeCsv()
+        self.profiler = FrameProfiler()
+        self.profiler.enabled = False  # measure cpu and gpu time of every stage in on_draw
+        self.showProfilerOverlay = False  # show frame times in the upper left, needs the profiler to be enabled
+
+        # only redraw on input, data changes or while the camera is moving, instead of continuously
+        # when changing settings while this is enabled call self.update() to redraw
+        self.renderOnDemand = False
+
         # other
         self.program['spriteScale'] = 1.1  # increase this if spheres appear to have cut off edges
 
@@ -131,20 +267,21 @@ class Canvas(app.Canvas):
         # setup orientation indicator
 
         # load and compile shader
-        with open('shader/oriIndicator.frag', 'r') as file:
-            oriFragmentString = file.read()
-
-        with open('shader/oriIndicator.vert', 'r') as file:
-            oriVertexString = file.read()
-
-        self._oriProgram = Program(oriVertexString,oriFragmentString)
+        self._oriProgram = Program(loadShader('oriIndicator.vert'), loadShader('oriIndicator.frag'))
         self._oriProgram['input_position'] = [ (0,0,0), (1,0,0),
                                                (0,0,0), (0,1,0),
                                                (0,0,0), (0,0,1)]
 
         # model matrix
         model = np.eye(4, dtype=np.float32)
+        self._model = model  # periodic images are drawn with a shifted copy of it
         self.program['model'] = model
+        self._densityProgram['model'] = model
+
+        # only set while trails are drawn as spheres, see _drawTrails()
+        for program in (self.program, self._densityProgram):
+            for name in ('trailLength', 'trailHead', 'trailFilled', 'trailParticles'):
+                program[name] = 0
 
         # camera and view matrix
         self.program['view'] = self.cam.viewMatrix
@@ -157,14 +294,461 @@ class Canvas(app.Canvas):
         # timing
         self._lastTime = time.time()
 
+        # profiler overlay, created on first use
+        self._profilerText = None
+
+        # playback state
+        self._snapshots = None
+        self._prefetcher = None
+        self._snapshotIndex = 0
+        self._snapshotTime = 0.0
+        self._playbackClock = 0.0
+
+        # live feed state, see connectLiveFeed()
+        self._liveFeed = None
+        self._liveFeedTimer = None
+
+        # offscreen framebuffer, created by renderOffscreen()
+        self._offscreen = None
+        self._offscreenSize = None
+
+        # video capture, see startCapture()
+        self._capture = None
+
         # show window
-        self.show()
+        if show:
+            self.show()
 
     def resetCamera(self):
         self.cam.setPosition(self.initialCamPosition,True)
         self.cam.setTarget(self.initialCamTarget,True)
 
+    def setParticles(self, position=None, vector=None, scalar=None, radius=None, offset=None, snapshot=None):
+        """Set particle data. Takes numpy arrays of shape (n,3) for position and vector and (n,) for scalar and radius.
+        Attributes that are None keep their current values, so eg. updating only the scalars is cheap. In compact
+        layout and with a gpuMemoryBudget all attributes are uploaded together and the ones that are None are reset
+        to zero.
+        Without offset the arrays replace all particles, with offset only the particles
+        [offset, offset+n) are updated. Contiguous float32 arrays are uploaded without copying them.
+        snapshot is set internally when the data comes from a snapshot series.
+        The arrays are kept by reference (so can be memory mapped) for culling, sorting, picking and filtering, do not
+        change them afterwards. Partial updates copy an array only if one of those features is enabled, otherwise
+        the attribute is forgotten on the cpu until it is set again without offset.
+        With a gpuMemoryBudget every call needs the positions."""
+        if self.gpuMemoryBudget is not None:
+            if position is None or offset is not None:
+                raise ValueError("with a gpuMemoryBudget every call to setParticles() needs all positions")
+            self.residency = ResidencyManager(position, vector, scalar, radius, self.gpuMemoryBudget)
+            self._particles = self.residency.buffer
+            self._drawIndicesSource = None
+        else:
+            if self.residency is not None:
+                self.residency = None
+                self._particles = self._newParticleBuffer()
+            self._particles.setData(position, vector, scalar, radius, offset)
+        if snapshot is None:
+            # the next snapshot of a series would be interpolated towards, but this data is not part of it
+            self._nextSnapshot = None
+        self._bindParticles()
+        self.update()
+        self._particlesChanged(position, vector, scalar, radius, offset, snapshot)
+
+    def _particlesChanged(self, position=None, vector=None, scalar=None, radius=None, offset=None, snapshot=None):
+        """update everything that is computed on the cpu from the particles given to setParticles()"""
+        if snapshot is None and offset is None and (scalar is not None or vector is not None):
+            # statistics of data that is not part of a snapshot series can not be cached
+            self._statistics = FieldStatistics()
+            if self.autoBounds:
+                self._statistics.add(scalar, vector)
+        elif snapshot is not None and self._seriesStatistics is not None:
+            self._statistics = self._seriesStatistics
+
+        if radius is not None:
+            self._maxParticleRadius = max(float(np.max(radius, initial=0.0)),
+                                          self._maxParticleRadius if offset is not None else 0.0)
+
+        self._updateParticleData({'position': position, 'vector': vector, 'scalar': scalar, 'radius': radius}, offset)
+
+        # the spatial index and the depth sorter are built again from all positions when culling or sorting needs
+        # them, see _buildMissingIndexes(). Out of core rendering culls whole chunks and does not sort
+        if position is not None or self.residency is not None:
+            self._spatialIndex = None
+            self._setDepthSorter(None)
+
+        self._particleFilter = None
+        if self._filterKey is not None:
+            self._drawIndicesSource = None
+        if position is not None:
+            self._particleBounds = None
+
+        if self.trailMode is not None and position is not None and offset is None:
+            if self.trails is None or self.trails.length != self.trailLength:
+                self.trails = ParticleTrails(self.trailLength)
+            self.trails.push(position, scalar)
+        elif self.trailMode is None:
+            self.trails = None
+
+        # the picking tree holds positions and radii, scalars and vectors are read when a particle is picked
+        if position is not None or radius is not None or 'position' not in self._particleData:
+            self._setPickTree(None)
+            self._buildMissingPickTree()
+
+    def _updateParticleData(self, given, offset):
+        """Keep the attributes given to setParticles() on the cpu, by reference. Partial updates are written into
+        a private copy of an array, so the arrays of the caller are never changed. Attributes no enabled feature
+        reads are dropped instead of copied."""
+        if self._compactLayout is not None or self.residency is not None:
+            # attributes that were not given are zero on the gpu now, see useCompactLayout() and residency.py
+            for name in [name for name, array in given.items() if array is None]:
+                self._particleData.pop(name, None)
+                self._ownedParticleData.discard(name)
+        if offset is None:
+            # attributes that were not given stay if they still have one value per particle
+            self._particleData = {name: array for name, array in self._particleData.items()
+                                  if len(array) == self.particleCount}
+            self._particleData.update({name: array for name, array in given.items() if array is not None})
+            self._ownedParticleData &= {name for name, array in given.items() if array is None}
+            return
+        for name, array in given.items():
+            stored = self._particleData.get(name)
+            if array is None or stored is None:
+                continue
+            if name not in self._ownedParticleData:
+                if name not in self._cpuAttributes():
+                    del self._particleData[name]
+                    continue
+                stored = self._particleData[name] = np.array(stored)
+                self._ownedParticleData.add(name)
+            values = np.asarray(array).reshape((-1,) + stored.shape[1:])
+            stored[offset:offset + len(values)] = values
+
+    def _cpuAttributes(self):
+        """names of the attributes that the enabled features read from the particle data on the cpu"""
+        names = set()
+        if self.enableCulling or self.sortTransparent or self.periodicBox is not None:
+            names.add('position')
+        if self.enablePicking:
+            names.update(('position', 'vector', 'scalar', 'radius'))
+        if self.enableFiltering:
+            names.update(('position', 'vector', 'scalar'))
+        return names
+
+    def _buildMissingIndexes(self):
+        """build the spatial index, the depth sorter and the picking tree if culling, sorting or picking was enabled
+        after setParticles() or the positions changed since"""
+        self._buildMissingPickTree()
+        if self.residency is not None or 'position' not in self._particleData:
+            return
+        if self.enableCulling and self._spatialIndex is None and not self._interpolationReady():
+            self._spatialIndex = GridIndex(self._particleData['position'])
+        if self.sortTransparent and self.depthSorter is None:
+            self._setDepthSorter(DepthSorter(self._particleData['position']))
+
+    def _bounds(self):
+        """(lower, upper) of all positions, computed on first use after the positions changed, None without particles"""
+        if self._particleBounds is None:
+            if self.residency is not None:
+                if self.residency.count == 0:
+                    return None
+                # the chunks know their bounds already, memory mapped positions are not read a second time
+                self._particleBounds = self.residency.bounds()
+            elif self._spatialIndex is not None:
+                self._particleBounds = (self._spatialIndex.lower, self._spatialIndex.upper)
+            elif len(self._particleData.get('position', ())) > 0:
+                position = self._particleData['position']
+                self._particleBounds = (np.min(position, axis=0), np.max(position, axis=0))
+        return self._particleBounds
+
+    def useCompactLayout(self, enable, quantizePositions=False):
+        """Store particles in the compact layout (see packing.py): vectors with 10 bit per component,
+        scalar and radius as half floats and optionally positions as 20 bit fixed point inside the bounding box.
+        Needs 20 or 16 instead of 32 bytes per particle. In compact layout every call to setParticles() needs the
+        positions and attributes that are not given are set to zero. Changing the layout discards the current particles, call setParticles() again afterwards.
+        Out of core rendering (see gpuMemoryBudget) always uses the float layout."""
+        self._compactLayout = quantizePositions if enable else None
+        self._particles = self._newParticleBuffer()
+        self.residency = None
+        self._bindParticles()
+        self._particleData = {}
+        self._ownedParticleData = set()
+        self._spatialIndex = None
+        self._setDepthSorter(None)
+
+    def _newParticleBuffer(self):
+        return ParticleBuffer() if self._compactLayout is None else PackedParticleBuffer(self._compactLayout)
+
+    @property
+    def particleCount(self):
+        return self._particles.count if self.residency is None else self.residency.count
+
+    def _buildMissingPickTree(self):
+        """start building the picking tree in the background if picking is enabled and there is none"""
+        if self.enablePicking and self._pickTree is None and 'position' in self._particleData:
+            self._setPickTree(buildInBackground(self._particleData['position'], self._particleData.get('radius')))
+
+    def _setPickTree(self, future):
+        if self._pickTree is not None:
+            self._pickTree.cancel()
+        self._pickTree = future
+
+    def pick(self, x, y):
+        """Returns the particle under the pixel x, y (from the top left, like mouse events) as dict with its index,
+        position, vector, scalar, radius and distance from the camera. Attributes that were not given to
+        setParticles() are None. Returns None if there is no particle or the picking tree is still being built."""
+        self._buildMissingPickTree()
+        if self._pickTree is None or not self._pickTree.done():
+            return None
+        tree = self._pickTree.result()
+        origin, direction = cursorRay(x, y, self.size, self.cam.modelMatrix, self._projection)
+        if bool(np.max(self.program['enableSizePerParticle'])) and tree.radius is not None:
+            hit = tree.intersect(origin, direction)
+        else:
+            hit = tree.intersect(origin, direction, float(np.max(self.program['sphereRadius'])))
+        if hit is None:
+            return None
+        index, distance = hit
+        result = {'index': index, 'distance': distance}
+        for name in ('position', 'vector', 'scalar', 'radius'):
+            array = self._particleData.get(name)
+            result[name] = None if array is None else np.array(array[index])
+        return result
+
+    def _pickAt(self, position):
+        self.pickedParticle = self.pick(*position)
+        if self.onPick is not None:
+            self.onPick(self.pickedParticle)
+
+    def _setDepthSorter(self, sorter):
+        if self.depthSorter is not None:
+            self.depthSorter.close()
+        self.depthSorter = sorter
+        self._drawIndicesSource = None
+
+    def setFilter(self, scalarRange=None, magnitudeRange=None, box=None, planes=None):
+        """Only draw particles whose scalar / vector magnitude is within (low, high) (None for an open end), that are
+        inside the box (lower, upper) and in front of all planes (a,b,c,d), where a*x + b*y + c*z + d >= 0.
+        Needs enableFiltering, call without arguments to draw all particles again. The index arrays of the last few
+        filters are cached, so going back to a filter uploads nothing. Any setParticles() call clears that cache."""
+        key = filterKey(scalarRange, magnitudeRange, box, planes)
+        if key is not None:
+            if self.residency is not None:
+                raise ValueError("filters can not be used together with a gpuMemoryBudget")
+            if not self.enableFiltering:
+                raise ValueError("set enableFiltering to filter particles")
+            if not self._particleData:
+                raise ValueError("call setParticles() before setting a filter")
+            # evaluate now, so a filter on an attribute that was never given fails here and not while drawing
+            self._currentFilter().indices(key)
+        self._filterKey = key
+        self.update()
+
+    def _currentFilter(self):
+        if self._particleFilter is None:
+            self._particleFilter = ParticleFilter(*(self._particleData.get(name)
+                                                    for name in ('position', 'vector', 'scalar')))
+        return self._particleFilter
+
+    def _indexedDraw(self):
+        """returns (culling, sorting, filtering), which of the features that draw through index buffers are active"""
+        # the grid index holds the positions of the current snapshot, interpolated particles can leave its cells
+        culling = self.enableCulling and self._spatialIndex is not None and self.periodicBox is None \
+            and not self._interpolationReady()
+        return culling, \
+            self.sortTransparent and self.depthSorter is not None, \
+            self.enableFiltering and self._filterKey is not None and self.residency is None and bool(self._particleData)
+
+    def _bindParticles(self):
+        if self._activeRenderPath == 'instanced':
+            self._particles.bind(self.program, divisor=1)
+            self.program['input_corner'] = self._quadCorners
+        else:
+            self._particles.bind(self.program)
+            # only the instanced quads have corners, drop the ones set before switching the render path
+            self.program['input_corner'] = None
+        self._particles.bind(self._densityProgram)
+
+        # attributes of the next snapshot, constant unless playback is interpolated
+        if self._interpolationReady():
+            self._nextParticles.bindNext(self.program, divisor=1 if self._activeRenderPath == 'instanced' else None)
+            self._nextParticles.bindNext(self._densityProgram)
+        else:
+            for program in (self.program, self._densityProgram):
+                program['input_positionNext'] = (0, 0, 0)
+                program['input_vectorNext'] = (0, 0, 0)
+                program['input_scalarNext'] = 0
+
+    def _interpolationReady(self):
+        """True if the snapshot after the current one is on the gpu, so the shader can interpolate"""
+        if self._nextSnapshot is None:
+            return False
+        if self.interpolateSnapshots not in (None, 'linear', 'hermite'):
+            raise ValueError("interpolateSnapshots must be None, 'linear' or 'hermite', got "
+                             + repr(self.interpolateSnapshots))
+        return self.interpolateSnapshots is not None \
+            and self._nextSnapshot.index == (self._snapshotIndex + 1) % len(self._snapshots) \
+            and self._nextParticles.count == self._particles.count \
+            and self._compactLayout is None and self.residency is None
+
+    def _pollNextSnapshot(self):
+        """upload the snapshot after the current one for interpolation, as soon as it is loaded"""
+        nextIndex = (self._snapshotIndex + 1) % len(self._snapshots)
+        if self._nextSnapshot is not None and self._nextSnapshot.index == nextIndex:
+            return
+        snapshot = self._prefetcher.poll(nextIndex)
+        if snapshot is None:
+            return
+        if self._nextParticles is None:
+            self._nextParticles = ParticleBuffer()
+        self._nextParticles.setData(**snapshot.arrays())
+        self._nextSnapshot = snapshot
+        self._bindParticles()
+
+    def _setInterpolationUniforms(self):
+        mode = 0
+        interval = 0.0
+        # when playback loops from the last snapshot to the first the particles jump instead of moving between them
+        if self._interpolationReady() and self._nextSnapshot.index > self._snapshotIndex:
+            mode = 2 if self.interpolateSnapshots == 'hermite' else 1
+            interval = max(self._nextSnapshot.time - self._snapshotTime, 0.0)
+        for program in (self.program, self._densityProgram):
+            program['interpolation'] = mode
+            program['time'] = min(self._playbackClock, 1.0)
+            program['snapshotInterval'] = interval
+
+    def _useRenderPath(self):
+        """switch the particle program to the render path selected by self.renderPath"""
+        if self.renderPath not in ('auto', 'geometry', 'instanced'):
+            raise ValueError("renderPath must be 'auto', 'geometry' or 'instanced', got " + repr(self.renderPath))
+        path = self.renderPath
+        indexed = any(self._indexedDraw()) or self.residency is not None
+        if (self.enableCulling or self.sortTransparent or self.residency is not None or self._filterKey is not None) \
+                and (path == 'auto' or indexed):
+            # culled, sorted, filtered and out of core draws select single points with an index buffer
+            path = 'geometry'
+        elif path == 'auto':
+            path = 'instanced'
+        if path == self._activeRenderPath:
+            return
+        # vispy can not apply constant attribute values to new shaders, all attributes are bound again below
+        for kind, _, name in self.program.variables:
+            if kind == 'attribute':
+                self.program[name] = None
+        if path == 'instanced':
+            self.program.set_shaders(loadShader('particleRenderer.vert', ['INSTANCED_QUADS']),
+                                     loadShader('particleRenderer.frag'))
+        else:
+            self.program.set_shaders(loadShader('particleRenderer.vert'), loadShader('particleRenderer.frag'),
+                                     loadShader('particleRenderer.geom'))
+        self._activeRenderPath = path
+        self._bindParticles()
+
+    def openSnapshots(self, path):
+        """Open a snapshot file written with snapshots.SnapshotWriter and show its first snapshot."""
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+        if self._snapshots is not None:
+            self._seriesStatistics.save()
+        self._snapshots = SnapshotSeries(path)
+        self._nextSnapshot = None
+        self._seriesStatistics = FieldStatistics(cachePath=str(path) + '.stats.npz', sourcePath=path)
+        self._statistics = self._seriesStatistics
+        self._prefetcher = SnapshotPrefetcher(self._snapshots, self.prefetchSnapshots, onLoad=self._onSnapshotLoaded)
+        self._playbackClock = 0.0
+        self.showSnapshot(0)
+
+    def _onSnapshotLoaded(self, snapshot):
+        # runs in a background thread of the prefetcher
+        if self.autoBounds:
+            self._seriesStatistics.addSnapshot(snapshot)
+
+    def showSnapshot(self, index):
+        """Show snapshot number index of the opened series, waits until it is read from disk."""
+        self._snapshotIndex = index % len(self._snapshots)
+        snapshot = self._prefetcher.get(self._snapshotIndex)
+        self.setParticles(snapshot=snapshot.index, **snapshot.arrays())
+        self._snapshotTime = snapshot.time
+        self._playbackClock = 0.0
+
+    def _updatePlayback(self, dt):
+        interpolate = self.interpolateSnapshots is not None and self._compactLayout is None and self.residency is None
+        if interpolate:
+            self._pollNextSnapshot()
+        if not self.playing:
+            return
+        self._playbackClock += dt * self.snapshotsPerSecond
+        if self._playbackClock < 1.0:
+            return
+        # never block the render thread, if the next snapshot is not loaded yet keep showing the current one
+        nextIndex = (self._snapshotIndex + 1) % len(self._snapshots)
+        if interpolate:
+            if not self._interpolationReady():
+                self._playbackClock = 1.0
+                return
+            # the next snapshot is already on the gpu and becomes the current one,
+            # the buffers of the current one receive the snapshot after it
+            snapshot = self._nextSnapshot
+            self._particles, self._nextParticles = self._nextParticles, self._particles
+            self._nextSnapshot = None
+            self._snapshotIndex = nextIndex
+            self._snapshotTime = snapshot.time
+            self._playbackClock = min(self._playbackClock - 1.0, 1.0)
+            self._pollNextSnapshot()
+            self._bindParticles()
+            self._particlesChanged(snapshot=snapshot.index, **snapshot.arrays())
+            return
+        snapshot = self._prefetcher.poll(nextIndex)
+        if snapshot is None:
+            self._playbackClock = 1.0
+            return
+        self.setParticles(snapshot=snapshot.index, **snapshot.arrays())
+        self._snapshotIndex = nextIndex
+        self._snapshotTime = snapshot.time
+        self._playbackClock = min(self._playbackClock - 1.0, 1.0)
+
+    def connectLiveFeed(self, name, notify=None):
+        """Show the frames a running simulation publishes with liveFeed.LiveFeedWriter under name. Every frame the
+        newest complete frame is copied out of shared memory once and uploaded, the simulation is never blocked.
+        notify is passed to the LiveFeedReader. With renderOnDemand the canvas redraws when a new frame arrives."""
+        self.disconnectLiveFeed()
+        self._liveFeed = LiveFeedReader(name, notify)
+        self._liveFeedTimer = app.Timer(1.0 / 120.0, connect=self._pollLiveFeed, start=True)
+        self.update()
+
+    def disconnectLiveFeed(self):
+        """stop showing the live feed, the particles of the last frame are kept"""
+        if self._liveFeed is None:
+            return
+        self._liveFeedTimer.stop()
+        self._liveFeed.close()
+        self._liveFeed = None
+        self._liveFeedTimer = None
+
+    def _pollLiveFeed(self, event):
+        if self._liveFeed.hasNewFrame():
+            self.update()
+
+    def _updateLiveFeed(self):
+        frame = self._liveFeed.latest()
+        if frame is not None:
+            # the reader copied the arrays out of shared memory, so features that keep them can do so
+            self.setParticles(**frame.arrays())
+
+    def setStatistics(self, statistics):
+        """Use statistics (a fieldStatistics.FieldStatistics) for autoBounds instead of the statistics of the particles
+        shown, eg. the statistics of all particles when this canvas renders only a part of them. They are kept when
+        the particles change, setStatistics(None) goes back to the statistics of the particles shown."""
+        self._givenStatistics = statistics
+        self.update()
+
+    def _updateBounds(self):
+        field = 'vectorMagnitude' if int(np.max(self.program['colorMode'])) == 2 else 'scalar'
+        statistics = self._statistics if self._givenStatistics is None else self._givenStatistics
+        bounds = statistics.bounds(field, *self.autoBoundsPercentiles)
+        if bounds is not None:
+            self.program['lowerBound'], self.program['upperBound'] = bounds
+
     def useAdditiveBlending(self, enable):
+        self._additiveBlending = enable
         if enable:
             gloo.set_blend_func('one','one')
             gloo.set_blend_equation('func_add')
@@ -175,19 +759,38 @@ class Canvas(app.Canvas):
 
     def on_mouse_move(self, event):
         self.camInputHandler.on_mouse_move(event)
+        if event.handled:
+            self.update()
+        elif self.enablePicking and self.pickOnHover:
+            self._pickAt(event.pos)
+
+    def on_mouse_release(self, event):
+        # a click is a release close to where the button was pressed, everything else moved the camera
+        if self.enablePicking and event.button == 1 and event.press_event is not None \
+                and np.max(np.abs(np.subtract(event.pos, event.press_event.pos))) <= 2:
+            self._pickAt(event.pos)
 
     def on_key_press(self, event):
         if event.key == 'R':
             self.resetCamera()
             event.handled = True
+        elif event.key in ('P', 'N', 'B') and self._snapshots is not None:
+            if event.key == 'P':
+                self.playing = not self.playing
+            else:
+                self.showSnapshot(self._snapshotIndex + (1 if event.key == 'N' else -1))
+            event.handled = True
         else:
             self.camInputHandler.on_key_pressed(event)
+        self.update()
 
     def on_key_release(self, event):
         self.camInputHandler.on_key_released(event)
+        self.update()
 
     def on_mouse_wheel(self, event):
         self.camInputHandler.on_mouse_wheel(event)
+        self.update()
 
     def _drawOrientationIndicator(self):
         gloo.set_state(line_width=5)
@@ -204,31 +807,357 @@ class Canvas(app.Canvas):
         self._oriProgram['view'] = glm.scale( self.cam.viewMatrix, glm.vec3(self.originIndicatorSize))
         self._oriProgram.draw('lines')
 
-    def on_draw(self, event):
+    def _drawIndexed(self):
+        """draw the particles selected by frustum culling and / or the filter, optionally in back to front order"""
+        culling, sorting, filtering = self._indexedDraw()
+        if filtering and not culling and not sorting:
+            # every cached filter has its own index buffer, so switching between filters uploads nothing
+            indices, count = self._currentFilter().indexBuffer(self._filterKey)
+            if count > 0:
+                self.program.draw('points', indices)
+            return
+
+        source = (culling, sorting, self._filterKey if filtering else None)
+        changed = self._drawIndicesSource != source
+        selections = []
+        if culling:
+            visibleIndices, cullingChanged = self._spatialIndex.visibleIndices(self.cam.viewMatrix, self._projection,
+                                                                               self._cullingMargin(), self.lodDistance)
+            changed = changed or cullingChanged
+            selections.append(visibleIndices)
+        if sorting:
+            order, sortingChanged = self.depthSorter.order(self.cam.viewMatrix)
+            changed = changed or sortingChanged
+
+        # only the index buffer is uploaded, the particle data stays as it is
+        if changed:
+            if filtering:
+                selections.append(self._currentFilter().indices(self._filterKey))
+            selected = None
+            if sorting or len(selections) > 1:
+                # particles in all selections
+                for indices in selections:
+                    mask = np.zeros(self._particles.count, dtype=bool)
+                    mask[indices] = True
+                    selected = mask if selected is None else selected & mask
+            if sorting:
+                # keep the sorted order, but only the selected particles
+                indices = order if selected is None else order[selected[order]]
+            else:
+                indices = selections[0] if selected is None else np.flatnonzero(selected).astype(np.uint32)
+            self._drawIndices.set_data(indices)
+            self._drawIndicesSource = source
+            self._drawIndexCount = len(indices)
+        if self._drawIndexCount == 0:
+            return
+        if sorting and not self._additiveBlending:
+            gloo.set_state(blend=True, blend_func=('src_alpha', 'one_minus_src_alpha'))
+            self.program.draw('points', self._drawIndices)
+            self.useAdditiveBlending(False)
+        else:
+            self.program.draw('points', self._drawIndices)
+
+    def _cullingMargin(self):
+        """how far a sprite can reach beyond its particle position"""
+        return max(float(np.max(self.program['sphereRadius'])), self._maxParticleRadius) \
+            * float(np.max(self.program['spriteScale']))
+
+    def _updateResidency(self):
+        """upload the chunks needed for the current view, _drawIndices then selects the particles to draw"""
+        indices, changed = self.residency.update(self.cam.viewMatrix, self._projection, self._cullingMargin())
+        if changed or self._drawIndicesSource != 'residency':
+            self._drawIndices.set_data(indices)
+            self._drawIndicesSource = 'residency'
+            self._drawIndexCount = len(indices)
+
+    def _periodicImages(self):
+        """model matrices of the periodic images in the view frustum, back to front when sorting and front to
+        back otherwise, or only the model matrix of the particles themselves if there is no periodicBox"""
+        if self.periodicBox is None:
+            return [self._model]
+        box = np.asarray(self.periodicBox, dtype=np.float64).reshape(3)
+        images = np.broadcast_to(np.asarray(self.periodicImages, dtype=np.int64), 3)
+        grid = np.meshgrid(*[np.arange(-count, count + 1) for count in images], indexing='ij')
+        offsets = np.stack(grid, axis=-1).reshape(-1, 3) * box
+        bounds = self._bounds()
+        lower, upper = bounds if bounds is not None else (np.zeros(3), box)
+
+        # planes in particle coordinates, so the bounds of every image can be tested without the model matrix
+        modelView = self._model @ glmToNumpy(self.cam.viewMatrix)
+        planes = frustumPlanes(modelView @ glmToNumpy(self._projection))
+        margin = self._cullingMargin()
+        offsets = offsets[boxesInFrustum(planes, lower + offsets - margin, upper + offsets + margin)]
+
+        # view space z of the image centers, the camera looks along -z
+        depth = (0.5 * (lower + upper) + offsets) @ modelView[:3, 2]
+        order = np.argsort(depth if self._indexedDraw()[1] else -depth, kind='stable')
+        return [translate(offset) @ self._model for offset in offsets[order]]
+
+    def _drawParticles(self):
+        if self.residency is not None:
+            if self._drawIndexCount > 0:
+                self.program.draw('points', self._drawIndices)
+        elif any(self._indexedDraw()):
+            self._drawIndexed()
+        elif self._activeRenderPath == 'instanced':
+            self.program.draw('triangle_strip')
+        else:
+            self.program.draw('points')
+
+    def _drawTrails(self):
+        """draw the positions in self.trails as lines or spheres, see trailMode"""
+        if self.trailMode not in ('lines', 'spheres'):
+            raise ValueError("trailMode must be None, 'lines' or 'spheres', got " + repr(self.trailMode))
+        if self.trailMode == 'lines':
+            if self._trailProgram is None:
+                self._trailProgram = Program(loadShader('trail.vert'), loadShader('trail.frag'))
+            for name in ('model', 'view', 'projection', 'defaultColor', 'colorMode', 'lowerBound', 'upperBound',
+                         'customTransferFunc', 'transferFunc', 'brightness'):
+                self._trailProgram[name] = self.program[name]
+            self.trails.bindLines(self._trailProgram)
+            gloo.set_state(blend=True, blend_func=('src_alpha', 'one_minus_src_alpha'), line_width=self.trailLineWidth)
+            self._trailProgram.draw('lines', self.trails.lineIndices())
+            self.useAdditiveBlending(self._additiveBlending)
+        else:
+            # the particle program draws the whole ring, then gets the particles back
+            instanced = self._activeRenderPath == 'instanced'
+            self.trails.bindSpheres(self.program, float(np.max(self.program['sphereRadius'])), 1 if instanced else None)
+            self.program.draw('triangle_strip' if instanced else 'points')
+            self.program['trailLength'] = 0
+            self._bindParticles()
+
+    def _drawDensity(self, images):
+        """aggregated rendering of the particles with every model matrix in images, see densityMode"""
+        if self.densityMode not in DENSITY_MODES:
+            raise ValueError("densityMode must be one of {}, got {!r}".format(DENSITY_MODES, self.densityMode))
+        if self.densityScaling not in DENSITY_SCALINGS:
+            raise ValueError("densityScaling must be one of {}, got {!r}"
+                             .format(DENSITY_SCALINGS, self.densityScaling))
+        mode = DENSITY_MODES.index(self.densityMode)
+        size = tuple(self.physical_size)
+        blockSize, reducedSize = reductionSize(size)
+        if self._densityTargetSize != size:
+            accumulated = gloo.Texture2D(shape=(size[1], size[0], 4), format='rgba', internalformat='rgba32f',
+                                         interpolation='nearest')
+            self._densityTarget = gloo.FrameBuffer(color=accumulated)
+            self._reduceTarget = gloo.FrameBuffer(color=gloo.Texture2D(shape=(reducedSize[1], reducedSize[0], 4),
+                                                                       format='rgba', internalformat='rgba32f'))
+            self._reduceProgram['accumulated'] = accumulated
+            self._resolveProgram['accumulated'] = accumulated
+            self._densityTargetSize = size
+
+        # count particles and sum up their scalars per pixel with additive blending into a float framebuffer
+        self._densityProgram['view'] = self.cam.viewMatrix
+        with self._densityTarget:
+            gloo.set_viewport(0, 0, *size)
+            gloo.clear(color=(0, 0, 0, 0))
+            gloo.set_state(blend=True, depth_test=False, blend_func=('one', 'one'), blend_equation='func_add')
+            for model in images:
+                self._densityProgram['model'] = model
+                if self.residency is not None:
+                    if self._drawIndexCount > 0:
+                        self._densityProgram.draw('points', self._drawIndices)
+                elif self._indexedDraw()[2]:
+                    indices, count = self._currentFilter().indexBuffer(self._filterKey)
+                    if count > 0:
+                        self._densityProgram.draw('points', indices)
+                else:
+                    self._densityProgram.draw('points')
+
+        # scaling needs the range (or the distribution) of all pixels. The gpu reduces the image to a few
+        # thousand blocks, which are read back without waiting, so the range of an earlier frame is used
+        with self._reduceTarget:
+            gloo.set_viewport(0, 0, *reducedSize)
+            gloo.set_state(blend=False, depth_test=False)
+            self._reduceProgram['blockSize'] = blockSize
+            self._reduceProgram['densityMode'] = mode
+            self._reduceProgram.draw('triangle_strip')
+            self.context.flush_commands()
+            self._densityReadback.start(reducedSize, mode)
+        gloo.set_viewport(0, 0, *size)
+        # only the first frame of a mode waits for its range
+        waitForRange = self._densityScale is None or self._densityScale[0] != mode
+        readback = self._densityReadback.latest(wait=waitForRange)
+        if readback is not None and readback[0] == mode:
+            self._densityScale = (mode, scalingFromReduction(readback[1]))
+        scale = self._densityScale[1] if self._densityScale is not None and self._densityScale[0] == mode else None
+        if scale is None:
+            # no particles on the screen, every pixel is discarded anyway
+            scale = (0.0, 1.0, np.zeros(1, dtype=np.float32))
+        low, high, table = scale
+        self._equalizeTable.set_data(table[:, np.newaxis])
+
+        # scale and color with the transfer function of the particle program
+        self._resolveProgram['densityMode'] = mode
+        self._resolveProgram['densityScaling'] = DENSITY_SCALINGS.index(self.densityScaling)
+        self._resolveProgram['densityLow'] = low
+        self._resolveProgram['densityHigh'] = high
+        for name in ('transferFunc', 'customTransferFunc', 'brightness'):
+            self._resolveProgram[name] = self.program[name]
+        gloo.set_state(blend=False, depth_test=False)
+        self._resolveProgram.draw('triangle_strip')
+        self.useAdditiveBlending(self._additiveBlending)
+
+    def _drawScene(self, dt):
+        self.profiler.beginFrame()
+
         # clear window content
-        gloo.clear(color=True, depth=True)
+        gloo.clear(color=self.backgroundColor, depth=True)
+
+        # update camera and view matrix
+        with self.profiler.stage('camera'):
+            self.camInputHandler.on_draw(dt)
+            cameraMoved = self.cam.update(dt)
+
+        # advance snapshot playback
+        if self._snapshots is not None:
+            with self.profiler.stage('playback'):
+                self._updatePlayback(dt)
+
+        # show the newest frame of a running simulation
+        if self._liveFeed is not None:
+            with self.profiler.stage('liveFeed'):
+                self._updateLiveFeed()
+
+        with self.profiler.stage('uniforms'):
+            if cameraMoved:
+                self.program['view'] = self.cam.viewMatrix
+            # statistics of snapshots are computed in the background, so check for new bounds every frame
+            if self.autoBounds:
+                self._updateBounds()
+            self._setInterpolationUniforms()
+
+        # draw particles, the gpu time covers all shader stages of the particle renderer
+        images = [self._model]
+        if self._particles.count > 0:
+            with self.profiler.stage('particles', gpu=True):
+                self._buildMissingIndexes()
+                self._useRenderPath()
+                if self.residency is not None:
+                    self._updateResidency()
+                images = self._periodicImages()
+                if self.densityMode is not None:
+                    self._drawDensity(images)
+                else:
+                    for model in images:
+                        self.program['model'] = model
+                        self._drawParticles()
+
+        if self.trails is not None and self.trailMode is not None and self.trails.filled > 1 \
+                and self.densityMode is None:
+            with self.profiler.stage('trails', gpu=True):
+                for model in images:
+                    self.program['model'] = model
+                    self._drawTrails()
+
+        # draw orientation indicator
+        with self.profiler.stage('indicators', gpu=True):
+            if self.enableOrientationIndicator:
+                self._drawOrientationIndicator()
+            if self.enableOriginIndicator:
+                self._drawOriginIndicator()
 
+        if self.showProfilerOverlay:
+            self._drawProfilerOverlay()
+
+        self.profiler.endFrame()
+
+    def _drawProfilerOverlay(self):
+        if self._profilerText is None:
+            from vispy.visuals import TextVisual
+            self._profilerText = TextVisual('', color='white', font_size=8, anchor_x='left', anchor_y='top')
+        # refreshing the text every frame would cost more than what we measure
+        if self.profiler.frame % 30 == 0:
+            self._profilerText.text = self.profiler.summary() \
+                + ('' if self.residency is None else '\n' + self.residency.summary())
+        self._profilerText.pos = (10, 10)
+        self._profilerText.transforms.configure(canvas=self, viewport=(0, 0) + tuple(self.physical_size))
+        self._profilerText.draw()
+        self.useAdditiveBlending(self._additiveBlending)
+
+    def on_draw(self, event):
         # calculate dt (time since last frame)
         newTime = time.time()
         dt = newTime - self._lastTime
         self._lastTime = newTime
 
-        # update camera and view matrix
-        self.camInputHandler.on_draw(dt)
-        self.cam.update(dt)
-        self.program['view'] = self.cam.viewMatrix
+        if self.renderOnDemand:
+            # after being idle dt can be large, which would make the camera overshoot
+            dt = min(dt, 0.1)
 
-        # draw particles
-        self.program.draw('points')
-
-        # draw orientation indicator
-        if self.enableOrientationIndicator:
-            self._drawOrientationIndicator()
-        if self.enableOriginIndicator:
-            self._drawOriginIndicator()
+        self._drawScene(dt)
+        if self._capture is not None:
+            self._captureFrame()
 
         # update window content
-        self.update()
+        if not self.renderOnDemand or self._needsRedraw():
+            self.update()
+
+    def _needsRedraw(self):
+        """True if the next frame will look different even without new input or data"""
+        return not self.cam.isConverged() or self.camInputHandler.isActive() or self.playing \
+            or self.showProfilerOverlay or (self.residency is not None and self.residency.uploadedBytes > 0)
+
+    def renderOffscreen(self, dt=0.0, read=True, depth=False):
+        """Render one frame into an offscreen framebuffer and return it as numpy array of shape (height, width, 4).
+        Works without a window, eg. with the osmesa backend (see headless.py).
+        With read=False nothing is returned, instead it waits for the gpu to finish (used for benchmarks).
+        With depth=True (color, depth) is returned, depth is a float32 array (height, width) of window space depth
+        in [0,1], eg. for compositing images of several renderers (see compositing.py)."""
+        self.set_current()
+        size = tuple(self.physical_size)
+        if self._offscreenSize != size:
+            shape = (size[1], size[0])
+            self._offscreen = gloo.FrameBuffer(color=gloo.RenderBuffer(shape),
+                                               depth=gloo.RenderBuffer(shape, format='depth'))
+            self._offscreenSize = size
+        with self._offscreen:
+            gloo.set_viewport(0, 0, *size)
+            self._drawScene(dt)
+            if self._capture is not None:
+                self._captureFrame()
+            if not read:
+                gloo.finish()
+                return None
+            if depth:
+                # gloo can only read colors, the depth is read directly after the queued commands were executed
+                self.context.flush_commands()
+                raw = gloo.gl.glReadPixels(0, 0, size[0], size[1], gloo.gl.GL_DEPTH_COMPONENT, gloo.gl.GL_FLOAT)
+                depthImage = np.frombuffer(raw, dtype=np.float32).reshape(size[1], size[0])[::-1].copy()
+                return self._offscreen.read(), depthImage
+            return self._offscreen.read()
+
+    def startCapture(self, outputPattern=None, command=None, buffers=3, workers=4):
+        """Record every drawn frame (in the window or with renderOffscreen()) until stopCapture() is called.
+        Frames are read back asynchronously and encoded in worker threads, either into png files named by
+        outputPattern (eg. 'frame_{:05d}.png') or piped as raw rgba into command, see frameCapture.ffmpegCommand()."""
+        self.stopCapture()
+        self._capture = FrameCapture(outputPattern, command, buffers, workers)
+
+    def stopCapture(self):
+        """Wait until all captured frames are written, returns the exit code of the encoder command if one is used"""
+        if self._capture is None:
+            return None
+        self.set_current()
+        result = self._capture.close()
+        self._capture = None
+        return result
+
+    def _captureFrame(self):
+        # the draw commands are queued by vispy, they have to be executed before the readback is started
+        self.context.flush_commands()
+        self._capture.capture(self.physical_size)
+
+    def on_close(self, event):
+        self.stopCapture()
+        self._densityReadback.close()
+        self.profiler.close()
+        self.disconnectLiveFeed()
+        self._setDepthSorter(None)
+        self._setPickTree(None)
+        if self._snapshots is not None:
+            self._prefetcher.close()
+            self._seriesStatistics.save()
 
     def on_resize(self, event):
         self.resetProjection()
@@ -239,6 +1168,7 @@ class Canvas(app.Canvas):
         aspect = self.size[0] / float(self.size[1])
         self._projection = perspective(self.fov, aspect, self.nearDistance, self.farDistance)
         self.program['projection'] = self._projection
+        self._densityProgram['projection'] = self._projection
 
         # calculate projection for the orientation indicator in the lower left
         orthoScale = 1/500
@@ -0,0 +1,197 @@
+"""Offscreen rendering benchmark, run "python benchmark.py --help" for options.
+Renders synthetic particle sets with every render mode of the particle shader and writes
+frame times, particle throughput and upload throughput as json.
+With --startup the time to import the viewer and draw the first frame is measured in fresh processes,
+without program cache, with an empty cache and with a filled cache."""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# settings changed by each mode, applied on top of the defaults of the canvas
+MODES = {
+    'spheres': {},
+    'geometryShader': {'renderPath': 'geometry'},
+    'instancedQuads': {'renderPath': 'instanced'},
+    'flatDisks': {'renderFlatDisks': True},
+    'flatDisksFalloff': {'renderFlatDisks': True, 'flatFalloff': True},
+    'texture': {'useTexture': True},
+    'edgeHighlights': {'enableEdgeHighlights': True},
+    'additiveBlending': {'additiveBlending': True},
+    'sizePerParticle': {'enableSizePerParticle': True},
+    'colorMode0': {'colorMode': 0},
+    'colorMode1': {'colorMode': 1},
+    'colorMode2': {'colorMode': 2},
+    'colorMode3': {'colorMode': 3},
+    'densityCount': {'densityMode': 'count'},
+    'densityMeanScalar': {'densityMode': 'meanScalar', 'densityScaling': 'equalize'},
+}
+
+DEFAULT_COUNTS = [1000, 10000, 100000, 1000000, 10000000, 100000000]
+
+
+def syntheticParticles(count, seed=0):
+    """uniformly distributed particles in [-1,1]^3 with random vectors, scalars and radii"""
+    rng = np.random.default_rng(seed)
+    position = rng.random((count, 3), dtype=np.float32) * 2.0 - 1.0
+    vector = rng.standard_normal((count, 3), dtype=np.float32)
+    scalar = rng.random(count, dtype=np.float32)
+    # keep the volume covered by all particles roughly constant
+    meanRadius = float(0.25 / np.cbrt(count))
+    radius = (0.5 + rng.random(count, dtype=np.float32)) * meanRadius
+    return {'position': position, 'vector': vector, 'scalar': scalar, 'radius': radius}
+
+
+def _applyMode(canvas, mode, count):
+    defaults = {'renderFlatDisks': False, 'flatFalloff': False, 'useTexture': False, 'enableEdgeHighlights': False,
+                'enableSizePerParticle': False, 'colorMode': 3}
+    settings = dict(defaults, **MODES[mode])
+    canvas.useAdditiveBlending(settings.pop('additiveBlending', False))
+    canvas.renderPath = settings.pop('renderPath', 'auto')
+    canvas.densityMode = settings.pop('densityMode', None)
+    canvas.densityScaling = settings.pop('densityScaling', 'log')
+    for name, value in settings.items():
+        canvas.program[name] = value
+    canvas.program['sphereRadius'] = 0.25 / np.cbrt(count)
+    canvas.program['lowerBound'] = 0.0
+    canvas.program['upperBound'] = 1.0 if settings['colorMode'] != 2 else 3.0
+
+
+def _environment():
+    from vispy import gloo
+    import vispy
+    gl = gloo.gl
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'vispy': vispy.__version__,
+            'platform': platform.platform(),
+            'glRenderer': gl.glGetParameter(gl.GL_RENDERER), 'glVersion': gl.glGetParameter(gl.GL_VERSION)}
+
+
+def runBenchmark(canvas, counts=DEFAULT_COUNTS, modes=MODES, frames=50, warmup=5):
+    """Benchmark an offscreen canvas, returns a list with one dict of results per particle count and mode."""
+    from vispy import gloo
+    results = []
+    for count in counts:
+        data = syntheticParticles(count)
+        uploadBytes = sum(array.nbytes for array in data.values())
+
+        # upload, twice so the second one measures an update of existing buffers
+        canvas.setParticles(**data)
+        canvas.renderOffscreen(read=False)
+        start = time.perf_counter()
+        canvas.setParticles(**data)
+        gloo.finish()
+        uploadSeconds = time.perf_counter() - start
+
+        for mode in modes:
+            _applyMode(canvas, mode, count)
+            for i in range(warmup):
+                canvas.renderOffscreen(read=False)
+            frameTimes = np.empty(frames)
+            for i in range(frames):
+                start = time.perf_counter()
+                canvas.renderOffscreen(read=False)
+                frameTimes[i] = time.perf_counter() - start
+            medianSeconds = float(np.median(frameTimes))
+            results.append({'particles': count, 'mode': mode, 'frames': frames,
+                            'msPerFrame': medianSeconds * 1e3,
+                            'msPerFrameP95': float(np.percentile(frameTimes, 95)) * 1e3,
+                            'particlesPerSecond': count / medianSeconds,
+                            'uploadSeconds': uploadSeconds,
+                            'uploadBytesPerSecond': uploadBytes / uploadSeconds})
+            print('{:>10} {:<18} {:8.2f} ms/frame  {:10.3g} particles/s'
+                  .format(count, mode, results[-1]['msPerFrame'], results[-1]['particlesPerSecond']), file=sys.stderr)
+        del data
+    return results
+
+
+# runs in a fresh python process, prints the timings as json
+_STARTUP_SCRIPT = """
+import json, os, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {directory!r})
+if {backend!r} == 'osmesa':
+    os.environ.setdefault('PYOPENGL_PLATFORM', 'osmesa')
+from vispy import app
+if {backend!r}:
+    app.use_app({backend!r})
+from ParticleVis import Canvas
+imported = time.perf_counter()
+canvas = Canvas(size={size!r}, show=False, programCache={programCache!r})
+created = time.perf_counter()
+canvas.renderOffscreen(read=False)
+drawn = time.perf_counter()
+print(json.dumps({{'importSeconds': imported - start, 'canvasSeconds': created - imported,
+                  'firstFrameSeconds': drawn - created, 'totalSeconds': drawn - start}}))
+"""
+
+
+def measureStartup(runs=5, size=(1920, 1080), backend=None):
+    """Start the viewer runs times for every cache state, each in a new process, returns a list of timing dicts.
+    The processes run in a temporary working directory with their own program cache. The drivers own shader cache
+    is disabled where possible (mesa), so 'uncached' really compiles."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    with tempfile.TemporaryDirectory() as workingDirectory:
+        environment = dict(os.environ, PARTICLEVIS_CACHE=os.path.join(workingDirectory, 'cache'),
+                           MESA_SHADER_CACHE_DISABLE='true')
+        # the first cached run fills the cache, so it is the cold start
+        for state, programCache, count in (('uncached', False, runs), ('cold', True, 1), ('warm', True, runs)):
+            for i in range(count):
+                script = _STARTUP_SCRIPT.format(directory=directory, backend=backend, size=tuple(size),
+                                                programCache=programCache)
+                output = subprocess.run([sys.executable, '-c', script], cwd=workingDirectory, env=environment,
+                                        check=True, capture_output=True, text=True).stdout
+                results.append(dict(json.loads(output.strip().splitlines()[-1]), cache=state))
+                print('{:<9} {:8.3f} s total  {:8.3f} s import  {:8.3f} s canvas  {:8.3f} s first frame'
+                      .format(state, results[-1]['totalSeconds'], results[-1]['importSeconds'],
+                              results[-1]['canvasSeconds'], results[-1]['firstFrameSeconds']), file=sys.stderr)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--counts', type=float, nargs='*', default=DEFAULT_COUNTS,
+                        help='particle counts to test, pass no value to skip the render benchmark')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES), help='render modes to test')
+    parser.add_argument('--frames', type=int, default=50, help='frames measured per count and mode')
+    parser.add_argument('--size', type=int, nargs=2, default=(1920, 1080), help='framebuffer width and height')
+    parser.add_argument('--backend', default=None, help='vispy backend, eg. osmesa for machines without display')
+    parser.add_argument('--output', default='-', help='json file to write, - for stdout')
+    parser.add_argument('--startup', type=int, default=0, metavar='RUNS',
+                        help='also measure the startup time, RUNS times per cache state')
+    args = parser.parse_args(argv)
+
+    # measured first, so nothing is loaded yet in this process
+    startup = measureStartup(args.startup, args.size, args.backend) if args.startup > 0 else None
+
+    if args.backend == 'osmesa':
+        os.environ.setdefault('PYOPENGL_PLATFORM', 'osmesa')
+    from vispy import app
+    if args.backend:
+        app.use_app(args.backend)
+    from ParticleVis import Canvas
+
+    canvas = Canvas(size=tuple(args.size), show=False)
+    canvas.enableOrientationIndicator = False
+    canvas.enableOriginIndicator = False
+    canvas.set_current()
+    report = {'environment': _environment(), 'size': list(args.size),
+              'results': runBenchmark(canvas, [int(c) for c in args.counts], args.modes, args.frames)}
+    if startup is not None:
+        report['startup'] = startup
+
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
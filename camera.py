@@ -20,6 +20,7 @@ class Camera:
         self.worldUp = worldUp  # worlds up vector
         self.mode = mode  # 0 = trackball, 1 = first person
         self.movementSpeedMod = 1.0  # temporary modified movement speed, will be reset every frame
+        self.convergenceTolerance = 1e-5  # camera snaps to the desired position / orientation when closer than this
 
         # cameras internal state (DO NOT WRITE)
         self._movementInput = glm.vec3(0)
@@ -34,6 +35,26 @@ class Camera:
         # variables depending on state, they are automatically updated when calling the Camera.update() (DO NOT WRITE, only read)
         self.modelMatrix = self._currentTransform.mat4()
         self.viewMatrix = glm.inverse(self.modelMatrix)
+        self._matrixTransform = self._copyTransform(self._currentTransform)  # transform the matrices were computed from
+
+    @staticmethod
+    def _copyTransform(transform):
+        return Transform(glm.vec3(transform.position), glm.quat(transform.orientation), glm.vec3(transform.scale))
+
+    def _isClose(self, a, b):
+        """compare transforms using convergenceTolerance (relative for positions)"""
+        # for small angles the distance between two unit quaternions is about half the angle between them
+        quatDistance = min(glm.length(a.orientation - b.orientation), glm.length(a.orientation + b.orientation))
+        scale = max(1.0, glm.length(b.position))
+        return glm.distance(a.position, b.position) <= self.convergenceTolerance * scale \
+            and 2.0 * quatDistance <= self.convergenceTolerance
+
+    def isConverged(self):
+        """True if the current transform reached the desired one within convergenceTolerance (relative distance
+        and angle), meaning the camera will not move anymore without new input"""
+        scale = max(1.0, abs(self._desiredTargetDistance))
+        return self._isClose(self._currentTransform, self._desiredTransform) \
+            and abs(self._currentTargetDistance - self._desiredTargetDistance) <= self.convergenceTolerance * scale
 
     def setTarget(self, target, interpolate=False):
         """Use to set a point where the camera should look. Target is expected to be a glm.vec3,
@@ -53,6 +74,15 @@ class Camera:
         if not interpolate:
             self._currentTransform.position = newPos
 
+    def setViewMatrix(self, view, interpolate=False):
+        """Use to place the camera according to a view matrix (glm.mat4), eg one computed by a CameraPath.
+        Interpolate is a bool, set it to true to produce an animated camera movement"""
+        model = glm.inverse(view)
+        self.setPosition(glm.vec3(model[3]), interpolate)
+        self._desiredTransform.orientation = glm.normalize(glm.quat_cast(glm.mat3(model)))
+        if not interpolate:
+            self._currentTransform.orientation = self._desiredTransform.orientation
+
     def rotateH(self, dPhi):
         self._rotationInput.x += dPhi * (self.fpsRotationSpeed if self.mode == 1 else self.tbRotationSpeed)
 
@@ -84,6 +114,7 @@ class Camera:
             self._movementInput.z -= dz * self.zoomSpeed
 
     def update(self, deltaTime):
+        """advance the camera by deltaTime seconds, returns True if the view matrix changed"""
         # movement in camera coordinates
         movement = self._currentTransform.orientation * (self._movementInput * self.movementSpeedMod)
 
@@ -143,14 +174,27 @@ class Camera:
             self._currentTransform.orientation = glm.slerp(self._currentTransform.orientation, self._desiredTransform.orientation,
                                                            glm.pow(deltaTime, self.rotationSmoothing))
 
-        self.modelMatrix = self._currentTransform.mat4()
-        self.viewMatrix = glm.inverse(self.modelMatrix)
+        # close enough (or the interpolation got stuck due to float precision),
+        # jump to the desired transform so the camera comes to rest. Without time passing nothing moves, that is
+        # not being stuck
+        if self.isConverged() or (deltaTime > 0 and self._isClose(self._currentTransform, self._matrixTransform)):
+            self._currentTransform = self._copyTransform(self._desiredTransform)
+            self._currentTargetDistance = self._desiredTargetDistance
+
+        # matrices are only recomputed when the transform changed
+        changed = not self._isClose(self._currentTransform, self._matrixTransform)
+        if changed:
+            self.modelMatrix = self._currentTransform.mat4()
+            self.viewMatrix = glm.inverse(self.modelMatrix)
+            self._matrixTransform = self._copyTransform(self._currentTransform)
+
         self._rotationInput.x = 0
         self._rotationInput.y = 0
         self._movementInput.x = 0
         self._movementInput.y = 0
         self._movementInput.z = 0
         self.movementSpeedMod = 1.0
+        return changed
 
 
 class CameraKeyInputs(Enum):
@@ -180,6 +224,12 @@ class CameraKeyInputs(Enum):
     ZOOM_OUT = 21
 
 
+# inputs that only change how other inputs act, holding them alone does not move the camera
+_MODIFIER_INPUTS = {CameraKeyInputs.ENABLE_MOUSE_ROTATION, CameraKeyInputs.ENABLE_MOUSE_PAN,
+                    CameraKeyInputs.SWITCH_INPUT_MODE, CameraKeyInputs.MOVE_FAST, CameraKeyInputs.MOVE_SLOW,
+                    CameraKeyInputs.INCREASE_SPEED, CameraKeyInputs.DECREASE_SPEED}
+
+
 class CameraInputHandler:
     """Moves the camera depending on mouse and keyboard input."""
     def __init__(self, camera, keyMap=None, enableMouseRotation=True, enableMousePan=True, enableMouseZoom=True, rotateMouseButton=1, panMouseButton=3):
@@ -245,6 +295,10 @@ class CameraInputHandler:
             self.camera.zoom(event.delta[1]*10)
             event.handled = True
 
+    def isActive(self):
+        """True while a key is held down that moves the camera every frame"""
+        return any(down for function, down in self._keyDown.items() if function not in _MODIFIER_INPUTS)
+
     def changeMovementSpeed(self, change):
         self.camera.moveSpeed = self.camera.moveSpeed + change * 0.025 * (self.camera.moveSpeed + sys.float_info.min)
         self.camera.panSpeed = self.camera.panSpeed + change * 0.025 * (self.camera.panSpeed + sys.float_info.min)
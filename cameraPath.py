@@ -0,0 +1,151 @@
+import glm
+import numpy as np
+
+from transform import Transform
+
+
+def _hermite(times, values, t):
+    """evaluate a cubic hermite spline through values (k,3) at times (k,) with catmull rom tangents at t (n,)"""
+    if len(times) == 1:
+        return np.repeat(values[:1], len(t), axis=0)
+    # tangents, central differences inside, one sided at the ends
+    tangents = np.empty_like(values)
+    tangents[1:-1] = (values[2:] - values[:-2]) / (times[2:] - times[:-2])[:, np.newaxis]
+    tangents[0] = (values[1] - values[0]) / (times[1] - times[0])
+    tangents[-1] = (values[-1] - values[-2]) / (times[-1] - times[-2])
+
+    segment = np.clip(np.searchsorted(times, t, side='right') - 1, 0, len(times) - 2)
+    dt = times[segment + 1] - times[segment]
+    u = ((t - times[segment]) / dt)[:, np.newaxis]
+    dt = dt[:, np.newaxis]
+    u2 = u * u
+    u3 = u2 * u
+    return (2 * u3 - 3 * u2 + 1) * values[segment] + (u3 - 2 * u2 + u) * dt * tangents[segment] \
+        + (-2 * u3 + 3 * u2) * values[segment + 1] + (u3 - u2) * dt * tangents[segment + 1]
+
+
+def _slerp(times, quats, t):
+    """spherical linear interpolation of quaternions (k,4) in w,x,y,z order at times t (n,)"""
+    if len(times) == 1:
+        return np.repeat(quats[:1], len(t), axis=0)
+    segment = np.clip(np.searchsorted(times, t, side='right') - 1, 0, len(times) - 2)
+    u = np.clip((t - times[segment]) / (times[segment + 1] - times[segment]), 0.0, 1.0)[:, np.newaxis]
+    a = quats[segment]
+    b = quats[segment + 1]
+    cosTheta = np.sum(a * b, axis=1, keepdims=True)
+    # take the short way around
+    b = np.where(cosTheta < 0, -b, b)
+    cosTheta = np.abs(cosTheta)
+    theta = np.arccos(np.clip(cosTheta, -1.0, 1.0))
+    sinTheta = np.sin(theta)
+    # fall back to linear interpolation when the quaternions are almost equal
+    nearlyEqual = sinTheta < 1e-6
+    safeSin = np.where(nearlyEqual, 1.0, sinTheta)
+    wa = np.where(nearlyEqual, 1.0 - u, np.sin((1.0 - u) * theta) / safeSin)
+    wb = np.where(nearlyEqual, u, np.sin(u * theta) / safeSin)
+    result = wa * a + wb * b
+    return result / np.linalg.norm(result, axis=1, keepdims=True)
+
+
+def _quatToMatrix(q):
+    """rotation matrices (n,3,3) from quaternions (n,4) in w,x,y,z order, columns are the rotated axes"""
+    w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    m = np.empty((len(q), 3, 3))
+    m[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    m[:, 0, 1] = 2 * (x * y - w * z)
+    m[:, 0, 2] = 2 * (x * z + w * y)
+    m[:, 1, 0] = 2 * (x * y + w * z)
+    m[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    m[:, 1, 2] = 2 * (y * z - w * x)
+    m[:, 2, 0] = 2 * (x * z - w * y)
+    m[:, 2, 1] = 2 * (y * z + w * x)
+    m[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    return m
+
+
+def _lookAtMatrix(position, target, worldUp):
+    """rotation matrices (n,3,3) of cameras at position looking at target (both (n,3)), columns are right, up, back"""
+    forward = target - position
+    forward /= np.linalg.norm(forward, axis=1, keepdims=True)
+    right = np.cross(forward, worldUp)
+    right /= np.linalg.norm(right, axis=1, keepdims=True)
+    up = np.cross(right, forward)
+    return np.stack((right, up, -forward), axis=2)
+
+
+class CameraPath:
+    """A camera flight defined by keyframes. The path is evaluated for all frames at once,
+    positions and targets are interpolated with a cubic spline, orientations with slerp."""
+
+    def __init__(self, worldUp=glm.vec3(0, 1, 0)):
+        self.worldUp = worldUp  # up vector used when orientations are computed from targets
+        self._times = []
+        self._positions = []
+        self._targets = []
+        self._orientations = []
+
+    def __len__(self):
+        return len(self._times)
+
+    def addKeyframe(self, time, position, target=None, orientation=None):
+        """Add a keyframe at time. position and target are glm.vec3 or 3 floats, orientation is a glm.quat.
+        If every keyframe has a target, the target is interpolated smoothly and the camera looks at it,
+        otherwise the camera orientation is interpolated, targets are then only used to compute the orientation."""
+        if target is None and orientation is None:
+            raise ValueError("keyframe needs a target or an orientation")
+        if self._times and time <= self._times[-1]:
+            raise ValueError("keyframes have to be added in order of time")
+        position = glm.vec3(*position)
+        if orientation is None:
+            transform = Transform(position)
+            transform.lookAt(glm.vec3(*target), glm.vec3(self.worldUp))
+            orientation = transform.orientation
+        self._times.append(float(time))
+        self._positions.append(tuple(position))
+        self._targets.append(None if target is None else tuple(glm.vec3(*target)))
+        self._orientations.append((orientation.w, orientation.x, orientation.y, orientation.z))
+
+    def addCameraKeyframe(self, time, camera):
+        """add the current position and orientation of a Camera as keyframe"""
+        self.addKeyframe(time, camera._currentTransform.position, orientation=camera._currentTransform.orientation)
+
+    def frameTimes(self, frames):
+        """times of frames evenly spaced frames from the first to the last keyframe"""
+        return np.linspace(self._times[0], self._times[-1], frames)
+
+    def evaluate(self, times):
+        """Returns positions (n,3) and rotation matrices (n,3,3) (columns are camera right, up, back)
+        of the camera at all times (n,)."""
+        if not self._times:
+            raise ValueError("camera path has no keyframes")
+        times = np.asarray(times, dtype=np.float64).reshape(-1)
+        keyTimes = np.array(self._times)
+        positions = _hermite(keyTimes, np.array(self._positions), times)
+        if all(target is not None for target in self._targets):
+            targets = _hermite(keyTimes, np.array(self._targets), times)
+            rotations = _lookAtMatrix(positions, targets, np.array(tuple(self.worldUp), dtype=np.float64))
+        else:
+            rotations = _quatToMatrix(_slerp(keyTimes, np.array(self._orientations), times))
+        return positions, rotations
+
+    def modelMatrices(self, times):
+        """camera model matrices (n,4,4) at all times (n,) in vispy layout (see transform.glmToNumpy)"""
+        positions, rotations = self.evaluate(times)
+        model = np.zeros((len(positions), 4, 4))
+        model[:, :3, :3] = np.transpose(rotations, (0, 2, 1))
+        model[:, 3, :3] = positions
+        model[:, 3, 3] = 1.0
+        return model
+
+    def viewMatrices(self, times):
+        """view matrices (n,4,4) at all times (n,) in vispy layout, ready to be used as the 'view' uniform"""
+        positions, rotations = self.evaluate(times)
+        view = np.zeros((len(positions), 4, 4))
+        view[:, :3, :3] = rotations
+        view[:, 3, :3] = -np.einsum('ni,nij->nj', positions, rotations)
+        view[:, 3, 3] = 1.0
+        return view
+
+    def frameJobs(self, frames):
+        """list of frame jobs for headless.renderFrames(), one per frame"""
+        return [{'view': view} for view in self.viewMatrices(self.frameTimes(frames))]
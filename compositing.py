@@ -0,0 +1,276 @@
+"""Sort-last parallel rendering: the particles are split among worker processes, every worker renders its part
+with the same camera into color and depth, and the images are merged by a per pixel depth test.
+Workers are local processes or servers on other machines started with serveWorker(). Depth compositing is exact
+for opaque particles, transparency and additive blending need all particles in one renderer."""
+import itertools
+import multiprocessing
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener, wait
+
+import numpy as np
+
+from fieldStatistics import FieldStatistics
+
+# keys of headless.applyFrameJob() a parallel frame job may use, all workers get the same job so it can only move
+# the camera. Data like a 'snapshot' would be loaded completely by every worker instead of its part
+_CAMERA_KEYS = ('position', 'target', 'view')
+
+def compositeDepth(color, depth, otherColor, otherDepth):
+    """Merge otherColor / otherDepth into color / depth in place, at every pixel the one closer to the camera
+    (smaller depth) wins. Colors are (h,w,4), depths (h,w) arrays."""
+    closer = otherDepth < depth
+    np.copyto(depth, otherDepth, where=closer)
+    np.copyto(color, otherColor, where=closer[..., np.newaxis])
+
+
+class DepthCompositor:
+    """Merges the images of all workers for one frame. Images are merged as soon as they arrive, each thread
+    works on its own band of rows, so the merging of one image is spread over all cores."""
+
+    def __init__(self, threads=4):
+        self.threads = threads
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='DepthCompositor')
+        self.color = None
+        self.depth = None
+
+    def begin(self):
+        self.color = None
+        self.depth = None
+
+    def add(self, color, depth):
+        if self.color is None:
+            # the first image is used as it is, images received from workers belong to nobody else
+            self.color = np.asarray(color) if color.flags.writeable else color.copy()
+            self.depth = np.asarray(depth) if depth.flags.writeable else depth.copy()
+            return
+        edges = np.linspace(0, len(self.depth), self.threads + 1).astype(np.int64)
+        bands = [slice(start, end) for start, end in zip(edges[:-1], edges[1:]) if end > start]
+        list(self._executor.map(lambda rows: compositeDepth(self.color[rows], self.depth[rows], color[rows],
+                                                            depth[rows]), bands))
+
+    def close(self):
+        self._executor.shutdown()
+
+
+def _serve(connection, canvas, index, count):
+    """answer the requests of a ParallelRenderer until it closes the connection"""
+    from headless import applyFrameJob
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            return
+        kind = request[0]
+        if kind == 'close':
+            return
+        try:
+            if kind == 'assign':
+                index, count = request[1:]
+                result = None
+            elif kind == 'setup':
+                function, args = request[1:]
+                result = function(canvas, index, count, *args)
+            elif kind == 'particles':
+                arrays, histograms = request[1:]
+                canvas.setParticles(**arrays)
+                # autoBounds uses the statistics of all particles, so every worker colors with the same bounds
+                statistics = FieldStatistics()
+                statistics.addHistograms(histograms)
+                canvas.setStatistics(statistics)
+                result = None
+            elif kind == 'render':
+                applyFrameJob(canvas, request[1])
+                result = canvas.renderOffscreen(depth=True)
+            else:
+                raise ValueError("unknown request " + repr(kind))
+            connection.send(('ok', result))
+        except Exception:
+            connection.send(('error', traceback.format_exc()))
+
+
+def _checkFrameJob(job):
+    other = set(job) - set(_CAMERA_KEYS)
+    if other:
+        raise ValueError("frame jobs of a ParallelRenderer can only move the camera ({}), got {}. "
+                         "Load the part of every worker with setup() or setParticles()"
+                         .format(', '.join(_CAMERA_KEYS), ', '.join(sorted(other))))
+    return job
+
+
+def _prepareCanvas(backend, size):
+    from headless import createCanvas
+    canvas = createCanvas(backend, size)
+    # indicators would be drawn once per worker and cover particles of the other workers
+    canvas.enableOrientationIndicator = False
+    canvas.enableOriginIndicator = False
+    return canvas
+
+
+def _localWorker(connection, backend, size):
+    _serve(connection, _prepareCanvas(backend, size), 0, 1)
+
+
+def serveWorker(address, authkey, backend='osmesa', size=(1920, 1080)):
+    """Run a render worker for ParallelRenderer(addresses=...) on another machine, eg.
+    python -c "import compositing; compositing.serveWorker(('0.0.0.0', 6000), b'secret')"
+    Serves one renderer after the other, the canvas and its particles are kept between them.
+    Requests are unpickled, so only clients that know the authkey are accepted."""
+    if not authkey:
+        raise ValueError("serveWorker() needs an authkey, requests without one could run any code in the worker")
+    canvas = _prepareCanvas(backend, size)
+    with Listener(address, authkey=authkey) as listener:
+        while True:
+            with listener.accept() as connection:
+                _serve(connection, canvas, 0, 1)
+
+
+class ParallelRenderer:
+    """Renders a particle set split among workers and composites their images by depth. workers local processes
+    are started, addresses (host, port) connect to workers started with serveWorker(). All workers render with
+    the same size and the same camera, so frame throughput scales with the number of workers as long as rendering
+    (and not the transfer of the images) dominates. authkey is the one given to serveWorker().
+    Use as a context manager or call close() when done."""
+
+    def __init__(self, workers=None, addresses=(), authkey=None, size=(1920, 1080), backend='osmesa',
+                 compositingThreads=4):
+        if addresses and not authkey:
+            raise ValueError("connecting to workers started with serveWorker() needs their authkey")
+        self.size = size
+        self._processes = []
+        self._connections = []
+        if workers is None and not addresses:
+            workers = multiprocessing.cpu_count()
+        # spawn instead of fork, a forked gl context is not usable
+        context = multiprocessing.get_context('spawn')
+        for _ in range(workers or 0):
+            parentConnection, childConnection = context.Pipe()
+            process = context.Process(target=_localWorker, args=(childConnection, backend, size), daemon=True)
+            process.start()
+            childConnection.close()
+            self._processes.append(process)
+            self._connections.append(parentConnection)
+        for address in addresses:
+            self._connections.append(Client(address, authkey=authkey))
+        self._compositor = DepthCompositor(compositingThreads)
+        self._request([('assign', index, len(self._connections)) for index in range(len(self._connections))])
+
+    @property
+    def workerCount(self):
+        return len(self._connections)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def _send(self, requests):
+        """send one request per worker, returns the connections the requests were sent to"""
+        sent = []
+        try:
+            for connection, request in zip(self._connections, requests):
+                connection.send(request)
+                sent.append(connection)
+        except Exception:
+            # eg a request that can not be pickled, the workers that got it still answer
+            self._receiveAll(sent, raiseErrors=False)
+            raise
+        return sent
+
+    def _receiveAll(self, connections, raiseErrors=True):
+        """Receive one answer from every connection. A failed worker raises only after all answers were received,
+        so no answer stays in a pipe and is mistaken for the answer to a later request."""
+        results = []
+        error = None
+        for connection in connections:
+            status, result = connection.recv()
+            if status == 'error' and error is None:
+                error = result
+            results.append(result)
+        if error is not None and raiseErrors:
+            raise RuntimeError("render worker failed:\n" + error)
+        return results
+
+    def _request(self, requests):
+        """send one request per worker and wait for all answers"""
+        return self._receiveAll(self._send(requests))
+
+    def setup(self, function, *args):
+        """Call function(canvas, workerIndex, workerCount, *args) in every worker, eg. to change settings or to
+        load its part of the particles from a file. function has to be a module level function so it can be
+        sent to the workers. Returns the results of all workers."""
+        return self._request([('setup', function, args)] * self.workerCount)
+
+    def setParticles(self, position, vector=None, scalar=None, radius=None):
+        """split the particles into one contiguous range per worker and send each worker its range, together with
+        the histograms of all particles for autoBounds"""
+        histograms = FieldStatistics().compute(scalar, vector)
+        bounds = np.linspace(0, len(position), self.workerCount + 1).astype(np.int64)
+        requests = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            arrays = {name: np.ascontiguousarray(array[start:end]) for name, array in
+                      (('position', position), ('vector', vector), ('scalar', scalar), ('radius', radius))
+                      if array is not None}
+            requests.append(('particles', arrays, histograms))
+        self._request(requests)
+
+    def _composite(self):
+        """merge the images of the frame the workers render now, in the order they finish"""
+        self._compositor.begin()
+        pending = list(self._connections)
+        error = None
+        while pending:
+            for connection in wait(pending):
+                pending.remove(connection)
+                status, result = connection.recv()
+                # after an error the images of the other workers are still received, but not merged
+                if status == 'error':
+                    error = error or result
+                elif error is None:
+                    self._compositor.add(*result)
+        if error is not None:
+            raise RuntimeError("render worker failed:\n" + error)
+        return self._compositor.color, self._compositor.depth
+
+    def render(self, job=None):
+        """Render one frame, job prepares the camera like headless.applyFrameJob() but can only use 'position',
+        'target' and 'view'. Returns (color, depth)."""
+        self._send([('render', _checkFrameJob(job or {}))] * self.workerCount)
+        return self._composite()
+
+    def renderFrames(self, jobs, inFlight=2):
+        """Render a sequence of frame jobs (see render()), yields (index, color) in order. Up to inFlight frames are
+        queued in the workers, so they render the next frame while the current one is transferred and composited."""
+        queued = 0
+        jobs = iter(jobs)
+        try:
+            for index in itertools.count():
+                while queued < inFlight:
+                    job = next(jobs, None)
+                    if job is None:
+                        break
+                    self._send([('render', _checkFrameJob(job))] * self.workerCount)
+                    queued += 1
+                if queued == 0:
+                    return
+                queued -= 1
+                color, _ = self._composite()
+                yield index, color
+        finally:
+            # after an error or when the caller stops early, the frames still queued are received and dropped
+            for _ in range(queued):
+                self._receiveAll(self._connections, raiseErrors=False)
+
+    def close(self):
+        for connection in self._connections:
+            try:
+                connection.send(('close',))
+            except OSError:
+                pass
+            connection.close()
+        self._connections = []
+        for process in self._processes:
+            process.join(timeout=10)
+        self._processes = []
+        self._compositor.close()
@@ -0,0 +1,201 @@
+import collections
+import ctypes
+
+import numpy as np
+
+from transform import glmToNumpy
+
+# what is shown per pixel: number of particles, sum of their scalars or the mean scalar
+DENSITY_MODES = ('count', 'scalar', 'meanScalar')
+# how the values are mapped to [0,1] before the transfer function is applied
+DENSITY_SCALINGS = ('linear', 'log', 'equalize')
+
+
+def binParticles(position, viewProjection, size, scalar=None, chunkSize=1 << 22):
+    """Project position (n,3) with viewProjection (model @ view @ projection in vispy layout, or glm) onto an image
+    of size (width, height) and count the particles per pixel. Returns (count, scalarSum) as float64 arrays of
+    shape (height, width) with the top row first, scalarSum is None if no scalar is given.
+    Works in chunks, so memory mapped data larger than the ram can be binned."""
+    width, height = size
+    matrix = glmToNumpy(viewProjection).astype(np.float32)
+    count = np.zeros(width * height)
+    scalarSum = None if scalar is None else np.zeros(width * height)
+    for start in range(0, len(position), chunkSize):
+        clip = np.asarray(position[start:start + chunkSize], dtype=np.float32) @ matrix[:3] + matrix[3]
+        w = clip[:, 3]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ndc = clip[:, :3] / w[:, None]
+        inside = (w > 0) & np.all(np.abs(ndc) <= 1.0, axis=1)
+        # same pixel as the rasterizer would choose for a point
+        x = np.minimum(((ndc[inside, 0] * 0.5 + 0.5) * width).astype(np.int64), width - 1)
+        y = np.minimum(((0.5 - ndc[inside, 1] * 0.5) * height).astype(np.int64), height - 1)
+        pixel = y * width + x
+        count += np.bincount(pixel, minlength=width * height)
+        if scalar is not None:
+            weights = np.asarray(scalar[start:start + chunkSize], dtype=np.float64)[inside]
+            scalarSum += np.bincount(pixel, weights=weights, minlength=width * height)
+    return count.reshape(height, width), None if scalarSum is None else scalarSum.reshape(height, width)
+
+
+def scaleDensity(count, scalarSum=None, mode='count', scaling='log', sampleSize=65536):
+    """Map the binned values of mode to [0,1] with linear, log or equalized (by rank) scaling.
+    Pixels without particles are set to -1."""
+    if mode not in DENSITY_MODES:
+        raise ValueError("mode must be one of {}, got {!r}".format(DENSITY_MODES, mode))
+    if scaling not in DENSITY_SCALINGS:
+        raise ValueError("scaling must be one of {}, got {!r}".format(DENSITY_SCALINGS, scaling))
+    filled = count > 0
+    result = np.full(count.shape, -1.0, dtype=np.float32)
+    if not filled.any():
+        return result
+
+    if mode == 'count':
+        values = count[filled]
+    elif mode == 'scalar':
+        values = scalarSum[filled]
+    else:
+        values = scalarSum[filled] / count[filled]
+    low = values.min()
+    if scaling == 'log':
+        values = np.log1p(values - low)
+        low = 0.0
+    if scaling == 'equalize':
+        # rank of every value in a random sample, equal areas of the image get equal parts of the color map
+        sample = values if len(values) <= sampleSize \
+            else np.random.default_rng(0).choice(values, sampleSize, replace=False)
+        sample = np.sort(sample)
+        scaled = np.searchsorted(sample, values, side='right') / len(sample)
+    else:
+        scaled = (values - low) / max(values.max() - low, np.finfo(np.float32).tiny)
+    result[filled] = np.clip(scaled, 0.0, 1.0)
+    return result
+
+
+def reductionSize(size, maxSize=64):
+    """Returns (blockSize, reducedSize) of the gpu reduction of an image of size (width, height), every pixel of the
+    reduced image covers blockSize pixels and the reduced image is at most maxSize pixels wide and high."""
+    blockSize = tuple(max(1, -(-int(s) // maxSize)) for s in size)
+    reducedSize = tuple(-(-int(s) // b) for s, b in zip(size, blockSize))
+    return blockSize, reducedSize
+
+
+def scalingFromReduction(reduced, tableSize=256):
+    """Parameters of the gpu scaling in densityResolve.frag from the reduced image (h,w,4) of densityReduce.frag,
+    which stores per block the smallest and the largest value, one sample value and the number of pixels with
+    particles. Returns (low, high, table) with the value range and tableSize values at equally spaced quantiles
+    for 'equalize' scaling, or None if no pixel has particles. The quantiles weight every sample with the pixels
+    of its block, so they approximate the distribution that scaleDensity() equalizes."""
+    reduced = np.asarray(reduced, dtype=np.float64).reshape(-1, 4)
+    filled = reduced[reduced[:, 3] > 0]
+    if len(filled) == 0:
+        return None
+    order = np.argsort(filled[:, 2], kind='stable')
+    samples = filled[order, 2]
+    cumulative = np.cumsum(filled[order, 3])
+    levels = np.arange(1, tableSize + 1) / tableSize * cumulative[-1]
+    table = samples[np.minimum(np.searchsorted(cumulative, levels), len(samples) - 1)]
+    return float(filled[:, 0].min()), float(filled[:, 1].max()), table.astype(np.float32)
+
+
+class ReductionReadback:
+    """Reads the reduced density image back through pixel buffer objects, like frameCapture.FrameCapture.
+    start() only queues the copy and latest() returns the newest copy that finished, so the canvas scales with the
+    range of an earlier frame instead of waiting for the gpu. Every call needs the gl context."""
+
+    def __init__(self, buffers=2):
+        self.buffers = buffers  # reads in flight at the same time
+        self._size = None
+        self._pbos = []
+        self._inFlight = collections.deque()  # (pbo, fence, tag) in the order of start()
+        self._next = 0
+
+    def start(self, size, tag=None):
+        """Queue reading the currently bound rgba32f framebuffer of size (width, height),
+        latest() returns tag together with the image. If all buffers are in flight the oldest read is dropped."""
+        from OpenGL import GL
+        size = tuple(int(v) for v in size)
+        if size != self._size:
+            self.close()
+            self._size = size
+            self._pbos = [int(GL.glGenBuffers(1)) for _ in range(self.buffers)]
+            for pbo in self._pbos:
+                GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+                GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, size[0] * size[1] * 16, None, GL.GL_STREAM_READ)
+        if len(self._inFlight) == self.buffers:
+            GL.glDeleteSync(self._inFlight.popleft()[1])
+
+        pbo = self._pbos[self._next]
+        self._next = (self._next + 1) % self.buffers
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+        GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 4)
+        GL.glReadPixels(0, 0, size[0], size[1], GL.GL_RGBA, GL.GL_FLOAT, ctypes.c_void_p(0))
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        fence = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        GL.glFlush()
+        self._inFlight.append((pbo, fence, tag))
+
+    def latest(self, wait=False):
+        """(tag, image) of the newest read that finished, image is (height, width, 4) float32 with the bottom row
+        first. None if no read finished, with wait it waits for the oldest read instead."""
+        from OpenGL import GL
+        result = None
+        while self._inFlight and GL.glClientWaitSync(self._inFlight[0][1], 0, 0) in (GL.GL_ALREADY_SIGNALED,
+                                                                                      GL.GL_CONDITION_SATISFIED):
+            result = self._finishOldest()
+        if result is None and wait and self._inFlight:
+            result = self._finishOldest()
+        return result
+
+    def _finishOldest(self):
+        from OpenGL import GL
+        pbo, fence, tag = self._inFlight.popleft()
+        GL.glClientWaitSync(fence, GL.GL_SYNC_FLUSH_COMMANDS_BIT, GL.GL_TIMEOUT_IGNORED)
+        GL.glDeleteSync(fence)
+
+        width, height = self._size
+        image = np.empty((height, width, 4), dtype=np.float32)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+        pointer = GL.glMapBufferRange(GL.GL_PIXEL_PACK_BUFFER, 0, image.nbytes, GL.GL_MAP_READ_BIT)
+        address = pointer if isinstance(pointer, int) else ctypes.cast(pointer, ctypes.c_void_p).value
+        np.copyto(image.reshape(-1), np.frombuffer((ctypes.c_float * image.size).from_address(address),
+                                                   dtype=np.float32))
+        GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        return tag, image
+
+    def close(self):
+        """drop all reads in flight and delete the buffers"""
+        from OpenGL import GL
+        while self._inFlight:
+            GL.glDeleteSync(self._inFlight.popleft()[1])
+        if self._pbos:
+            GL.glDeleteBuffers(len(self._pbos), self._pbos)
+        self._pbos = []
+        self._size = None
+        self._next = 0
+
+
+def colorize(scaled, colors=None, background=(0, 0, 0, 0)):
+    """rgba uint8 image of scaled values, colors is a (n,3) or (n,4) color table in [0,1] (default viridis)"""
+    if colors is None:
+        from vispy.color import get_colormap
+        colors = get_colormap('viridis').map(np.linspace(0, 1, 256))
+    colors = np.asarray(colors, dtype=np.float64)
+    if colors.shape[1] == 3:
+        colors = np.concatenate([colors, np.ones((len(colors), 1))], axis=1)
+    table = np.round(np.clip(colors, 0.0, 1.0) * 255).astype(np.uint8)
+    image = np.empty(scaled.shape + (4,), dtype=np.uint8)
+    image[:] = np.round(np.asarray(background) * 255).astype(np.uint8)
+    filled = scaled >= 0
+    image[filled] = table[np.round(scaled[filled] * (len(table) - 1)).astype(np.int64)]
+    return image
+
+
+def densityImage(position, viewProjection, size, scalar=None, mode='count', scaling='log', colors=None,
+                 background=(0, 0, 0, 0)):
+    """Render an aggregated density image of size (width, height) without opengl, returns (height, width, 4) uint8.
+    The time per particle is a few projections and one bincount, independent of the image size."""
+    if mode != 'count' and scalar is None:
+        raise ValueError("mode " + mode + " needs the scalar field")
+    count, scalarSum = binParticles(position, viewProjection, size, scalar if mode != 'count' else None)
+    return colorize(scaleDensity(count, scalarSum, mode, scaling), colors, background)
@@ -0,0 +1,86 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from transform import glmToNumpy
+
+
+def depthOrder(position, view, chunkSize=1 << 22):
+    """Returns the indices of position (n,3) sorted back to front as seen through view (glm or vispy layout).
+    Depth is quantized to 16 bit, so numpy sorts the keys with a radix sort."""
+    view = glmToNumpy(view)
+    count = len(position)
+    if count == 0:
+        return np.zeros(0, dtype=np.uint32)
+    # view space z of every particle, the camera looks along -z so the smallest z is the furthest away
+    axis = view[:3, 2].astype(np.float32)
+    depth = np.empty(count, dtype=np.float32)
+    for start in range(0, count, chunkSize):
+        np.dot(np.asarray(position[start:start + chunkSize], dtype=np.float32), axis, out=depth[start:start + chunkSize])
+    low = float(depth.min())
+    scale = 65535.0 / max(float(depth.max()) - low, np.finfo(np.float32).tiny)
+    keys = ((depth - low) * scale).astype(np.uint16)
+    return np.argsort(keys, kind='stable').astype(np.uint32)
+
+
+def _cameraOf(view):
+    """camera position and view direction in world space"""
+    inverse = np.linalg.inv(glmToNumpy(view))
+    return inverse[3, :3], -inverse[2, :3] / np.linalg.norm(inverse[2, :3])
+
+
+class DepthSorter:
+    """Keeps a back to front draw order of particles for alpha blending. The particles are only sorted again
+    when the camera turned or moved more than a threshold since the last sort. In threaded mode the new order
+    is computed in a worker thread and the previous one is used until it is ready."""
+
+    def __init__(self, position, angleThreshold=2.0, distanceThreshold=0.02, threaded=True):
+        self.position = position  # (n,3) positions, kept by reference
+        self.angleThreshold = angleThreshold  # degree the view direction can turn before sorting again
+        self.distanceThreshold = distanceThreshold  # camera movement before sorting again, relative to the bounds
+        self.threaded = threaded  # sort in a worker thread, except for the very first sort
+
+        self.count = len(position)
+        if self.count > 0:
+            self._size = float(np.linalg.norm(np.max(position, axis=0) - np.min(position, axis=0)))
+        else:
+            self._size = 0.0
+        self._order = None
+        self._sortedFor = None  # camera position and direction of the last sort
+        self._future = None
+        self._executor = None
+
+    def _needsSort(self, position, direction):
+        if self._sortedFor is None:
+            return True
+        lastPosition, lastDirection = self._sortedFor
+        angle = np.degrees(np.arccos(np.clip(np.dot(direction, lastDirection), -1.0, 1.0)))
+        return angle > self.angleThreshold \
+            or np.linalg.norm(position - lastPosition) > self.distanceThreshold * self._size
+
+    def order(self, view):
+        """Returns (indices, changed), indices is a uint32 array of all particles sorted back to front
+        and changed is False if it is the same array as returned by the last call."""
+        changed = False
+        if self._future is not None and self._future.done():
+            self._order = self._future.result()
+            self._future = None
+            changed = True
+
+        camera = _cameraOf(view)
+        if self._future is None and self._needsSort(*camera):
+            self._sortedFor = camera
+            view = glmToNumpy(view).copy()
+            if self.threaded and self._order is not None:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='DepthSorter')
+                self._future = self._executor.submit(depthOrder, self.position, view)
+            else:
+                self._order = depthOrder(self.position, view)
+                changed = True
+        return self._order, changed
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
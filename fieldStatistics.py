@@ -0,0 +1,201 @@
+import os
+import threading
+
+import numpy as np
+
+
+class Histogram:
+    """Histogram with a fixed number of bins that grows its range while data is added.
+    When values fall outside of the range, the bin width is doubled and neighboring bins are merged. No counts are
+    lost, but the bin edges depend on the data added first, so percentiles of data added in chunks can differ from
+    those of adding it at once by up to one bin width of the final range."""
+
+    def __init__(self, bins=1024):
+        self.bins = bins + bins % 2  # number of bins, always even so bins can be merged in pairs
+        self.counts = np.zeros(self.bins, dtype=np.int64)
+        self.lower = 0.0  # lower edge of the first bin
+        self.width = 0.0  # width of a bin, 0 while the histogram is empty
+        self.total = 0  # number of values added
+        self.min = np.inf  # smallest value added
+        self.max = -np.inf  # largest value added
+
+    @property
+    def upper(self):
+        return self.lower + self.width * self.bins
+
+    def edges(self):
+        return self.lower + self.width * np.arange(self.bins + 1)
+
+    def _grow(self, low, high):
+        """double the bin width until [low, high] fits into the range"""
+        while low < self.lower or high >= self.upper:
+            oldBins = np.arange(self.bins)
+            if low < self.lower:
+                # extend downwards, the old range becomes the upper half
+                self.lower -= self.width * self.bins
+                oldBins += self.bins
+            self.counts = np.bincount(oldBins // 2, weights=self.counts, minlength=self.bins).astype(np.int64)
+            self.width *= 2.0
+
+    def add(self, values):
+        """add the finite values of an array of any shape"""
+        values = np.asarray(values).reshape(-1)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        low = float(values.min())
+        high = float(values.max())
+        if self.width == 0.0:
+            self.lower = low
+            self.width = max((high - low) / self.bins, abs(low) * 1e-6, np.finfo(np.float32).tiny) * (1.0 + 1e-6)
+        self._grow(low, high)
+        index = np.floor((values - self.lower) / self.width).astype(np.int64)
+        np.clip(index, 0, self.bins - 1, out=index)
+        self.counts += np.bincount(index, minlength=self.bins)
+        self.total += len(values)
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+
+    def merge(self, other):
+        """add the counts of another histogram, values inside a bin of other are assumed to be at its center"""
+        if other.total == 0:
+            return
+        if self.width == 0.0:
+            self.lower, self.width = other.lower, other.width
+        self._grow(other.min, other.max)
+        centers = other.lower + (np.arange(other.bins) + 0.5) * other.width
+        centers = np.clip(centers, other.min, other.max)
+        index = np.clip(np.floor((centers - self.lower) / self.width).astype(np.int64), 0, self.bins - 1)
+        self.counts += np.bincount(index, weights=other.counts, minlength=self.bins).astype(np.int64)
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        """estimate the q-th percentile (q in [0,100], scalar or array) assuming values are spread evenly in a bin"""
+        if self.total == 0:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        cumulative = np.concatenate(([0], np.cumsum(self.counts)))
+        result = np.interp(np.asarray(q) / 100.0 * self.total, cumulative, self.edges())
+        return np.clip(result, self.min, self.max)
+
+    def toDict(self, prefix):
+        return {prefix + 'counts': self.counts,
+                prefix + 'range': np.array([self.lower, self.width, self.total, self.min, self.max])}
+
+    @classmethod
+    def fromDict(cls, data, prefix):
+        counts = data[prefix + 'counts']
+        histogram = cls(len(counts))
+        histogram.counts = counts.astype(np.int64)
+        histogram.lower, histogram.width, total, histogram.min, histogram.max = data[prefix + 'range']
+        histogram.total = int(total)
+        return histogram
+
+
+class FieldStatistics:
+    """Histograms of the scalar field and of the vector magnitude. Data is processed in chunks, so memory mapped
+    snapshots larger than the ram work. Histograms of every snapshot are cached and merged into a histogram over
+    all data seen so far, which is used to find bounds for the transfer function.
+    Thread safe, so snapshots can be added from the prefetching threads."""
+
+    fields = ('scalar', 'vectorMagnitude')
+
+    def __init__(self, bins=1024, chunkSize=1 << 22, cachePath=None, sourcePath=None):
+        self.bins = bins  # number of histogram bins
+        self.chunkSize = chunkSize  # number of particles processed at once
+        self.cachePath = cachePath  # npz file where the per snapshot histograms are stored, see save()
+
+        self._lock = threading.Lock()
+        self._snapshots = {}  # snapshot key -> {field -> Histogram}
+        self._total = {field: Histogram(bins) for field in self.fields}
+        # size and modification time of the file the statistics are computed from, a cache written for another
+        # version of that file is not loaded
+        self._source = _fileSignature(sourcePath) if sourcePath is not None else None
+        if cachePath is not None and os.path.exists(cachePath):
+            self._loadCache(cachePath)
+
+    def compute(self, scalar=None, vector=None):
+        """returns histograms of scalar (n,) and the magnitude of vector (n,3), computed in chunks"""
+        histograms = {}
+        if scalar is not None:
+            histograms['scalar'] = Histogram(self.bins)
+            for start in range(0, len(scalar), self.chunkSize):
+                histograms['scalar'].add(scalar[start:start + self.chunkSize])
+        if vector is not None:
+            histograms['vectorMagnitude'] = Histogram(self.bins)
+            for start in range(0, len(vector), self.chunkSize):
+                chunk = np.asarray(vector[start:start + self.chunkSize], dtype=np.float32)
+                histograms['vectorMagnitude'].add(np.sqrt(np.einsum('ij,ij->i', chunk, chunk)))
+        return histograms
+
+    def add(self, scalar=None, vector=None, key=None):
+        """Add data to the statistics and return its histograms. If key (eg the snapshot index) was added before,
+        the cached histograms are returned and nothing is counted twice."""
+        with self._lock:
+            if key is not None and key in self._snapshots:
+                return self._snapshots[key]
+        return self.addHistograms(self.compute(scalar, vector), key)
+
+    def addHistograms(self, histograms, key=None):
+        """add histograms returned by compute(), eg computed in another process, caching works like in add()"""
+        with self._lock:
+            if key is not None:
+                if key in self._snapshots:
+                    return self._snapshots[key]
+                self._snapshots[key] = histograms
+            for field, histogram in histograms.items():
+                self._total[field].merge(histogram)
+        return histograms
+
+    def addSnapshot(self, snapshot):
+        """add a snapshots.Snapshot, cached by its index"""
+        return self.add(snapshot.scalar, snapshot.vector, snapshot.index)
+
+    def histogram(self, field, key=None):
+        """histogram of field ('scalar' or 'vectorMagnitude') of one snapshot or of all data if key is None"""
+        with self._lock:
+            if key is None:
+                return self._total[field]
+            return self._snapshots.get(key, {}).get(field)
+
+    def bounds(self, field, lowerPercentile=1.0, upperPercentile=99.0, key=None):
+        """returns (lower, upper) percentiles of field, None if no data was added for that field"""
+        with self._lock:
+            histogram = self._total[field] if key is None else self._snapshots.get(key, {}).get(field)
+            if histogram is None or histogram.total == 0:
+                return None
+            lower, upper = histogram.percentile([lowerPercentile, upperPercentile])
+        return float(lower), float(upper)
+
+    def save(self, path=None):
+        """write the per snapshot histograms to the cache file, does nothing without path and cachePath"""
+        path = path or self.cachePath
+        if path is None:
+            return
+        data = {}
+        if self._source is not None:
+            data['source'] = self._source
+        with self._lock:
+            for key, histograms in self._snapshots.items():
+                for field, histogram in histograms.items():
+                    data.update(histogram.toDict('{}/{}/'.format(key, field)))
+        np.savez(path, **data)
+
+    def _loadCache(self, path):
+        with np.load(path) as data:
+            if self._source is not None and ('source' not in data.files
+                                              or not np.array_equal(data['source'], self._source)):
+                return
+            prefixes = set(name.rsplit('/', 1)[0] for name in data.files if '/' in name)
+            for prefix in prefixes:
+                key, field = prefix.split('/')
+                histogram = Histogram.fromDict(data, prefix + '/')
+                self._snapshots.setdefault(int(key), {})[field] = histogram
+                self._total[field].merge(histogram)
+
+
+def _fileSignature(path):
+    """(size, modification time in ns) of a file"""
+    status = os.stat(path)
+    return np.array([status.st_size, status.st_mtime_ns], dtype=np.int64)
@@ -0,0 +1,114 @@
+import math
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from vispy import gloo
+
+_executor = None
+
+
+def filterKey(scalarRange=None, magnitudeRange=None, box=None, planes=None):
+    """Hashable description of a filter, None if it selects everything.
+    scalarRange / magnitudeRange: (low, high) of the scalar / vector magnitude, both inclusive, None for no bound
+    box: (lower, upper) corners of an axis aligned box
+    planes: sequence of (a,b,c,d), a particle p is kept if a*p.x + b*p.y + c*p.z + d >= 0 for all planes"""
+    def pair(value):
+        return None if value is None else tuple(None if v is None else float(v) for v in value)
+    key = (pair(scalarRange), pair(magnitudeRange),
+           None if box is None else tuple(tuple(float(v) for v in corner) for corner in box),
+           None if planes is None or len(planes) == 0 else tuple(tuple(float(v) for v in plane) for plane in planes))
+    return None if key == (None, None, None, None) else key
+
+
+def _inRange(values, bounds):
+    low, high = bounds
+    mask = np.ones(len(values), dtype=bool)
+    if low is not None:
+        mask &= values >= low
+    if high is not None:
+        mask &= values <= high
+    return mask
+
+
+def filterMask(key, position=None, vector=None, scalar=None):
+    """bool array of the particles (given as arrays, or chunks of them) that pass the filter described by key"""
+    scalarRange, magnitudeRange, box, planes = key
+    mask = None
+
+    def combine(part):
+        nonlocal mask
+        mask = part if mask is None else mask & part
+
+    if scalarRange is not None:
+        combine(_inRange(np.asarray(scalar, dtype=np.float32), scalarRange))
+    if magnitudeRange is not None:
+        vector = np.asarray(vector, dtype=np.float32)
+        # compare squared magnitudes, no square root per particle
+        squared = tuple(None if bound is None else math.copysign(bound * bound, bound) for bound in magnitudeRange)
+        combine(_inRange(np.einsum('ij,ij->i', vector, vector), squared))
+    if box is not None or planes is not None:
+        position = np.asarray(position, dtype=np.float32)
+        if box is not None:
+            combine(np.all((position >= box[0]) & (position <= box[1]), axis=1))
+        if planes is not None:
+            planes = np.asarray(planes, dtype=np.float32)
+            combine(np.all(position @ planes[:, :3].T + planes[:, 3] >= 0, axis=1))
+    return mask
+
+
+class ParticleFilter:
+    """Evaluates filters (see filterKey) on particle arrays and keeps the resulting index arrays of the last
+    cacheSize filters, so going back to a previous filter costs nothing. The arrays are kept by reference and
+    processed in chunks on a thread pool, numpy releases the gil for the comparisons."""
+
+    def __init__(self, position=None, vector=None, scalar=None, cacheSize=8, chunkSize=1 << 21):
+        self.arrays = {'position': position, 'vector': vector, 'scalar': scalar}
+        self.cacheSize = cacheSize  # number of filter results kept
+        self.chunkSize = chunkSize
+        self.count = next((len(array) for array in self.arrays.values() if array is not None), 0)
+        self._cache = OrderedDict()  # filter key -> [indices, index buffer or None]
+
+    def _check(self, key):
+        scalarRange, magnitudeRange, box, planes = key
+        for name, needed in (('scalar', scalarRange), ('vector', magnitudeRange), ('position', box or planes)):
+            if needed is not None and self.arrays[name] is None:
+                raise ValueError("this filter needs the " + name + " of the particles")
+
+    def _evaluate(self, key):
+        def chunkIndices(start):
+            chunk = {name: None if array is None else array[start:start + self.chunkSize]
+                     for name, array in self.arrays.items()}
+            return np.flatnonzero(filterMask(key, **chunk)).astype(np.uint32) + np.uint32(start)
+
+        global _executor
+        starts = range(0, self.count, self.chunkSize)
+        if len(starts) > 1:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(thread_name_prefix='ParticleFilter')
+            parts = list(_executor.map(chunkIndices, starts))
+        else:
+            parts = [chunkIndices(start) for start in starts]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.uint32)
+
+    def _entry(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            self._check(key)
+            entry = [self._evaluate(key), None]
+            self._cache[key] = entry
+            while len(self._cache) > self.cacheSize:
+                self._cache.popitem(last=False)
+        self._cache.move_to_end(key)
+        return entry
+
+    def indices(self, key):
+        """sorted uint32 indices of the particles that pass the filter"""
+        return self._entry(key)[0]
+
+    def indexBuffer(self, key):
+        """(gloo.IndexBuffer, count) of the particles that pass the filter, uploaded once per cached filter"""
+        entry = self._entry(key)
+        if entry[1] is None:
+            entry[1] = gloo.IndexBuffer(entry[0])
+        return entry[1], len(entry[0])
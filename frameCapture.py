@@ -0,0 +1,143 @@
+import collections
+import ctypes
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def ffmpegCommand(path, size, framesPerSecond=60, codec='libx264', quality=18):
+    """command line for FrameCapture(command=...) that encodes the raw frames of size (width, height) into a video"""
+    return ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgba',
+            '-s', '{}x{}'.format(*size), '-r', str(framesPerSecond), '-i', '-',
+            '-c:v', codec, '-crf', str(quality), '-pix_fmt', 'yuv420p', str(path)]
+
+
+def _writePng(fileName, image):
+    from vispy.io import write_png
+    write_png(fileName, image)
+
+
+class FrameCapture:
+    """Records rendered frames without stalling the pipeline. Every frame is read into one of several pixel buffer
+    objects, the gpu copies it there asynchronously while the next frames are rendered. Only when a buffer is
+    needed again (or its fence signaled before) it is mapped, copied into a numpy array and handed to a thread pool
+    for encoding. Frames are written as png files with outputPattern (eg. 'frame_{:05d}.png'), or as raw rgba to
+    the stdin of command (see ffmpegCommand()), in that case one thread writes them in order.
+    capture() must be called from the thread that owns the gl context, right after the frame was drawn."""
+
+    def __init__(self, outputPattern=None, command=None, buffers=3, workers=4, maxPending=None):
+        if (outputPattern is None) == (command is None):
+            raise ValueError("give either outputPattern or command")
+        self.outputPattern = outputPattern
+        self.buffers = buffers  # number of pixel buffer objects, 2 or 3 hide the readback latency
+        self.maxPending = 2 * workers if maxPending is None else maxPending  # frames encoded at the same time
+        self.frame = 0  # number of frames captured so far
+        self.size = None  # (width, height) of the captured frames
+
+        self._process = None
+        if command is not None:
+            self._process = subprocess.Popen(command, stdin=subprocess.PIPE)
+            workers = 1  # a pipe needs the frames in order
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='FrameCapture')
+        self._encoding = collections.deque()  # futures of the encoder threads
+        self._pbos = []
+        self._inFlight = collections.deque()  # (pbo index, fence, frame number) in capture order
+        self._next = 0
+
+    def _allocate(self, size):
+        from OpenGL import GL
+        self._release()
+        self.size = size
+        self._pbos = [int(GL.glGenBuffers(1)) for _ in range(self.buffers)]
+        for pbo in self._pbos:
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+            GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, size[0] * size[1] * 4, None, GL.GL_STREAM_READ)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+    def _release(self):
+        from OpenGL import GL
+        self._collect(wait=True)
+        if self._pbos:
+            GL.glDeleteBuffers(len(self._pbos), self._pbos)
+        self._pbos = []
+        self._next = 0
+
+    def capture(self, size):
+        """Start reading the currently bound framebuffer of size (width, height). Frames captured earlier whose
+        readback finished are passed to the encoders, this only blocks if all buffers are still in flight."""
+        from OpenGL import GL
+        size = tuple(int(v) for v in size)
+        if size != self.size:
+            if self._process is not None and self.size is not None:
+                raise ValueError("frames piped to an encoder can not change their size")
+            self._allocate(size)
+
+        self._collect(wait=False)
+        if len(self._inFlight) == self.buffers:
+            # the oldest frame is still being read, we need its buffer now
+            self._finishOldest()
+
+        pbo = self._pbos[self._next]
+        self._next = (self._next + 1) % self.buffers
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+        GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 4)
+        # with a bound pack buffer the last argument is an offset into it, the call returns immediately
+        GL.glReadPixels(0, 0, size[0], size[1], GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        fence = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        GL.glFlush()
+        self._inFlight.append((pbo, fence, self.frame))
+        self.frame += 1
+
+    def _collect(self, wait):
+        """hand finished frames to the encoders in capture order, with wait all frames in flight"""
+        from OpenGL import GL
+        while self._inFlight:
+            fence = self._inFlight[0][1]
+            if not wait and GL.glClientWaitSync(fence, 0, 0) not in (GL.GL_ALREADY_SIGNALED,
+                                                                     GL.GL_CONDITION_SATISFIED):
+                break
+            self._finishOldest()
+
+    def _finishOldest(self):
+        from OpenGL import GL
+        pbo, fence, frame = self._inFlight.popleft()
+        GL.glClientWaitSync(fence, GL.GL_SYNC_FLUSH_COMMANDS_BIT, GL.GL_TIMEOUT_IGNORED)
+        GL.glDeleteSync(fence)
+
+        width, height = self.size
+        image = np.empty((height, width, 4), dtype=np.uint8)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, pbo)
+        pointer = GL.glMapBufferRange(GL.GL_PIXEL_PACK_BUFFER, 0, image.nbytes, GL.GL_MAP_READ_BIT)
+        address = pointer if isinstance(pointer, int) else ctypes.cast(pointer, ctypes.c_void_p).value
+        mapped = np.frombuffer((ctypes.c_ubyte * image.nbytes).from_address(address), dtype=np.uint8)
+        # opengl stores the bottom row first, flip while copying
+        np.copyto(image, mapped.reshape(height, width, 4)[::-1])
+        GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+        self._encode(frame, image)
+
+    def _encode(self, frame, image):
+        # limit the memory held by frames waiting for an encoder
+        while len(self._encoding) >= self.maxPending:
+            self._encoding.popleft().result()
+        while self._encoding and self._encoding[0].done():
+            self._encoding.popleft().result()
+        if self._process is not None:
+            self._encoding.append(self._executor.submit(self._process.stdin.write, image.data))
+        else:
+            self._encoding.append(self._executor.submit(_writePng, self.outputPattern.format(frame), image))
+
+    def close(self):
+        """Wait for all frames to be read and encoded. Needs the gl context, like capture().
+        Returns the exit code of the encoder command, None when writing png files."""
+        self._release()
+        for future in self._encoding:
+            future.result()
+        self._encoding.clear()
+        self._executor.shutdown()
+        if self._process is None:
+            return None
+        self._process.stdin.close()
+        return self._process.wait()
@@ -0,0 +1,66 @@
+import multiprocessing
+import os
+
+# every worker process owns one canvas and with it one gl context
+_canvas = None
+
+
+def createCanvas(backend='osmesa', size=(1920, 1080)):
+    """create a canvas without window for renderOffscreen(), call once per process"""
+    if backend == 'osmesa':
+        # PyOpenGL has to know about osmesa before it is imported for the first time
+        os.environ.setdefault('PYOPENGL_PLATFORM', 'osmesa')
+    from vispy import app
+    app.use_app(backend)
+    from ParticleVis import Canvas
+    return Canvas(size=size, show=False)
+
+
+def _initWorker(backend, size, setup, setupArgs):
+    global _canvas
+    _canvas = createCanvas(backend, size)
+    if setup is not None:
+        setup(_canvas, *setupArgs)
+
+
+def applyFrameJob(canvas, job):
+    """Prepare canvas for one frame. job is a dict, all keys are optional:
+    'snapshot': index of the snapshot to show (open the series in the setup function),
+    'position' / 'target': camera position and look at point as 3 floats,
+    'view': view matrix as 4x4 numpy array in vispy layout, eg. from CameraPath.frameJobs()"""
+    import glm
+    from transform import numpyToGlm
+    if 'snapshot' in job:
+        canvas.showSnapshot(job['snapshot'])
+    if 'position' in job:
+        canvas.cam.setPosition(glm.vec3(*job['position']))
+    if 'target' in job:
+        canvas.cam.setTarget(glm.vec3(*job['target']))
+    if 'view' in job:
+        canvas.cam.setViewMatrix(numpyToGlm(job['view']))
+
+
+def _renderJob(args):
+    index, job, outputPattern = args
+    applyFrameJob(_canvas, job)
+    frame = _canvas.renderOffscreen()
+    if outputPattern is None:
+        return index, frame
+    from vispy.io import write_png
+    fileName = outputPattern.format(index)
+    write_png(fileName, frame)
+    return index, fileName
+
+
+def renderFrames(jobs, setup=None, setupArgs=(), size=(1920, 1080), workers=None, backend='osmesa',
+                 outputPattern=None, chunksize=1):
+    """Render a list of frame jobs (see applyFrameJob) on a pool of worker processes with one offscreen canvas each.
+    setup(canvas, *setupArgs) is called once per worker to load data and change settings, it has to be a module
+    level function so it can be sent to the workers. Yields (index, frame) in job order, frame is a (h,w,4) uint8
+    array. If outputPattern (eg. 'frame_{:05d}.png') is given the workers write png files and (index, fileName)
+    is yielded instead, which avoids sending the images between processes."""
+    # spawn instead of fork, a forked gl context is not usable
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, _initWorker, (backend, size, setup, setupArgs)) as pool:
+        tasks = ((index, job, outputPattern) for index, job in enumerate(jobs))
+        yield from pool.imap(_renderJob, tasks, chunksize)
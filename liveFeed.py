@@ -0,0 +1,247 @@
+import os
+import select
+import socket
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from snapshots import Snapshot, _ARRAYS
+
+# shared memory layout, all header fields are int64 so every field is written with a single aligned store:
+#   global header: magic, slot count, capacity, sequence of the latest frame, slot of the latest frame,
+#                  slot the reader is using (-1 for none)
+#   one header per slot: sequence of its frame (-1 while it is written), particle count, time, attribute mask
+#   slot data: one float32 array of capacity particles per attribute, each aligned to 64 bytes
+_MAGIC = int.from_bytes(b'PVLIVE01', 'little')
+_GLOBAL_WORDS = 8
+_SLOT_WORDS = 4
+_MAGIC_WORD, _SLOTS_WORD, _CAPACITY_WORD, _SEQUENCE_WORD, _LATEST_WORD, _READER_WORD = range(6)
+_ALIGNMENT = 64
+_NAMES = tuple(_ARRAYS)
+
+
+def _align(size):
+    return -(-size // _ALIGNMENT) * _ALIGNMENT
+
+
+def _layout(slots, capacity):
+    """returns (header words, bytes per slot, total bytes)"""
+    words = _GLOBAL_WORDS + slots * _SLOT_WORDS
+    slotBytes = sum(_align(capacity * components * 4) for components in _ARRAYS.values())
+    return words, slotBytes, _align(words * 8) + slots * slotBytes
+
+
+def _slotArrays(buffer, headerWords, slotBytes, slot, capacity):
+    """float32 views of all arrays in a slot, with room for capacity particles"""
+    offset = _align(headerWords * 8) + slot * slotBytes
+    arrays = {}
+    for name, components in _ARRAYS.items():
+        shape = (capacity, components) if components > 1 else (capacity,)
+        arrays[name] = np.ndarray(shape, dtype='<f4', buffer=buffer, offset=offset)
+        offset += _align(capacity * components * 4)
+    return arrays
+
+
+def _attach(name):
+    """attach to an existing shared memory block without letting the resource tracker of this process delete it"""
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # before python 3.13 attaching registers the block, so it would be unlinked when this process exits
+        memory = shared_memory.SharedMemory(name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(memory._name, 'shared_memory')
+        except Exception:
+            pass
+        return memory
+
+
+class LiveFeedWriter:
+    """Producer side of a live feed, eg inside a running simulation. Frames are copied into a ring of slots in
+    shared memory, the writer never waits for the viewer: it always writes into a slot that is neither the latest
+    complete frame nor the one the viewer is reading, so with three or more slots frames are never torn.
+    notify is the path of a unix datagram socket (see LiveFeedReader), the sequence number of every new frame
+    is sent there if a reader listens. Use as a context manager or call close() when done."""
+
+    def __init__(self, capacity, name=None, slots=3, notify=None):
+        if slots < 3:
+            raise ValueError("a live feed needs at least 3 slots, got " + str(slots))
+        self.capacity = capacity  # maximum number of particles per frame
+        self.slots = slots
+        self.notify = notify
+        self._headerWords, self._slotBytes, size = _layout(slots, capacity)
+        self._memory = shared_memory.SharedMemory(name, create=True, size=size)
+        self.name = self._memory.name  # pass this to LiveFeedReader / Canvas.connectLiveFeed()
+
+        self._header = np.ndarray(self._headerWords, dtype='<i8', buffer=self._memory.buf)
+        self._header[:] = 0
+        self._header[_SLOTS_WORD] = slots
+        self._header[_CAPACITY_WORD] = capacity
+        self._header[_LATEST_WORD] = -1
+        self._header[_READER_WORD] = -1
+        self._slotHeaders = self._header[_GLOBAL_WORDS:].reshape(slots, _SLOT_WORDS)
+        self._slotTimes = self._slotHeaders.view('<f8')[:, 2]
+        self._slotHeaders[:, 0] = -1
+        self._slotArrays = [_slotArrays(self._memory.buf, self._headerWords, self._slotBytes, slot, capacity)
+                            for slot in range(slots)]
+        # the magic is written last, readers can not attach to a half initialized feed
+        self._header[_MAGIC_WORD] = _MAGIC
+
+        self.sequence = 0  # sequence number of the last written frame, starts at 1
+        self._lastSlot = -1
+        self._socket = None
+        if notify is not None:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._socket.setblocking(False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def write(self, position, vector=None, scalar=None, radius=None, time=None):
+        """Publish the next frame, position and vector are expected as (n,3), scalar and radius as (n,).
+        Costs one copy of the arrays into shared memory and never blocks. Returns the sequence number."""
+        count = len(position)
+        if count > self.capacity:
+            raise ValueError("frame has {} particles, but the feed was created for {}".format(count, self.capacity))
+        given = {'position': position, 'vector': vector, 'scalar': scalar, 'radius': radius}
+
+        # the next slot after the last one that is neither the latest frame nor in use by the reader
+        latest = self._header[_LATEST_WORD]
+        reader = self._header[_READER_WORD]
+        slot = next(candidate % self.slots for candidate in range(self._lastSlot + 1, self._lastSlot + 1 + self.slots)
+                    if candidate % self.slots not in (latest, reader))
+
+        slotHeader = self._slotHeaders[slot]
+        slotHeader[0] = -1
+        mask = 0
+        for bit, name in enumerate(_NAMES):
+            if given[name] is None:
+                continue
+            target = self._slotArrays[slot][name][:count]
+            source = np.asarray(given[name], dtype=np.float32)
+            target[...] = source.reshape(target.shape)
+            mask |= 1 << bit
+        self.sequence += 1
+        slotHeader[1] = count
+        self._slotTimes[slot] = self.sequence if time is None else float(time)
+        slotHeader[3] = mask
+        slotHeader[0] = self.sequence
+        self._header[_LATEST_WORD] = slot
+        self._header[_SEQUENCE_WORD] = self.sequence
+        self._lastSlot = slot
+
+        if self._socket is not None:
+            try:
+                self._socket.sendto(self.sequence.to_bytes(8, 'little'), self.notify)
+            except OSError:
+                # nobody is listening or the reader is behind, it reads the latest frame anyway
+                pass
+        return self.sequence
+
+    def close(self):
+        """close and delete the shared memory, readers that are attached keep their mapping"""
+        if self._memory is None:
+            return
+        if self._socket is not None:
+            self._socket.close()
+        self._header = self._slotHeaders = self._slotTimes = self._slotArrays = None
+        self._memory.close()
+        self._memory.unlink()
+        self._memory = None
+
+
+class LiveFeedReader:
+    """Viewer side of a live feed created by a LiveFeedWriter with the given name. latest() returns the newest
+    complete frame as a Snapshot. Its arrays are copied out of shared memory once, like a seqlock: the copy is only
+    returned if the slot still holds the same frame afterwards, so a frame is never torn even if the writer did not
+    see the reservation of the slot in time. The returned arrays belong to the caller.
+    With notify (a path) a unix datagram socket is bound there and wait() sleeps until the writer sends a frame."""
+
+    def __init__(self, name, notify=None):
+        self._memory = _attach(name)
+        header = np.ndarray(_GLOBAL_WORDS, dtype='<i8', buffer=self._memory.buf)
+        if header[_MAGIC_WORD] != _MAGIC:
+            self._memory.close()
+            raise ValueError(name + " is not a particle live feed")
+        self.slots = int(header[_SLOTS_WORD])
+        self.capacity = int(header[_CAPACITY_WORD])
+        headerWords, slotBytes, _ = _layout(self.slots, self.capacity)
+        self._header = np.ndarray(headerWords, dtype='<i8', buffer=self._memory.buf)
+        self._slotHeaders = self._header[_GLOBAL_WORDS:].reshape(self.slots, _SLOT_WORDS)
+        self._slotTimes = self._slotHeaders.view('<f8')[:, 2]
+        self._slotArrays = [_slotArrays(self._memory.buf, headerWords, slotBytes, slot, self.capacity)
+                            for slot in range(self.slots)]
+        self.sequence = 0  # sequence number of the last frame returned by latest()
+        self.droppedFrames = 0  # frames the writer published that were never returned by latest()
+
+        self.notify = notify
+        self._socket = None
+        if notify is not None:
+            if os.path.exists(notify):
+                os.unlink(notify)
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._socket.bind(notify)
+            self._socket.setblocking(False)
+
+    def hasNewFrame(self):
+        return self._header is not None and self._header[_SEQUENCE_WORD] > self.sequence
+
+    def latest(self):
+        """Returns the newest complete frame as a Snapshot (its index is the sequence number) if it is newer than
+        the last one returned, None otherwise. Never blocks the writer."""
+        while self.hasNewFrame():
+            # reserve the slot and check that it is still the latest, so the writer usually avoids it
+            slot = int(self._header[_LATEST_WORD])
+            self._header[_READER_WORD] = slot
+            slotHeader = self._slotHeaders[slot]
+            sequence = int(slotHeader[0])
+            if slot != self._header[_LATEST_WORD] or sequence <= 0:
+                continue
+            count = int(slotHeader[1])
+            frameTime = float(self._slotTimes[slot])
+            mask = int(slotHeader[3])
+            # without a memory fence the reservation can reach the writer after it picked the slot, so the frame
+            # is copied and only returned if the writer did not start writing into the slot in the meantime
+            arrays = {name: np.array(self._slotArrays[slot][name][:count]) for bit, name in enumerate(_NAMES)
+                      if mask & (1 << bit)}
+            if slotHeader[0] != sequence:
+                continue
+            self.droppedFrames += max(sequence - self.sequence - 1, 0)
+            self.sequence = sequence
+            return Snapshot(sequence, frameTime, **arrays)
+        return None
+
+    def wait(self, timeout=None):
+        """Wait until a new frame is published or timeout seconds passed, returns True if there is a new frame.
+        Sleeps on the notification socket if there is one, polls the header otherwise."""
+        end = None if timeout is None else time.monotonic() + timeout
+        while not self.hasNewFrame():
+            remaining = None if end is None else end - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            if self._socket is not None:
+                if select.select([self._socket], [], [], remaining)[0]:
+                    try:
+                        while self._socket.recv(8):
+                            pass
+                    except BlockingIOError:
+                        pass
+            else:
+                time.sleep(0.001 if remaining is None else min(0.001, remaining))
+        return True
+
+    def close(self):
+        if self._memory is None:
+            return
+        if self._socket is not None:
+            self._socket.close()
+            os.unlink(self.notify)
+        self._header[_READER_WORD] = -1
+        self._header = self._slotHeaders = self._slotTimes = self._slotArrays = None
+        self._memory.close()
+        self._memory = None
@@ -0,0 +1,140 @@
+import numpy as np
+from vispy import gloo
+
+# the compact layout stores per particle:
+#   'packed' (2 words): vector as 3 signed normalized 10 bit integers relative to vectorScale,
+#                       scalar and radius as two half floats, the sign of the radius is dropped
+#   'position' (3 floats) or 'quantizedPosition' (2 words): 3x20 bit fixed point relative to the bounding box
+# words are stored in float32 fields, the shader reinterprets the bits (see particleRenderer.vert).
+# GL may flush denormals and canonicalize NaNs, so a word keeps 31 payload bits in a normal finite float:
+# the low 7 exponent bits are stored plus one (exponent 1 to 128) and bit 30 goes into the sign bit
+_QUANTIZATION_STEPS = 2 ** 20 - 1
+_SNORM10_MAX = 511
+
+
+def encodeWords(payload):
+    """returns the bits (uint32) of normal finite floats that store the 31 bit integers payload"""
+    payload = np.asarray(payload, dtype=np.uint32)
+    return ((payload & 0x3FFFFFFF) + 0x00800000) | ((payload >> 30) << 31)
+
+
+def decodeWords(words):
+    """inverse of encodeWords(), the same math as the shader"""
+    words = np.asarray(words, dtype=np.uint32)
+    return ((words & 0x7FFFFFFF) - 0x00800000) | ((words >> 31) << 30)
+
+
+def compactDtype(quantizePositions):
+    if quantizePositions:
+        return np.dtype([('quantizedPosition', np.float32, 2), ('packed', np.float32, 2)])
+    return np.dtype([('position', np.float32, 3), ('packed', np.float32, 2)])
+
+
+def quantizePositions(position, boundsMin, boundsExtent):
+    """returns the two words (n,2) uint32 that store position (n,3) as 20 bit fixed point inside of the bounds"""
+    extent = np.where(boundsExtent > 0, boundsExtent, 1.0)
+    q = np.rint((position - boundsMin) / extent * _QUANTIZATION_STEPS)
+    q = np.clip(q, 0, _QUANTIZATION_STEPS).astype(np.uint32)
+    words = np.empty((len(position), 2), dtype=np.uint32)
+    words[:, 0] = q[:, 0] | ((q[:, 1] & 0x7FF) << 20)
+    words[:, 1] = (q[:, 1] >> 11) | (q[:, 2] << 9)
+    return encodeWords(words)
+
+
+def dequantizePositions(words, boundsMin, boundsExtent):
+    """inverse of quantizePositions(), the same math as the shader"""
+    words = decodeWords(words)
+    q = np.empty((len(words), 3), dtype=np.uint32)
+    q[:, 0] = words[:, 0] & 0xFFFFF
+    q[:, 1] = (words[:, 0] >> 20) | ((words[:, 1] & 0x1FF) << 11)
+    q[:, 2] = (words[:, 1] >> 9) & 0xFFFFF
+    return boundsMin + q / _QUANTIZATION_STEPS * boundsExtent
+
+
+def packAttributes(vector, scalar, radius, vectorScale):
+    """returns the two words (n,2) uint32 with vector (n,3) and scalar / radius (n,) in the compact layout"""
+    words = np.empty((len(vector), 2), dtype=np.uint32)
+    snorm = np.rint(np.clip(vector / (vectorScale if vectorScale > 0 else 1.0), -1.0, 1.0) * _SNORM10_MAX)
+    snorm = snorm.astype(np.int32).view(np.uint32) & 0x3FF
+    words[:, 0] = snorm[:, 0] | (snorm[:, 1] << 10) | (snorm[:, 2] << 20)
+    radius = np.maximum(np.asarray(radius, dtype=np.float16), 0)
+    words[:, 1] = np.asarray(scalar, dtype=np.float16).view(np.uint16) \
+        | ((radius.view(np.uint16).astype(np.uint32) & 0x7FFF) << 16)
+    return encodeWords(words)
+
+
+class PackedParticleBuffer:
+    """Stores all particle attributes interleaved in one vertex buffer using the compact layout,
+    16 bytes per particle with quantized positions, 20 bytes without, instead of 32.
+    Has the same interface as particleBuffer.ParticleBuffer. Fields of an interleaved buffer can not be
+    limited to a sub range, so the buffer always has exactly the size of the particle set."""
+
+    def __init__(self, quantizePositions=False):
+        self.quantizePositions = quantizePositions  # store positions as fixed point relative to the bounding box
+
+        # internal state (DO NOT WRITE, only read)
+        self.count = 0
+        self.boundsMin = np.zeros(3, dtype=np.float32)
+        self.boundsExtent = np.zeros(3, dtype=np.float32)
+        self.vectorScale = 1.0
+        self._dtype = compactDtype(quantizePositions)
+        self._buffer = gloo.VertexBuffer(np.zeros(0, dtype=self._dtype))
+
+    def setData(self, position=None, vector=None, scalar=None, radius=None, offset=None):
+        """Pack and upload particle attributes, see ParticleBuffer.setData(). As all attributes share one
+        buffer every call has to provide the position, attributes that are not given are set to zero.
+        Bounds and vector scale are computed on full updates, updates with an offset reuse them."""
+        if position is None:
+            raise ValueError("the compact layout needs the position with every update")
+        position = np.asarray(position, dtype=np.float32).reshape(-1, 3)
+        length = len(position)
+        vector = np.zeros((length, 3), dtype=np.float32) if vector is None \
+            else np.asarray(vector, dtype=np.float32).reshape(length, 3)
+        scalar = np.zeros(length, dtype=np.float32) if scalar is None else np.asarray(scalar).reshape(length)
+        radius = np.zeros(length, dtype=np.float32) if radius is None else np.asarray(radius).reshape(length)
+
+        if offset is None:
+            offset = 0
+            if length > 0:
+                self.boundsMin = position.min(axis=0)
+                self.boundsExtent = position.max(axis=0) - self.boundsMin
+                self.vectorScale = float(np.sqrt(np.max(np.einsum('ij,ij->i', vector, vector))))
+            if length != self.count:
+                self._buffer.resize_bytes(length * self._dtype.itemsize)
+            self.count = length
+        elif offset < 0 or offset + length > self.count:
+            raise ValueError("Particle range [{}, {}) is outside of the {} particles in the buffer"
+                             .format(offset, offset + length, self.count))
+        if length == 0:
+            return
+
+        data = np.empty(length, dtype=self._dtype)
+        if self.quantizePositions:
+            data['quantizedPosition'] = quantizePositions(position, self.boundsMin, self.boundsExtent).view(np.float32)
+        else:
+            data['position'] = position
+        data['packed'] = packAttributes(vector, scalar, radius, self.vectorScale).view(np.float32)
+        self._buffer.set_subdata(data, offset=offset)
+
+    def bind(self, program, divisor=None):
+        """bind the buffer to program and set the uniforms needed for decoding,
+        with divisor 1 the attributes advance once per instance"""
+        fields = {'input_packed': 'packed'}
+        if self.quantizePositions:
+            fields['input_quantizedPosition'] = 'quantizedPosition'
+            program['input_position'] = (0, 0, 0)
+            program['vertexLayout'] = 2
+        else:
+            fields['input_position'] = 'position'
+            program['input_quantizedPosition'] = (0, 0)
+            program['vertexLayout'] = 1
+        for name, field in fields.items():
+            view = self._buffer[field]
+            view.divisor = divisor
+            program[name] = view
+        program['input_vector'] = (0, 0, 0)
+        program['input_scalar'] = 0
+        program['input_radius'] = 0
+        program['boundsMin'] = self.boundsMin
+        program['boundsExtent'] = self.boundsExtent
+        program['vectorScale'] = self.vectorScale
@@ -0,0 +1,118 @@
+import numpy as np
+from vispy import gloo
+
+
+class ParticleBuffer:
+    """Keeps one preallocated vertex buffer per particle attribute. Data is uploaded in place,
+    buffers are only reallocated when the number of particles grows beyond the current capacity."""
+
+    # shader attribute name and number of float components per particle
+    attributes = {'input_position': 3, 'input_vector': 3, 'input_scalar': 1, 'input_radius': 1}
+    # attributes the shader blends between two snapshots
+    interpolated = ('input_position', 'input_vector', 'input_scalar')
+
+    def __init__(self, capacity=0, growthFactor=1.5):
+        self.growthFactor = growthFactor  # capacity is multiplied by at least this when the buffers need to grow
+
+        # internal state (DO NOT WRITE, only read)
+        self.count = 0  # number of valid particles in the buffers
+        self.capacity = 0  # number of particles that fit into the buffers without reallocation
+        self._buffers = {}
+        for name, components in self.attributes.items():
+            # an empty array of the right shape fixes the buffers dtype so it can be resized later
+            self._buffers[name] = gloo.VertexBuffer(np.zeros(_shape(0, components), dtype=np.float32))
+        if capacity > 0:
+            self.reserve(capacity)
+
+    def __getitem__(self, name):
+        return self._buffers[name]
+
+    def reserve(self, capacity):
+        """Make sure the buffers can hold at least capacity particles. Growing the buffers discards their content."""
+        if capacity <= self.capacity:
+            return False
+        for name, components in self.attributes.items():
+            self._buffers[name].resize_bytes(capacity * components * 4)
+        self.capacity = capacity
+        return True
+
+    def resize(self, count):
+        """Set the number of particles without uploading anything, eg to fill the buffers in parts with offsets.
+        The content of particles beyond the previous count is undefined until it is written."""
+        self.reserve(count)
+        self.count = count
+
+    def setData(self, position=None, vector=None, scalar=None, radius=None, offset=None):
+        """Upload particle attributes. All arguments are numpy arrays with one entry (or row of 3) per particle,
+        any attribute that is None is left untouched. Contiguous float32 arrays are not copied, so do not modify
+        them until the next frame was drawn.
+        If offset is None the given arrays replace the whole particle set and define the new particle count.
+        Otherwise only the range [offset, offset+len) is written, which must lie within the current particle count.
+        When the particle count changes, attributes that are not given are reset to zero."""
+        data = {'input_position': position, 'input_vector': vector, 'input_scalar': scalar, 'input_radius': radius}
+        data = {name: _prepareAttribute(array, self.attributes[name], name) for name, array in data.items() if array is not None}
+        if not data:
+            return
+
+        lengths = set(len(array) for array in data.values())
+        if len(lengths) != 1:
+            raise ValueError("All particle attributes must have the same length, got " + str(sorted(lengths)))
+        length = lengths.pop()
+
+        if offset is None:
+            offset = 0
+            if length > self.capacity:
+                self.reserve(max(length, int(self.capacity * self.growthFactor)))
+            if length != self.count:
+                # the old values of attributes we did not get belong to other particles, fill them with zeros
+                for name, components in self.attributes.items():
+                    if name not in data:
+                        data[name] = np.zeros(_shape(length, components), dtype=np.float32)
+            self.count = length
+        elif offset < 0 or offset + length > self.count:
+            raise ValueError("Particle range [{}, {}) is outside of the {} particles in the buffer"
+                             .format(offset, offset + length, self.count))
+
+        for name, array in data.items():
+            if length > 0:
+                self._buffers[name].set_subdata(array, offset=offset)
+
+    def _view(self, name, divisor):
+        # programs read the divisor from the object bound to them when drawing, so every bind gets its own view
+        # and the divisor of the shared buffer is never changed
+        view = self._buffers[name][:self.count]
+        view.divisor = divisor
+        return view
+
+    def bind(self, program, divisor=None):
+        """Bind the buffers to the attributes of program, so that only the valid particles are drawn.
+        With divisor 1 the attributes advance once per instance, for instanced rendering."""
+        for name in self._buffers:
+            program[name] = self._view(name, divisor)
+        # attributes of the compact layout are not used (see packing.py)
+        program['input_packed'] = (0, 0)
+        program['input_quantizedPosition'] = (0, 0)
+        program['vertexLayout'] = 0
+
+    def bindNext(self, program, divisor=None):
+        """Bind the buffers as the next snapshot, whose attributes are interpolated during playback
+        (see particleRenderer.vert). Both snapshots must have the same particle count."""
+        for name in self.interpolated:
+            program[name + 'Next'] = self._view(name, divisor)
+
+
+def _shape(count, components):
+    return (count, components) if components > 1 else (count,)
+
+
+def _prepareAttribute(array, components, name):
+    """returns array as contiguous float32 array of the shape expected by the vertex buffer, copies only if needed"""
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    if components == 1:
+        if array.ndim == 2 and array.shape[1] == 1:
+            array = array.reshape(-1)
+        if array.ndim != 1:
+            raise ValueError(name + " must have shape (n,) or (n,1), got " + str(array.shape))
+    elif array.ndim != 2 or array.shape[1] != components:
+        raise ValueError(name + " must have shape (n,{}), got ".format(components) + str(array.shape))
+    return array
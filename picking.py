@@ -0,0 +1,158 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from transform import glmToNumpy
+
+_executor = None
+
+
+def _spreadBits(values):
+    """insert two zero bits between each of the lower 10 bits, for morton codes"""
+    values = values.astype(np.uint32) & 0x3FF
+    values = (values | (values << 16)) & 0x030000FF
+    values = (values | (values << 8)) & 0x0300F00F
+    values = (values | (values << 4)) & 0x030C30C3
+    values = (values | (values << 2)) & 0x09249249
+    return values
+
+
+def _rayBox(origin, inverseDirection, lower, upper):
+    """returns (hit, entry distance) of a ray against boxes (n,3)"""
+    with np.errstate(invalid='ignore'):
+        t1 = (lower - origin) * inverseDirection
+        t2 = (upper - origin) * inverseDirection
+    entry = np.nanmax(np.minimum(t1, t2), axis=1)
+    exit = np.nanmin(np.maximum(t1, t2), axis=1)
+    return exit >= np.maximum(entry, 0.0), entry
+
+
+class ParticleTree:
+    """Bounding volume hierarchy over particles for ray casts. Particles are sorted along a morton curve, every
+    leafSize consecutive particles form a leaf and every branching consecutive nodes form the parent node.
+    Only the sort order and the node bounds are stored, positions are read from the original array at query time.
+    Building is done with numpy in chunks, so it works for memory mapped data and releases the gil most of the time."""
+
+    def __init__(self, position, radius=None, leafSize=64, branching=8, chunkSize=1 << 22):
+        self.position = position  # (n,3) positions, kept by reference
+        self.radius = radius  # (n,) radii or None, kept by reference
+        self.leafSize = leafSize
+        self.branching = branching
+        self.count = len(position)
+
+        # morton code of every particle inside the bounding box
+        lower = np.full(3, np.inf)
+        upper = np.full(3, -np.inf)
+        for start in range(0, self.count, chunkSize):
+            chunk = np.asarray(position[start:start + chunkSize], dtype=np.float32)
+            lower = np.minimum(lower, chunk.min(axis=0))
+            upper = np.maximum(upper, chunk.max(axis=0))
+        scale = 1023.0 / np.maximum(upper - lower, np.finfo(np.float32).tiny) if self.count > 0 else np.ones(3)
+        codes = np.empty(self.count, dtype=np.uint32)
+        for start in range(0, self.count, chunkSize):
+            cell = (np.asarray(position[start:start + chunkSize], dtype=np.float32) - lower) * scale
+            codes[start:start + chunkSize] = _spreadBits(cell[:, 0]) | (_spreadBits(cell[:, 1]) << 1) \
+                | (_spreadBits(cell[:, 2]) << 2)
+        self.order = np.argsort(codes, kind='stable').astype(np.uint32)
+        del codes
+
+        # leaf bounds of the particle centers and the largest radius per leaf
+        leafCount = (self.count + leafSize - 1) // leafSize
+        levelLower = np.empty((leafCount, 3), dtype=np.float32)
+        levelUpper = np.empty((leafCount, 3), dtype=np.float32)
+        levelRadius = np.zeros(leafCount, dtype=np.float32)
+        leavesPerChunk = max(chunkSize // leafSize, 1)
+        for firstLeaf in range(0, leafCount, leavesPerChunk):
+            lastLeaf = min(firstLeaf + leavesPerChunk, leafCount)
+            indices = self.order[firstLeaf * leafSize:lastLeaf * leafSize]
+            starts = np.arange(lastLeaf - firstLeaf) * leafSize
+            chunk = np.asarray(position[indices], dtype=np.float32)
+            levelLower[firstLeaf:lastLeaf] = np.minimum.reduceat(chunk, starts, axis=0)
+            levelUpper[firstLeaf:lastLeaf] = np.maximum.reduceat(chunk, starts, axis=0)
+            if radius is not None:
+                levelRadius[firstLeaf:lastLeaf] = np.maximum.reduceat(np.asarray(radius[indices], dtype=np.float32),
+                                                                      starts)
+
+        # upper levels, levels[0] are the leaves and levels[-1] has at most branching nodes
+        self.levels = [(levelLower, levelUpper, levelRadius)]
+        while len(levelLower) > branching:
+            starts = np.arange(0, len(levelLower), branching)
+            levelLower = np.minimum.reduceat(levelLower, starts, axis=0)
+            levelUpper = np.maximum.reduceat(levelUpper, starts, axis=0)
+            levelRadius = np.maximum.reduceat(levelRadius, starts)
+            self.levels.append((levelLower, levelUpper, levelRadius))
+
+    def _candidateLeaves(self, origin, inverseDirection, radius):
+        """leaves whose bounds are hit by the ray, sorted by entry distance"""
+        nodes = np.arange(len(self.levels[-1][0]))
+        for level in range(len(self.levels) - 1, -1, -1):
+            lower, upper, nodeRadius = self.levels[level]
+            margin = nodeRadius[nodes, None] if radius is None else radius
+            hit, entry = _rayBox(origin, inverseDirection, lower[nodes] - margin, upper[nodes] + margin)
+            nodes = nodes[hit]
+            entry = entry[hit]
+            if level > 0:
+                nodes = (nodes[:, None] * self.branching + np.arange(self.branching)).reshape(-1)
+                nodes = nodes[nodes < len(self.levels[level - 1][0])]
+        sort = np.argsort(entry)
+        return nodes[sort], entry[sort]
+
+    def intersect(self, origin, direction, radius=None, batchSize=16):
+        """Cast a ray and return (index, distance) of the first sphere it hits, None if it hits nothing.
+        radius is the radius of all spheres, if None the per particle radii given to the constructor are used."""
+        if radius is None and self.radius is None:
+            raise ValueError("the tree was built without radii, so a radius is needed")
+        if self.count == 0:
+            return None
+        origin = np.asarray(origin, dtype=np.float64)
+        direction = np.asarray(direction, dtype=np.float64)
+        direction = direction / np.linalg.norm(direction)
+        with np.errstate(divide='ignore'):
+            inverseDirection = 1.0 / direction
+        leaves, entry = self._candidateLeaves(origin, inverseDirection, radius)
+
+        best = None
+        # test the leaves front to back, stop as soon as the next leaves start behind the closest hit
+        for start in range(0, len(leaves), batchSize):
+            if best is not None and entry[start] > best[1]:
+                break
+            first = leaves[start:start + batchSize] * self.leafSize
+            ranges = (first[:, None] + np.arange(self.leafSize)).reshape(-1)
+            indices = self.order[ranges[ranges < self.count]]
+            offset = np.asarray(self.position[indices], dtype=np.float64) - origin
+            along = offset @ direction
+            squaredDistance = np.einsum('ij,ij->i', offset, offset) - along * along
+            sphereRadius = np.asarray(self.radius[indices], dtype=np.float64) if radius is None else float(radius)
+            squaredRadius = sphereRadius * sphereRadius
+            hit = (squaredDistance <= squaredRadius) & (along > 0)
+            if not hit.any():
+                continue
+            # distance to the front surface of each hit sphere
+            squaredRadius = squaredRadius[hit] if radius is None else squaredRadius
+            distance = along[hit] - np.sqrt(squaredRadius - squaredDistance[hit])
+            closest = int(np.argmin(distance))
+            if best is None or distance[closest] < best[1]:
+                best = (int(indices[hit][closest]), float(distance[closest]))
+        return best
+
+
+def cursorRay(x, y, size, cameraModel, projection):
+    """Returns (origin, direction) in world space of the ray through the pixel (x, y), measured from the top left
+    of a viewport of size (width, height). cameraModel is the model matrix of the camera (its inverse view matrix)
+    and projection the projection matrix, as glm or in vispy layout."""
+    ndcX = 2.0 * x / size[0] - 1.0
+    ndcY = 1.0 - 2.0 * y / size[1]
+    toWorld = np.linalg.inv(glmToNumpy(projection)) @ glmToNumpy(cameraModel)
+    near, far = np.array([[ndcX, ndcY, -1.0, 1.0], [ndcX, ndcY, 1.0, 1.0]]) @ toWorld
+    near = near[:3] / near[3]
+    far = far[:3] / far[3]
+    direction = far - near
+    return near, direction / np.linalg.norm(direction)
+
+
+def buildInBackground(position, radius=None):
+    """start building a ParticleTree in a background thread, returns a concurrent.futures.Future"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ParticleTree')
+    return _executor.submit(ParticleTree, position, radius)
@@ -0,0 +1,168 @@
+import collections
+import contextlib
+import csv
+import time
+
+import numpy as np
+
+
+class _GpuTimers:
+    """GL_TIME_ELAPSED queries, results are collected a few frames later so reading them never stalls"""
+
+    def __init__(self):
+        from OpenGL import GL
+        self._gl = GL
+        self._free = []
+        self._pending = []  # (query, frame, stage)
+
+    def begin(self):
+        if not self._free:
+            self._free.append(int(np.ravel(self._gl.glGenQueries(1))[0]))
+        query = self._free.pop()
+        self._gl.glBeginQuery(self._gl.GL_TIME_ELAPSED, query)
+        return query
+
+    def end(self, query, frame, stage):
+        self._gl.glEndQuery(self._gl.GL_TIME_ELAPSED)
+        self._pending.append((query, frame, stage))
+
+    def collect(self):
+        """returns (frame, stage, milliseconds) of all queries whose results are available"""
+        results = []
+        stillPending = []
+        available = np.zeros(1, dtype=np.int32)
+        elapsed = np.zeros(1, dtype=np.uint64)
+        for query, frame, stage in self._pending:
+            self._gl.glGetQueryObjectiv(query, self._gl.GL_QUERY_RESULT_AVAILABLE, available)
+            if available[0]:
+                self._gl.glGetQueryObjectui64v(query, self._gl.GL_QUERY_RESULT, elapsed)
+                results.append((frame, stage, float(elapsed[0]) * 1e-6))
+                self._free.append(query)
+            else:
+                stillPending.append((query, frame, stage))
+        self._pending = stillPending
+        return results
+
+    def close(self):
+        """delete all queries, results that were not collected yet are dropped"""
+        queries = self._free + [query for query, _, _ in self._pending]
+        if queries:
+            self._gl.glDeleteQueries(len(queries), np.array(queries, dtype=np.uint32))
+        self._free = []
+        self._pending = []
+
+
+class FrameProfiler:
+    """Measures cpu time of the stages of a frame and, where the gl context supports timer queries,
+    the gpu time of stages that issue draw calls. Keeps rolling percentiles over the last frames
+    and optionally a full trace that can be written as csv."""
+
+    def __init__(self, window=300, enableGpuTimers=True, recordTrace=False):
+        self.enabled = True  # set to False to skip all measurements
+        self.window = window  # number of frames used for the rolling percentiles
+        self.enableGpuTimers = enableGpuTimers  # use gl timer queries, disabled automatically if not supported
+        self.recordTrace = recordTrace  # keep every measurement for writeCsv()
+
+        self._frame = -1
+        self._frameStart = 0.0
+        self._cpu = collections.defaultdict(lambda: collections.deque(maxlen=self.window))
+        self._gpu = collections.defaultdict(lambda: collections.deque(maxlen=self.window))
+        self._trace = {}  # (frame, stage) -> [time, cpu ms, gpu ms]
+        self._gpuTimers = None
+
+    @property
+    def frame(self):
+        return self._frame
+
+    def beginFrame(self):
+        if not self.enabled:
+            return
+        self._frame += 1
+        self._frameStart = time.perf_counter()
+
+    def endFrame(self):
+        if not self.enabled:
+            return
+        self._record('frame', (time.perf_counter() - self._frameStart) * 1e3)
+        if self._gpuTimers is not None:
+            for frame, stage, milliseconds in self._gpuTimers.collect():
+                self._gpu[stage].append(milliseconds)
+                if self.recordTrace and (frame, stage) in self._trace:
+                    self._trace[(frame, stage)][2] = milliseconds
+
+    def _record(self, stage, milliseconds):
+        self._cpu[stage].append(milliseconds)
+        if self.recordTrace:
+            self._trace[(self._frame, stage)] = [self._frameStart, milliseconds, None]
+
+    def _startGpuTimer(self):
+        if not self.enableGpuTimers:
+            return None
+        try:
+            if self._gpuTimers is None:
+                self._gpuTimers = _GpuTimers()
+            return self._gpuTimers.begin()
+        except Exception:
+            # no PyOpenGL or no timer queries in this context
+            self.enableGpuTimers = False
+            self._gpuTimers = None
+            return None
+
+    @contextlib.contextmanager
+    def stage(self, name, gpu=False):
+        """Measure the code inside the with block as stage name. Set gpu to True for stages with draw calls.
+        gpu timer queries can not be nested, so do not nest stages that use them."""
+        if not self.enabled:
+            yield
+            return
+        query = self._startGpuTimer() if gpu else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, (time.perf_counter() - start) * 1e3)
+            if query is not None:
+                self._gpuTimers.end(query, self._frame, name)
+
+    def stages(self):
+        return list(self._cpu.keys())
+
+    def percentiles(self, q=(50, 95, 99)):
+        """returns {stage: {'cpu': [...], 'gpu': [...]}} with percentiles in milliseconds over the rolling window,
+        'gpu' is missing for stages without gpu measurements"""
+        result = {}
+        for stage, values in self._cpu.items():
+            result[stage] = {'cpu': list(np.percentile(values, q))}
+            if self._gpu.get(stage):
+                result[stage]['gpu'] = list(np.percentile(self._gpu[stage], q))
+        return result
+
+    def summary(self):
+        """multi line text with the median and 95th percentile of every stage"""
+        lines = []
+        for stage, values in self.percentiles((50, 95)).items():
+            line = '{:<12} cpu {:7.2f} / {:7.2f} ms'.format(stage, *values['cpu'])
+            if 'gpu' in values:
+                line += '   gpu {:7.2f} / {:7.2f} ms'.format(*values['gpu'])
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def writeCsv(self, path):
+        """write the recorded trace (see recordTrace) with one row per frame and stage"""
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['frame', 'time', 'stage', 'cpu_ms', 'gpu_ms'])
+            for (frame, stage), (startTime, cpu, gpu) in sorted(self._trace.items()):
+                writer.writerow([frame, startTime, stage, cpu, '' if gpu is None else gpu])
+
+    def close(self):
+        """delete the gl timer queries, needs the gl context they were created in. They are created again if the
+        profiler is used afterwards."""
+        if self._gpuTimers is not None:
+            self._gpuTimers.close()
+            self._gpuTimers = None
+
+    def reset(self):
+        self._cpu.clear()
+        self._gpu.clear()
+        self._trace = {}
@@ -0,0 +1,192 @@
+import numpy as np
+
+from particleBuffer import ParticleBuffer
+from spatialIndex import frustumPlanes, boxesInFrustum
+from transform import glmToNumpy
+
+# gpu memory of a resident particle: position, vector, scalar and radius as float32 plus its entry in the index buffer
+BYTES_PER_PARTICLE = 4 * (3 + 3 + 1 + 1) + 4
+
+
+def _spatialChunks(position, particlesPerChunk, chunkSize=1 << 22, maxCellsPerAxis=64):
+    """Sort particles into a uniform grid with a counting sort, working on chunkSize particles at a time so memory
+    mapped data is never loaded at once. Cells with more than particlesPerChunk particles are split.
+    Returns (order, start, count, lower, upper) where the particles of chunk i are order[start[i]:start[i]+count[i]]
+    and lower, upper are the bounds of their positions."""
+    count = len(position)
+    lower = np.full(3, np.inf, dtype=np.float32)
+    upper = np.full(3, -np.inf, dtype=np.float32)
+    for start in range(0, count, chunkSize):
+        chunk = np.asarray(position[start:start + chunkSize], dtype=np.float32)
+        lower = np.minimum(lower, chunk.min(axis=0))
+        upper = np.maximum(upper, chunk.max(axis=0))
+    cellsPerAxis = int(np.clip(round((count / particlesPerChunk) ** (1 / 3)), 1, maxCellsPerAxis))
+    cellSize = np.maximum((upper - lower) / cellsPerAxis, np.finfo(np.float32).tiny)
+    cells = cellsPerAxis ** 3
+
+    def cellIds(chunk):
+        cell = np.clip(np.floor((chunk - lower) / cellSize).astype(np.int64), 0, cellsPerAxis - 1)
+        return (cell[:, 2] * cellsPerAxis + cell[:, 1]) * cellsPerAxis + cell[:, 0]
+
+    # first pass counts, second pass scatters every chunk into its place and computes the cell bounds
+    cellCount = np.zeros(cells, dtype=np.int64)
+    for start in range(0, count, chunkSize):
+        cellCount += np.bincount(cellIds(np.asarray(position[start:start + chunkSize], dtype=np.float32)),
+                                 minlength=cells)
+    cellStart = np.cumsum(cellCount) - cellCount
+    cursor = cellStart.copy()
+    order = np.empty(count, dtype=np.uint32)
+    cellLower = np.full((cells, 3), np.inf, dtype=np.float32)
+    cellUpper = np.full((cells, 3), -np.inf, dtype=np.float32)
+    for start in range(0, count, chunkSize):
+        chunk = np.asarray(position[start:start + chunkSize], dtype=np.float32)
+        ids = cellIds(chunk)
+        sort = np.argsort(ids, kind='stable')
+        sortedIds = ids[sort]
+        groupStart = np.flatnonzero(np.r_[True, sortedIds[1:] != sortedIds[:-1]])
+        groupIds = sortedIds[groupStart]
+        groupLength = np.diff(np.r_[groupStart, len(ids)])
+        rank = np.arange(len(ids)) - np.repeat(groupStart, groupLength)
+        order[cursor[sortedIds] + rank] = start + sort
+        cursor[groupIds] += groupLength
+        cellLower[groupIds] = np.minimum(cellLower[groupIds], np.minimum.reduceat(chunk[sort], groupStart, axis=0))
+        cellUpper[groupIds] = np.maximum(cellUpper[groupIds], np.maximum.reduceat(chunk[sort], groupStart, axis=0))
+
+    # split full cells into chunks of at most particlesPerChunk particles, they share the bounds of the cell
+    used = np.flatnonzero(cellCount)
+    pieces = (cellCount[used] + particlesPerChunk - 1) // particlesPerChunk
+    cellOfChunk = np.repeat(used, pieces)
+    piece = np.arange(len(cellOfChunk)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    chunkStart = cellStart[cellOfChunk] + piece * particlesPerChunk
+    chunkCount = np.minimum(cellCount[cellOfChunk] - piece * particlesPerChunk, particlesPerChunk)
+    return order, chunkStart, chunkCount, cellLower[cellOfChunk], cellUpper[cellOfChunk]
+
+
+class ResidencyManager:
+    """Out of core rendering of particle sets larger than the gpu memory. Particles are split into spatial chunks,
+    only as many chunks as fit into budgetBytes are kept in a pool of gpu buffer slots. Every frame the chunks in
+    the view frustum are requested by particle count over squared distance to the camera. Missing ones are uploaded
+    (at most uploadBytesPerFrame per frame) and replace the least recently used chunks that are not needed.
+    The arrays are kept by reference and only read when a chunk is uploaded, so they can be memory mapped."""
+
+    def __init__(self, position, vector=None, scalar=None, radius=None, budgetBytes=1 << 30,
+                 particlesPerChunk=1 << 18, uploadBytesPerFrame=64 << 20):
+        self.arrays = {'position': position, 'vector': vector, 'scalar': scalar, 'radius': radius}
+        self.uploadBytesPerFrame = uploadBytesPerFrame  # limits the time spent uploading in a single frame
+        self.count = len(position)
+
+        self._order, self._chunkStart, self._chunkCount, self._chunkLower, self._chunkUpper = \
+            _spatialChunks(position, particlesPerChunk)
+        self._chunkCenter = 0.5 * (self._chunkLower + self._chunkUpper)
+
+        # the pool has at least one slot, even if a chunk does not fit into the budget
+        self.slotSize = int(self._chunkCount.max()) if len(self._chunkCount) > 0 else 1
+        slots = int(np.clip(budgetBytes // (self.slotSize * BYTES_PER_PARTICLE), 1, max(len(self._chunkCount), 1)))
+        self.buffer = ParticleBuffer()
+        self.buffer.resize(slots * self.slotSize)
+        self._slotChunk = np.full(slots, -1, dtype=np.int64)  # chunk stored in every slot, -1 for free slots
+        self._slotLastUsed = np.full(slots, -1, dtype=np.int64)  # frame in which the slot was last drawn
+        self._chunkSlot = np.full(len(self._chunkCount), -1, dtype=np.int64)
+        self._frame = 0
+        self._drawn = None  # chunks in the current index array
+        self._indices = np.zeros(0, dtype=np.uint32)
+
+        # statistics
+        self.uploadedBytes = 0  # in the last frame
+        self.uploadedChunks = 0  # in total
+        self.evictedChunks = 0  # in total
+        self.visibleChunks = 0  # in the last frame
+
+    @property
+    def chunkCount(self):
+        return len(self._chunkCount)
+
+    @property
+    def slotCount(self):
+        return len(self._slotChunk)
+
+    def _upload(self, chunk, slot):
+        start = self._chunkStart[chunk]
+        count = int(self._chunkCount[chunk])
+        # particles of a chunk are sorted by index, so reading them from a memory mapped file is sequential
+        indices = self._order[start:start + count]
+        data = {}
+        for name, array in self.arrays.items():
+            shape = (count, 3) if name in ('position', 'vector') else (count,)
+            if array is None:
+                # the slot may contain data of an evicted chunk
+                data[name] = np.zeros(shape, dtype=np.float32)
+            else:
+                data[name] = np.asarray(array[indices], dtype=np.float32).reshape(shape)
+        self.buffer.setData(offset=slot * self.slotSize, **data)
+
+        if self._slotChunk[slot] >= 0:
+            self._chunkSlot[self._slotChunk[slot]] = -1
+            self.evictedChunks += 1
+        self._slotChunk[slot] = chunk
+        self._chunkSlot[chunk] = slot
+        self.uploadedChunks += 1
+        self.uploadedBytes += count * BYTES_PER_PARTICLE
+
+    def update(self, view, projection, margin=0.0):
+        """Upload missing chunks for the view and projection (glm or vispy layout). Returns (indices, changed),
+        indices are the slots of the particles to draw from self.buffer and changed is False if they are the same
+        as returned by the last call. margin is added to the chunk bounds, eg the largest particle radius."""
+        self._frame += 1
+        self.uploadedBytes = 0
+        view = glmToNumpy(view)
+        planes = frustumPlanes(view @ glmToNumpy(projection))
+        visible = np.flatnonzero(boxesInFrustum(planes, self._chunkLower - margin, self._chunkUpper + margin))
+        self.visibleChunks = len(visible)
+        cameraPosition = np.linalg.inv(view)[3, :3]
+        # close chunks with many particles contribute most to the image
+        distance = np.linalg.norm(self._chunkCenter[visible] - cameraPosition, axis=1)
+        priority = self._chunkCount[visible] / np.maximum(distance, 1e-6) ** 2
+        wanted = visible[np.argsort(-priority, kind='stable')][:self.slotCount]
+
+        wantedMask = np.zeros(len(self._chunkCount), dtype=bool)
+        wantedMask[wanted] = True
+        resident = wanted[self._chunkSlot[wanted] >= 0]
+        self._slotLastUsed[self._chunkSlot[resident]] = self._frame
+
+        for chunk in wanted[self._chunkSlot[wanted] < 0]:
+            if self.uploadedBytes >= self.uploadBytesPerFrame:
+                break
+            # free slots first, then the least recently used slot that holds a chunk we do not need now
+            replaceable = (self._slotChunk < 0) | ~wantedMask[np.maximum(self._slotChunk, 0)]
+            candidates = np.flatnonzero(replaceable)
+            if len(candidates) == 0:
+                break
+            slot = candidates[np.argmin(self._slotLastUsed[candidates])]
+            self._upload(chunk, slot)
+            self._slotLastUsed[slot] = self._frame
+
+        drawn = np.sort(wanted[self._chunkSlot[wanted] >= 0])
+        if self._drawn is not None and np.array_equal(drawn, self._drawn):
+            return self._indices, False
+        self._drawn = drawn
+        slots = self._chunkSlot[drawn]
+        length = self._chunkCount[drawn]
+        offset = np.repeat(slots * self.slotSize - (np.cumsum(length) - length), length)
+        self._indices = (np.arange(int(length.sum()), dtype=np.int64) + offset).astype(np.uint32)
+        return self._indices, True
+
+    def bounds(self):
+        """(lower, upper) of all positions"""
+        return self._chunkLower.min(axis=0), self._chunkUpper.max(axis=0)
+
+    def statistics(self):
+        """residency of the last frame as dict"""
+        resident = self._slotChunk >= 0
+        return {'chunks': self.chunkCount, 'visibleChunks': self.visibleChunks,
+                'residentChunks': int(resident.sum()), 'slots': self.slotCount,
+                'drawnParticles': len(self._indices), 'particles': self.count,
+                'residentParticles': int(self._chunkCount[self._slotChunk[resident]].sum()),
+                'budgetBytes': self.slotCount * self.slotSize * BYTES_PER_PARTICLE,
+                'uploadedBytes': self.uploadedBytes,
+                'uploadedChunks': self.uploadedChunks, 'evictedChunks': self.evictedChunks}
+
+    def summary(self):
+        statistics = self.statistics()
+        return 'resident {residentChunks}/{chunks} chunks, {visibleChunks} visible, {drawnParticles} drawn, ' \
+               '{uploadedBytes} bytes uploaded'.format(**statistics)
@@ -0,0 +1,12 @@
+#version 450
+
+in float splatWeight;
+
+out vec4 fragment_color;
+
+// rendered with additive blending into a float framebuffer,
+// red counts the particles that fall into the pixel and green sums up their scalars
+void main()
+{
+    fragment_color = vec4(1.0f, splatWeight, 0.0f, 0.0f);
+}
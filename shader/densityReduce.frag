@@ -0,0 +1,34 @@
+#version 450
+
+out vec4 fragment_color;
+
+uniform sampler2D accumulated; // particle count in red and scalar sum in green, see densityAccumulate.frag
+uniform ivec2 blockSize; // pixels of the accumulated image covered by one pixel of the reduced image
+uniform int densityMode; // 0: particle count, 1: sum of the scalars, 2: mean scalar
+
+// reduces every block of the accumulated image to (smallest value, largest value, one sample value, pixels with
+// particles), the canvas reads the small result back to scale the density (see densitySplat.scalingFromReduction)
+void main()
+{
+    const ivec2 accumulatedSize = textureSize(accumulated, 0);
+    const ivec2 first = ivec2(gl_FragCoord.xy) * blockSize;
+    const ivec2 last = min(first + blockSize, accumulatedSize);
+
+    float lowest = 3.4e38f;
+    float highest = -3.4e38f;
+    float sampled = 0.0f;
+    float filled = 0.0f;
+    for(int y = first.y; y < last.y; y++)
+        for(int x = first.x; x < last.x; x++)
+        {
+            const vec2 pixel = texelFetch(accumulated, ivec2(x, y), 0).rg;
+            if(pixel.r <= 0.0f)
+                continue;
+            const float value = densityMode == 0 ? pixel.r : (densityMode == 1 ? pixel.g : pixel.g / pixel.r);
+            lowest = min(lowest, value);
+            highest = max(highest, value);
+            sampled = value;
+            filled += 1.0f;
+        }
+    fragment_color = vec4(lowest, highest, sampled, filled);
+}
@@ -0,0 +1,61 @@
+#version 450
+
+in vec2 texcoord;
+
+out vec4 fragment_color;
+
+uniform sampler2D accumulated; // particle count in red and scalar sum in green, see densityAccumulate.frag
+uniform int densityMode; // 0: particle count, 1: sum of the scalars, 2: mean scalar
+uniform int densityScaling; // 0: linear, 1: log, 2: equalize
+uniform float densityLow; // smallest value of all pixels with particles
+uniform float densityHigh; // largest value of all pixels with particles
+uniform sampler1D equalizeTable; // values at equally spaced quantiles, for equalize scaling
+uniform bool customTransferFunc; // set to true to use the custom transfer function (the sampler 1D)
+uniform sampler1D transferFunc; // the custom transfer function
+uniform float brightness; // additional brightness control
+
+// same as in particleRenderer.vert
+vec3 defaultTransferFunc(float v)
+{
+    return vec3((v*2.0f) +0.3f, (v) +0.1f, (0.5f*v) +0.1f);
+}
+
+// map the value to [0,1], the same as densitySplat.scaleDensity() but with the range of the previous frame
+float scaleDensity(const float value)
+{
+    if(densityScaling == 2)
+    {
+        // number of quantiles not larger than the value, found by binary search
+        const int size = textureSize(equalizeTable, 0);
+        int lower = 0;
+        int upper = size;
+        while(lower < upper)
+        {
+            const int middle = (lower + upper) / 2;
+            if(texelFetch(equalizeTable, middle, 0).r <= value)
+                lower = middle + 1;
+            else
+                upper = middle;
+        }
+        return float(lower) / float(size);
+    }
+    if(densityScaling == 1)
+        return log(1.0f + max(value - densityLow, 0.0f)) / max(log(1.0f + densityHigh - densityLow), 1.17549435e-38f);
+    return (value - densityLow) / max(densityHigh - densityLow, 1.17549435e-38f);
+}
+
+void main()
+{
+    const vec2 pixel = texture(accumulated, texcoord).rg;
+    if(pixel.r <= 0.0f)
+        discard;
+
+    const float value = densityMode == 0 ? pixel.r : (densityMode == 1 ? pixel.g : pixel.g / pixel.r);
+    const float scaled = clamp(scaleDensity(value), 0.0f, 1.0f);
+    vec3 color;
+    if(customTransferFunc)
+        color = texture(transferFunc, scaled).xyz;
+    else
+        color = defaultTransferFunc(scaled);
+    fragment_color = vec4(color * brightness, 1.0f);
+}
@@ -0,0 +1,11 @@
+#version 450
+
+in vec2 input_position; // corner of the screen filling quad in [-1,1]^2
+
+out vec2 texcoord;
+
+void main()
+{
+    texcoord = 0.5f * input_position + vec2(0.5f);
+    gl_Position = vec4(input_position, 0.0f, 1.0f);
+}
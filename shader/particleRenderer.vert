@@ -4,6 +4,11 @@ in vec3 input_position; // positions where spheres are rendered
 in vec3 input_vector; // vector field for color
 in float input_scalar; // scalar field for color
 in float input_radius; // size of each particle, if size per particle is enabled
+in vec2 input_packed; // compact layout: vector as 10/10/10 snorm and scalar / radius as two halfs, see packing.py
+in vec2 input_quantizedPosition; // compact layout: position as 3x20 bit fixed point inside of the bounds
+in vec3 input_positionNext; // interpolated playback: position in the next snapshot
+in vec3 input_vectorNext; // interpolated playback: vector in the next snapshot
+in float input_scalarNext; // interpolated playback: scalar in the next snapshot
 
 uniform vec3 defaultColor; // particle color in color mode 0
 uniform float brightness; // additional brightness control
@@ -15,9 +20,48 @@ uniform bool enableSizePerParticle; // should every particle have a differnt siz
 uniform float sphereRadius; // radius of the spheres when enableSizePerParticle is false
 uniform bool customTransferFunc; // set to true to use the custom transfer function (the sampler 1D)
 uniform sampler1D transferFunc; // the custom transfer function
+uniform int vertexLayout; // 0: one float attribute per field, 1: compact layout, 2: compact layout with quantized positions
+uniform vec3 boundsMin; // lower corner of the bounding box used for quantized positions
+uniform vec3 boundsExtent; // size of the bounding box used for quantized positions
+uniform float vectorScale; // vectors of the compact layout are stored relative to this length
+uniform int interpolation; // 0: show the attributes as they are, 1: blend linearly to the next snapshot, 2: hermite
+uniform float time; // position between the current (0) and the next snapshot (1)
+uniform float snapshotInterval; // simulation time between the snapshots, scales the vectors (velocities) for hermite
+uniform int trailLength; // trails drawn as spheres: number of slots in the ring of positions (see trails.py), else 0
+uniform int trailHead; // trails: ring slot of the newest positions
+uniform int trailFilled; // trails: number of slots written so far
+uniform int trailParticles; // trails: number of particles in every slot
 
+#if defined(INSTANCED_QUADS) || defined(DENSITY_SPLAT)
+// no geometry shader, so the vertex shader transforms into clip space itself
+uniform mat4 view; // view matrix
+uniform mat4 projection; // projection matrix
+
+vec3 sphereColor;
+float particleRadius;
+#else
 out vec3 sphereColor;
 out float particleRadius;
+#endif
+
+#ifdef INSTANCED_QUADS
+// instanced quads: the particle attributes above advance once per instance, this once per quad corner
+in vec2 input_corner; // corner of the quad in [-1,1]^2
+
+uniform float spriteScale; // increase for high fild of view, if spheres seem to be cut of on the edges
+uniform bool renderFlatDisks; // render disks instead of spheres
+
+flat out vec3 color;
+flat out float radius;
+flat out vec4 viewSphereCenter;
+smooth out vec2 texcoord;
+smooth out vec4 viewPosOnPlane;
+#endif
+
+#ifdef DENSITY_SPLAT
+// density splatting: every particle is a single pixel, see densityAccumulate.frag
+out float splatWeight;
+#endif
 
 // some helper functions
 bool iszero(float f)
@@ -35,6 +79,38 @@ bool iszero(vec3 v)
     return iszero(length(v));
 }
 
+// the 31 payload bits of a compact layout word, the float holding them is always normal and finite (see packing.py)
+uint decodeWord(uint bits)
+{
+    return ((bits & 0x7FFFFFFFu) - 0x00800000u) | ((bits >> 31u) << 30u);
+}
+
+// unpack 3 signed normalized 10 bit integers
+vec3 unpackSnorm3x10(uint bits)
+{
+    // move each value to the top of the word, then sign extend it by an arithmetic shift
+    const ivec3 v = ivec3(int(bits << 22u), int(bits << 12u), int(bits << 2u)) >> 22;
+    return max(vec3(v) / 511.0f, vec3(-1.0f));
+}
+
+// unpack 3 unsigned 20 bit fixed point values spread over two words
+vec3 unpackQuantizedPosition(uvec2 bits)
+{
+    const uvec3 q = uvec3( bits.x & 0xFFFFFu,
+                           (bits.x >> 20u) | ((bits.y & 0x1FFu) << 11u),
+                           (bits.y >> 9u) & 0xFFFFFu);
+    return boundsMin + vec3(q) / 1048575.0f * boundsExtent;
+}
+
+// cubic hermite curve through both positions with the vector field as velocity
+vec3 hermite(const vec3 p0, const vec3 v0, const vec3 p1, const vec3 v1, const float t)
+{
+    const float t2 = t*t;
+    const float t3 = t2*t;
+    return (2.0f*t3 - 3.0f*t2 + 1.0f) * p0 + (t3 - 2.0f*t2 + t) * snapshotInterval * v0
+         + (3.0f*t2 - 2.0f*t3) * p1 + (t3 - t2) * snapshotInterval * v1;
+}
+
 // used if no texture is set as the transfer function
 // v is a value between 0 and 1
 vec3 defaultTransferFunc(float v)
@@ -42,33 +118,130 @@ vec3 defaultTransferFunc(float v)
     return vec3((v*2.0f) +0.3f, (v) +0.1f, (0.5f*v) +0.1f);
 }
 
+#ifdef INSTANCED_QUADS
+// does the same as particleRenderer.geom, but for the single corner input_corner of the quad
+void expandQuad(const vec4 worldPosition)
+{
+    color = sphereColor;
+    radius = particleRadius;
+    viewSphereCenter = view * worldPosition;
+
+    // build transform matrix to get the quad from camera origin to it's proper position in camera (view) coordinates
+    // matrix is filled collum major
+    mat4 transform;
+    if( projection[3][3] > 0 )
+    {
+        // we are dealing with orthografic projection,
+        // only move it to the proper position
+
+        // for spheres the sprite is moved by radius in the z-direction (to allow early z test)
+        float moveToCamera=radius;
+        if(renderFlatDisks)
+            moveToCamera = 0;
+
+        transform = mat4(   1.0f, 0.0f, 0.0f, 0.0f, //LEFT
+                            0.0f, 1.0f, 0.0f, 0.0f, //UP
+                            0.0f, 0.0f, 1.0f, 0.0f, //FORWARD
+                            viewSphereCenter.x,
+                            viewSphereCenter.y,
+                            viewSphereCenter.z + moveToCamera,
+                            1.0f);//POSITION
+    }
+    else
+    {
+        // we deal with perspective projection
+        // rotation to face the camera
+        const vec3 direction = normalize(-viewSphereCenter.xyz);
+        const vec3 upGuess = vec3(0,1,0);
+        const vec3 left = cross(direction,upGuess);
+        const vec3 up = cross(left,direction);
+
+        // for spheres the sprite is moved by radius in the direction of the camera (to allow early z test)
+        float moveToCamera=radius;
+        if(renderFlatDisks)
+            moveToCamera = 0;
+
+        // move(viewSphereCenter) * rotate * move(radius)
+        transform = mat4(   left.x, left.y, left.z, 0.0f, //LEFT
+                            up.x, up.y, up.z, 0.0f, //UP
+                            direction.x, direction.y, direction.z, 0.0f, //FORWARD
+                            viewSphereCenter.x + direction.x*moveToCamera,
+                            viewSphereCenter.y + direction.y*moveToCamera,
+                            viewSphereCenter.z + direction.z*moveToCamera,
+                            1.0f);//POSITION
+    }
+
+    texcoord = input_corner * spriteScale;
+    viewPosOnPlane = transform * vec4( texcoord * radius, 0.0f, 1.0f);
+    gl_Position = projection * viewPosOnPlane;
+}
+#endif
+
 // see https://github.com/tdd11235813/spheres_shader/tree/master/src/shader
 // and: https://paroj.github.io/gltut/Illumination/Tutorial%2013.html
 // as well as chapter 14 and 15
 // for sphere imposter rendering
 void main()
 {
-	gl_Position = model * vec4(input_position.xyz,1.0);
+    vec3 position;
+    vec3 vector;
+    float scalar;
+    float radius;
+    if(vertexLayout == 0)
+    {
+        position = input_position;
+        vector = input_vector;
+        scalar = input_scalar;
+        radius = input_radius;
+
+        // interpolated playback, the attributes of the next snapshot are resident in a second set of buffers
+        if(interpolation == 2)
+            position = hermite(position, vector, input_positionNext, input_vectorNext, time);
+        else if(interpolation == 1)
+            position = mix(position, input_positionNext, time);
+        if(interpolation != 0)
+        {
+            vector = mix(vector, input_vectorNext, time);
+            scalar = mix(scalar, input_scalarNext, time);
+        }
+    }
+    else
+    {
+        // compact data is uploaded as float attributes without conversion, so the bits arrive unchanged
+        const uvec2 packedBits = uvec2(decodeWord(floatBitsToUint(input_packed.x)),
+                                       decodeWord(floatBitsToUint(input_packed.y)));
+        vector = unpackSnorm3x10(packedBits.x) * vectorScale;
+        const vec2 scalarRadius = unpackHalf2x16(packedBits.y);
+        scalar = scalarRadius.x;
+        radius = scalarRadius.y;
+        if(vertexLayout == 2)
+            position = unpackQuantizedPosition(uvec2(decodeWord(floatBitsToUint(input_quantizedPosition.x)),
+                                                     decodeWord(floatBitsToUint(input_quantizedPosition.y))));
+        else
+            position = input_position;
+    }
+
+	gl_Position = model * vec4(position.xyz,1.0);
 
     switch(colorMode)
     {
     case 1: // vector field direction
-        if(iszero(input_vector))
+        if(iszero(vector))
             sphereColor = defaultColor;
         else
         {
-            sphereColor = 0.5f*normalize(input_vector)+vec3(0.5f);
+            sphereColor = 0.5f*normalize(vector)+vec3(0.5f);
         }
         break;
     case 2: // vector magnitude
-        float leng = smoothstep(lowerBound,upperBound,length(input_vector));
+        float leng = smoothstep(lowerBound,upperBound,length(vector));
         if(customTransferFunc)
             sphereColor = texture(transferFunc,leng).xyz;
         else
             sphereColor = defaultTransferFunc(leng);
         break;
     case 3: // scalar
-        float rho = smoothstep(lowerBound , upperBound, input_scalar);
+        float rho = smoothstep(lowerBound , upperBound, scalar);
         if(customTransferFunc)
             sphereColor = texture(transferFunc,rho).xyz;
         else
@@ -81,9 +254,33 @@ void main()
     }
 
     if(enableSizePerParticle)
-        particleRadius = input_radius;
+        particleRadius = radius;
     else
         particleRadius = sphereRadius;
 
     sphereColor *= brightness;
+
+    if(trailLength > 0)
+    {
+        // the index into the ring tells the age of the position, the newest ones are drawn as the particles
+        // themselves, older ones shrink until they vanish at the end of the trail
+#ifdef INSTANCED_QUADS
+        const int ringIndex = gl_InstanceID;
+#else
+        const int ringIndex = gl_VertexID;
+#endif
+        const int age = (trailHead - ringIndex / trailParticles + trailLength) % trailLength;
+        if(age > 0 && age < trailFilled)
+            particleRadius *= 1.0f - float(age) / float(trailFilled);
+        else
+            particleRadius = 0.0f;
+    }
+
+#ifdef INSTANCED_QUADS
+    expandQuad(gl_Position);
+#endif
+#ifdef DENSITY_SPLAT
+    splatWeight = scalar;
+    gl_Position = projection * view * gl_Position;
+#endif
 }
\ No newline at end of file
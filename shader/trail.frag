@@ -0,0 +1,14 @@
+#version 450
+
+in vec3 color;
+in float fade;
+in float valid;
+
+out vec4 fragment_color;
+
+void main()
+{
+    if(valid < 0.999f)
+        discard;
+    fragment_color = vec4(color, fade);
+}
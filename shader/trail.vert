@@ -0,0 +1,52 @@
+#version 450
+
+in vec3 input_position; // ring of trail positions, see trails.py
+in float input_scalar; // ring of trail scalars
+
+uniform mat4 model; // model matrix of the object
+uniform mat4 view; // view / camera matrix
+uniform mat4 projection; // projection matrix
+uniform int trailHead; // ring slot of the newest positions
+uniform int trailLength; // number of slots in the ring
+uniform int trailFilled; // number of slots written so far
+uniform int trailParticles; // number of particles in every slot
+uniform vec3 defaultColor; // trail color unless colored by the scalar field
+uniform int colorMode; // 3: color by scalar field, everything else uses the default color
+uniform float upperBound; // highest value of the scalar field
+uniform float lowerBound; // lowest value of the scalar field
+uniform bool customTransferFunc; // set to true to use the custom transfer function (the sampler 1D)
+uniform sampler1D transferFunc; // the custom transfer function
+uniform float brightness; // additional brightness control
+
+out vec3 color;
+out float fade; // 1 at the particle, 0 at the end of the trail
+out float valid; // less than one on segments that touch a slot without positions
+
+// same as in particleRenderer.vert
+vec3 defaultTransferFunc(float v)
+{
+    return vec3((v*2.0f) +0.3f, (v) +0.1f, (0.5f*v) +0.1f);
+}
+
+void main()
+{
+    // the vertex index is the index into the ring, so it tells the age of the position
+    const int age = (trailHead - gl_VertexID / trailParticles + trailLength) % trailLength;
+    // the oldest slot is also excluded, the segment between it and the newest one closes the ring
+    const int visibleAges = min(trailFilled, trailLength - 1);
+    valid = age < visibleAges ? 1.0f : 0.0f;
+    fade = 1.0f - float(age) / float(max(visibleAges - 1, 1));
+
+    color = defaultColor;
+    if(colorMode == 3)
+    {
+        const float rho = smoothstep(lowerBound, upperBound, input_scalar);
+        if(customTransferFunc)
+            color = texture(transferFunc, rho).xyz;
+        else
+            color = defaultTransferFunc(rho);
+    }
+    color *= brightness;
+
+    gl_Position = projection * view * model * vec4(input_position, 1.0f);
+}
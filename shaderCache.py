@@ -0,0 +1,173 @@
+import hashlib
+import os
+import re
+import struct
+
+import numpy as np
+import vispy
+from vispy.gloo import glir
+
+# shader sources are shipped next to this file, so the viewer works from any working directory
+SHADER_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shader')
+# the program cache replaces GLIR classes of vispy and repeats the bookkeeping of GlirProgram.link_program(),
+# so it is only installed for the vispy versions (major, minor) it was checked against, [first, last)
+PROGRAM_CACHE_VISPY_VERSIONS = ((0, 17), (0, 18))
+
+
+def loadShader(name, defines=()):
+    """returns the source of shader file name from the shader directory,
+    with a #define line for every name in defines inserted after the #version line"""
+    with open(os.path.join(SHADER_DIRECTORY, name), 'r') as file:
+        source = file.read()
+    if defines:
+        version, newline, rest = source.partition('\n')
+        source = version + newline + ''.join('#define {}\n'.format(define) for define in defines) + rest
+    return source
+
+
+def cacheDirectory():
+    """directory for files cached between runs, set PARTICLEVIS_CACHE to change it"""
+    directory = os.environ.get('PARTICLEVIS_CACHE')
+    if not directory:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        directory = os.path.join(base, 'ParticleVis')
+    return directory
+
+
+def programKey(driver, shaders):
+    """cache key of a program, driver is the gl vendor, renderer and version as bytes,
+    shaders a list of (target, source) of all its shaders"""
+    key = hashlib.sha256(driver)
+    for target, code in shaders:
+        key.update(b'\0' + str(target).encode() + b'\0' + code.encode('utf-8'))
+    return key.hexdigest()
+
+
+def programCacheSupported(version=None):
+    """True if the program cache can be installed with the vispy version string (default: the one imported)"""
+    numbers = re.findall(r'\d+', version or vispy.__version__)[:2]
+    if len(numbers) < 2:
+        return False
+    first, last = PROGRAM_CACHE_VISPY_VERSIONS
+    return first <= tuple(int(number) for number in numbers) < last
+
+
+def _integer(value):
+    # PyOpenGL returns integer queries as python int or as array, depending on the platform
+    return int(np.ravel(value)[0])
+
+
+class _DeferredShader:
+    """Stores the shader source instead of compiling it, the program compiles it only if no cached binary exists"""
+
+    def set_data(self, offset, code):
+        self.code = code
+        self.compiled = False
+
+    def compile(self):
+        if not self.compiled:
+            super().set_data(0, self.code)
+            self.compiled = True
+
+
+class _CachedProgram(glir.GlirProgram):
+    """GLIR program that loads the linked program binary from disk (glProgramBinary) when the same sources were
+    linked before with the same driver, and stores it after linking otherwise."""
+
+    directory = None  # set by installProgramCache()
+
+    def attach(self, id_):
+        # shaders are attached when linking, so nothing is compiled if the binary can be loaded
+        self._attached_shaders.append(self._parser.get_object(id_))
+
+    def link_program(self):
+        from OpenGL import GL
+        try:
+            binarySupported = _integer(GL.glGetIntegerv(GL.GL_NUM_PROGRAM_BINARY_FORMATS)) > 0
+            driver = b'\0'.join(GL.glGetString(name) or b'' for name in (GL.GL_VENDOR, GL.GL_RENDERER, GL.GL_VERSION))
+        except Exception:
+            binarySupported = False
+        if not binarySupported:
+            self._compileAndLink()
+            return
+
+        key = programKey(driver, [(shader._target, shader.code) for shader in self._attached_shaders])
+        path = os.path.join(self.directory, key + '.bin')
+
+        if self._loadBinary(GL, path):
+            # same bookkeeping as glir.GlirProgram.link_program() does after linking
+            self._attached_shaders = []
+            self._unset_variables = self._get_active_attributes_and_uniforms()
+            self._handles = {}
+            self._known_invalid = set()
+            self._attributes = {}
+            self._samplers = {}
+            self._linked = True
+            return
+
+        GL.glProgramParameteri(self._handle, GL.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL.GL_TRUE)
+        self._compileAndLink()
+        self._storeBinary(GL, path)
+
+    def _compileAndLink(self):
+        for shader in self._attached_shaders:
+            shader.compile()
+            glir.gl.glAttachShader(self._handle, shader.handle)
+        glir.GlirProgram.link_program(self)
+
+    def _loadBinary(self, GL, path):
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return False
+        if len(data) <= 4:
+            return False
+        binaryFormat, = struct.unpack('<I', data[:4])
+        binary = np.frombuffer(data, dtype=np.uint8, offset=4)
+        try:
+            GL.glProgramBinary(self._handle, binaryFormat, binary, len(binary))
+            return _integer(GL.glGetProgramiv(self._handle, GL.GL_LINK_STATUS)) != 0
+        except GL.GLError:
+            # the driver rejected the binary, eg after an update that did not change the version string
+            return False
+
+    def _storeBinary(self, GL, path):
+        try:
+            length = _integer(GL.glGetProgramiv(self._handle, GL.GL_PROGRAM_BINARY_LENGTH))
+            if length == 0:
+                return
+            binary = np.empty(length, dtype=np.uint8)
+            written = np.zeros(1, dtype=np.int32)
+            binaryFormat = np.zeros(1, dtype=np.uint32)
+            GL.glGetProgramBinary(self._handle, length, written, binaryFormat, binary)
+            os.makedirs(self.directory, exist_ok=True)
+            # write to a temporary file first, so a concurrent start never reads half a binary
+            temporary = '{}.{}.tmp'.format(path, os.getpid())
+            with open(temporary, 'wb') as file:
+                file.write(struct.pack('<I', int(binaryFormat[0])))
+                file.write(binary[:int(written[0])].tobytes())
+            os.replace(temporary, path)
+        except (OSError, GL.GLError):
+            # the cache is only an optimization
+            pass
+
+
+def installProgramCache(canvas, directory=None):
+    """Make the GLIR parser of canvas cache linked programs in directory (default: cacheDirectory()/programs).
+    Must be called before the first program of the canvas is created. The cache key is a hash of all shader sources
+    and the gl vendor, renderer and version string, drivers without program binary support compile as usual.
+    Relies on vispy internals, with other vispy versions (see PROGRAM_CACHE_VISPY_VERSIONS) nothing is installed.
+    Returns whether the cache was installed."""
+    if not programCacheSupported():
+        return False
+    parser = canvas.context.shared.parser
+    classmap = getattr(parser, '_classmap', None)
+    if classmap is None or not hasattr(glir.GlirProgram, '_get_active_attributes_and_uniforms'):
+        return False
+    directory = directory or os.path.join(cacheDirectory(), 'programs')
+    classmap['Program'] = type('CachedProgram', (_CachedProgram,), {'directory': directory})
+    for name in ('VertexShader', 'FragmentShader', 'GeometryShader'):
+        if not issubclass(classmap[name], _DeferredShader):
+            classmap[name] = type(classmap[name].__name__, (_DeferredShader, classmap[name]), {})
+    return True
@@ -0,0 +1,177 @@
+import json
+import mmap
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# file layout:
+#   header: 8 byte magic, uint64 offset of the index
+#   raw little endian float32 arrays, each one aligned to the page size
+#   index: utf-8 json describing every snapshot and where its arrays are stored
+_MAGIC = b'PVSNAPS1'
+_HEADER = struct.Struct('<8sQ')
+_ALIGNMENT = mmap.PAGESIZE
+
+# array name and number of float components per particle
+_ARRAYS = {'position': 3, 'vector': 3, 'scalar': 1, 'radius': 1}
+
+
+class Snapshot:
+    """particle data of a single timestep, arrays are read-only views into the memory mapped file
+    attributes that were not stored are None"""
+
+    def __init__(self, index, time, position, vector=None, scalar=None, radius=None):
+        self.index = index
+        self.time = time
+        self.position = position
+        self.vector = vector
+        self.scalar = scalar
+        self.radius = radius
+
+    def arrays(self):
+        """returns the stored arrays as a dict that can be passed to Canvas.setParticles()"""
+        return {name: getattr(self, name) for name in _ARRAYS if getattr(self, name) is not None}
+
+
+class SnapshotWriter:
+    """Writes a series of snapshots into one file. Use as a context manager or call close() when done."""
+
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._file.write(_HEADER.pack(_MAGIC, 0))
+        self._snapshots = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def write(self, position, vector=None, scalar=None, radius=None, time=None):
+        """append the next timestep, position and vector are expected as (n,3), scalar and radius as (n,)"""
+        count = len(position)
+        entry = {'time': len(self._snapshots) if time is None else float(time), 'count': count, 'arrays': {}}
+        for name, array in (('position', position), ('vector', vector), ('scalar', scalar), ('radius', radius)):
+            if array is None:
+                continue
+            array = np.ascontiguousarray(array, dtype='<f4').reshape((count, _ARRAYS[name]) if _ARRAYS[name] > 1 else count)
+            self._file.seek(-self._file.tell() % _ALIGNMENT, 1)
+            entry['arrays'][name] = self._file.tell()
+            self._file.write(array.data)
+        self._snapshots.append(entry)
+
+    def close(self):
+        if self._file.closed:
+            return
+        indexOffset = self._file.seek(0, 2)
+        self._file.write(json.dumps({'version': 1, 'snapshots': self._snapshots}).encode('utf-8'))
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(_MAGIC, indexOffset))
+        self._file.close()
+
+
+class SnapshotSeries:
+    """Read access to a snapshot file. The file is memory mapped, so accessing a snapshot does not copy or read
+    anything, the data is paged in by the os when it is first used."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            magic, indexOffset = _HEADER.unpack(file.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise ValueError(str(path) + " is not a particle snapshot file")
+            file.seek(indexOffset)
+            self._snapshots = json.loads(file.read().decode('utf-8'))['snapshots']
+        self._map = np.memmap(path, dtype=np.uint8, mode='r')
+
+    def __len__(self):
+        return len(self._snapshots)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("snapshot index out of range")
+        entry = self._snapshots[index]
+        count = entry['count']
+        arrays = {}
+        for name, offset in entry['arrays'].items():
+            components = _ARRAYS[name]
+            raw = self._map[offset:offset + count * components * 4]
+            arrays[name] = raw.view('<f4').reshape((count, components) if components > 1 else count)
+        return Snapshot(index, entry['time'], **arrays)
+
+    def times(self):
+        return [entry['time'] for entry in self._snapshots]
+
+    def load(self, index):
+        """returns the snapshot and makes sure all its pages are read from disk"""
+        snapshot = self[index]
+        for array in snapshot.arrays().values():
+            # touch one byte per page, the os reads the file in large sequential chunks
+            raw = array.reshape(-1).view(np.uint8)
+            if raw.size > 0:
+                raw[::mmap.PAGESIZE].max()
+        return snapshot
+
+
+class SnapshotPrefetcher:
+    """Loads snapshots of a SnapshotSeries in background threads, always keeping the next
+    lookahead snapshots after the one currently shown in flight.
+    onLoad(snapshot) is called in another background thread after a snapshot was loaded, eg to compute statistics.
+    Snapshots are handed out without waiting for it, so a slow onLoad does not delay playback."""
+
+    def __init__(self, series, lookahead=4, workers=2, loop=True, onLoad=None):
+        self.series = series
+        self.lookahead = lookahead  # number of snapshots that are read ahead of the current one
+        self.loop = loop  # wrap around at the end of the series
+        self.onLoad = onLoad  # called in a background thread with every loaded snapshot
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='SnapshotPrefetcher')
+        self._onLoadExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='SnapshotPrefetcherOnLoad')
+        self._pending = {}  # snapshot index -> future
+
+    def _window(self, index):
+        indices = []
+        for i in range(index, index + self.lookahead + 1):
+            if self.loop:
+                i %= len(self.series)
+            elif i >= len(self.series):
+                break
+            if i not in indices:
+                indices.append(i)
+        return indices
+
+    def _load(self, index):
+        snapshot = self.series.load(index)
+        if self.onLoad is not None:
+            self._onLoadExecutor.submit(self.onLoad, snapshot)
+        return snapshot
+
+    def request(self, index):
+        """schedule loading of snapshot index and the ones following it, drops everything outside that window"""
+        window = self._window(index)
+        for i in list(self._pending):
+            if i not in window:
+                self._pending.pop(i).cancel()
+        for i in window:
+            if i not in self._pending:
+                self._pending[i] = self._executor.submit(self._load, i)
+
+    def poll(self, index):
+        """returns snapshot index if it was loaded already, None otherwise. Never blocks."""
+        self.request(index)
+        future = self._pending[index]
+        return future.result() if future.done() else None
+
+    def get(self, index):
+        """returns snapshot index, waits until it is loaded"""
+        self.request(index)
+        return self._pending[index].result()
+
+    def close(self):
+        for future in self._pending.values():
+            future.cancel()
+        self._pending = {}
+        self._executor.shutdown(wait=False)
+        self._onLoadExecutor.shutdown(wait=False, cancel_futures=True)
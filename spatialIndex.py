@@ -0,0 +1,99 @@
+import numpy as np
+
+from transform import glmToNumpy
+
+
+def frustumPlanes(viewProjection):
+    """Returns the 6 planes (a,b,c,d) of the view frustum of a combined view projection matrix in vispy layout.
+    A point p is inside a plane when a*p.x + b*p.y + c*p.z + d >= 0. Planes are not normalized."""
+    m = np.asarray(viewProjection, dtype=np.float64)
+    return np.array([m[:, 3] + m[:, 0], m[:, 3] - m[:, 0],  # left, right
+                     m[:, 3] + m[:, 1], m[:, 3] - m[:, 1],  # bottom, top
+                     m[:, 3] + m[:, 2], m[:, 3] - m[:, 2]])  # near, far
+
+
+def boxesInFrustum(planes, lower, upper):
+    """Vectorized test of axis aligned boxes (lower and upper corners with shape (n,3)) against frustum planes.
+    Returns a bool array that is False for boxes that are completely outside of the frustum."""
+    normals = planes[:, :3]
+    # for every plane and box pick the corner furthest along the plane normal
+    corner = np.where(normals[:, np.newaxis, :] >= 0, upper[np.newaxis], lower[np.newaxis])
+    distance = np.einsum('pbi,pi->pb', corner, normals) + planes[:, 3:4]
+    return np.all(distance >= 0, axis=0)
+
+
+class GridIndex:
+    """Sorts particles into a uniform grid. Each frame the cells are culled against the view frustum
+    and distant cells are subsampled, resulting in an index array of the particles that need to be drawn."""
+
+    def __init__(self, position, particlesPerCell=4096, maxCellsPerAxis=128):
+        """build the index for the particle positions (n,3), cells are sized to hold about particlesPerCell particles"""
+        position = np.asarray(position, dtype=np.float32)
+        self.count = len(position)
+        self.lower = position.min(axis=0) if self.count > 0 else np.zeros(3, dtype=np.float32)
+        self.upper = position.max(axis=0) if self.count > 0 else np.zeros(3, dtype=np.float32)
+        cellsPerAxis = int(np.clip(round((self.count / particlesPerCell) ** (1 / 3)), 1, maxCellsPerAxis))
+        self.resolution = np.array([cellsPerAxis] * 3)
+        self.cellSize = np.maximum((self.upper - self.lower) / self.resolution, np.finfo(np.float32).tiny)
+
+        # sort particles by cell
+        cell = np.floor((position - self.lower) / self.cellSize).astype(np.int64)
+        np.clip(cell, 0, self.resolution - 1, out=cell)
+        cellId = (cell[:, 2] * self.resolution[1] + cell[:, 1]) * self.resolution[0] + cell[:, 0]
+        self.order = np.argsort(cellId, kind='stable').astype(np.uint32)  # particle indices sorted by cell
+        cellCount = np.bincount(cellId, minlength=int(np.prod(self.resolution)))
+
+        # only keep cells that contain particles
+        self._cells = np.nonzero(cellCount)[0]
+        self._cellCount = cellCount[self._cells]
+        self._cellStart = (np.cumsum(cellCount) - cellCount)[self._cells]
+
+        # tight bounds of the particles in every cell
+        self._cellLower = np.empty((len(self._cells), 3), dtype=np.float32)
+        self._cellUpper = np.empty((len(self._cells), 3), dtype=np.float32)
+        for axis in range(3):
+            sortedPosition = position[self.order, axis]
+            self._cellLower[:, axis] = np.minimum.reduceat(sortedPosition, self._cellStart) if self.count > 0 else 0
+            self._cellUpper[:, axis] = np.maximum.reduceat(sortedPosition, self._cellStart) if self.count > 0 else 0
+        self._cellCenter = 0.5 * (self._cellLower + self._cellUpper)
+
+        self._lastSelection = None
+        self._lastIndices = None
+
+    def selectCells(self, view, projection, margin=0.0, lodDistance=None, minFraction=0.01):
+        """Returns the visible cells and the stride used to subsample each of them.
+        view and projection are glm matrices or numpy arrays in vispy layout, margin is added to the cell
+        bounds (use the largest particle radius). Cells further away than lodDistance are subsampled so that
+        the number of drawn particles falls off with the square of the distance, down to minFraction."""
+        view = glmToNumpy(view)
+        planes = frustumPlanes(view @ glmToNumpy(projection))
+        visible = np.nonzero(boxesInFrustum(planes, self._cellLower - margin, self._cellUpper + margin))[0]
+
+        stride = np.ones(len(visible), dtype=np.int64)
+        if lodDistance is not None and len(visible) > 0:
+            cameraPosition = np.linalg.inv(view)[3, :3]
+            distance = np.linalg.norm(self._cellCenter[visible] - cameraPosition, axis=1)
+            fraction = np.clip((lodDistance / np.maximum(distance, 1e-12)) ** 2, minFraction, 1.0)
+            # strides are powers of two, so the selection only changes when crossing a lod level
+            stride = 2 ** np.floor(np.log2(1.0 / fraction)).astype(np.int64)
+        return visible, stride
+
+    def visibleIndices(self, view, projection, margin=0.0, lodDistance=None, minFraction=0.01):
+        """Returns (indices, changed), indices is a uint32 array of the particles to draw
+        and changed is False if it is the same array as returned by the last call."""
+        visible, stride = self.selectCells(view, projection, margin, lodDistance, minFraction)
+        if self._lastSelection is not None and np.array_equal(self._lastSelection[0], visible) \
+                and np.array_equal(self._lastSelection[1], stride):
+            return self._lastIndices, False
+
+        start = self._cellStart[visible]
+        length = (self._cellCount[visible] + stride - 1) // stride
+        total = int(length.sum())
+        # expand every (start, length, stride) range into the indices it covers
+        rangeOffset = np.cumsum(length) - length
+        local = np.arange(total, dtype=np.int64) - np.repeat(rangeOffset, length)
+        positionInOrder = np.repeat(start, length) + local * np.repeat(stride, length)
+
+        self._lastSelection = (visible, stride)
+        self._lastIndices = self.order[positionInOrder]
+        return self._lastIndices, True
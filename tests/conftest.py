@@ -0,0 +1,16 @@
+import os
+import sys
+
+import glm
+import pytest
+
+# the modules of ParticleVis live in the repository root, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def camera():
+    """(view, projection) as glm matrices, the camera sits at z=10 and looks at the origin along -z"""
+    view = glm.lookAt(glm.vec3(0, 0, 10), glm.vec3(0, 0, 0), glm.vec3(0, 1, 0))
+    projection = glm.perspective(glm.radians(60.0), 1.0, 0.1, 100.0)
+    return view, projection
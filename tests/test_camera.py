@@ -0,0 +1,31 @@
+from types import SimpleNamespace
+
+import glm
+import pytest
+
+from camera import Camera, CameraInputHandler
+
+
+def _press(handler, key, pressed=True):
+    event = SimpleNamespace(key=key, handled=False)
+    (handler.on_key_pressed if pressed else handler.on_key_released)(event)
+
+
+def test_onlyMovingKeysKeepTheHandlerActive():
+    handler = CameraInputHandler(None)
+    for key in ('Control', 'Alt', 'Shift', ' ', 'F', 'C'):
+        _press(handler, key)
+    assert not handler.isActive()
+    _press(handler, 'W')
+    assert handler.isActive()
+    _press(handler, 'W', pressed=False)
+    assert not handler.isActive()
+
+
+def test_interpolatedMoveDoesNotJumpWithoutTime():
+    camera = Camera(1, glm.vec3(0, 0, 10), glm.vec3(0, 0, 0))
+    camera.setPosition(glm.vec3(0, 0, 20), interpolate=True)
+    assert not camera.update(0.0)
+    assert camera.modelMatrix[3].z == pytest.approx(10)
+    assert camera.update(0.1)
+    assert 10 < camera.modelMatrix[3].z < 20
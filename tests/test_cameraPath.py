@@ -0,0 +1,50 @@
+import glm
+import numpy as np
+import pytest
+
+from cameraPath import CameraPath
+from transform import glmToNumpy
+
+
+def test_pathPassesThroughKeyframes():
+    path = CameraPath()
+    keyframes = [(0.0, (0, 0, 10)), (1.0, (10, 0, 0)), (3.0, (0, 5, -10))]
+    for time, position in keyframes:
+        path.addKeyframe(time, position, target=(0, 0, 0))
+    positions, rotations = path.evaluate([time for time, _ in keyframes])
+    assert np.allclose(positions, [position for _, position in keyframes])
+    # the camera looks along -z of its rotation, towards the target
+    back = rotations[:, :, 2]
+    assert np.allclose(back, positions / np.linalg.norm(positions, axis=1, keepdims=True))
+
+
+def test_viewMatricesMatchGlm():
+    path = CameraPath()
+    path.addKeyframe(0.0, (1, 2, 10), target=(0, 0, 0))
+    path.addKeyframe(2.0, (-4, 1, 3), target=(1, 0, 0))
+    expected = glmToNumpy(glm.lookAt(glm.vec3(1, 2, 10), glm.vec3(0, 0, 0), glm.vec3(0, 1, 0)))
+    view = path.viewMatrices([0.0])[0]
+    assert np.allclose(view, expected, atol=1e-6)
+    model = path.modelMatrices([0.7])[0]
+    assert np.allclose(model @ path.viewMatrices([0.7])[0], np.eye(4), atol=1e-9)
+
+
+def test_orientationsAreInterpolated():
+    path = CameraPath()
+    path.addKeyframe(0.0, (0, 0, 0), orientation=glm.angleAxis(0.0, glm.vec3(0, 1, 0)))
+    path.addKeyframe(1.0, (0, 0, 0), orientation=glm.angleAxis(glm.radians(90.0), glm.vec3(0, 1, 0)))
+    _, rotations = path.evaluate([0.5])
+    expected = glm.mat3_cast(glm.angleAxis(glm.radians(45.0), glm.vec3(0, 1, 0)))
+    assert np.allclose(rotations[0], np.array([list(expected[i]) for i in range(3)]).T, atol=1e-6)
+
+
+def test_invalidKeyframes():
+    path = CameraPath()
+    with pytest.raises(ValueError):
+        path.evaluate([0.0])
+    with pytest.raises(ValueError):
+        path.addKeyframe(0.0, (0, 0, 1))
+    path.addKeyframe(1.0, (0, 0, 1), target=(0, 0, 0))
+    with pytest.raises(ValueError):
+        path.addKeyframe(1.0, (0, 0, 2), target=(0, 0, 0))
+    assert len(path.frameJobs(4)) == 4
@@ -0,0 +1,115 @@
+import glm
+import numpy as np
+import pytest
+from vispy import app, gloo
+from vispy.gloo.context import GLContext, forget_canvas, set_current_canvas
+
+from ParticleVis import Canvas
+
+
+@pytest.fixture
+def canvas(monkeypatch):
+    """a Canvas without window, its gl commands are queued in a context that is never flushed"""
+    def init(self, size=(512, 512), **kwargs):
+        self._fakeSize = size
+        self._context = GLContext()
+        set_current_canvas(self)
+
+    monkeypatch.setattr(app.Canvas, '__init__', init)
+    monkeypatch.setattr(gloo.gl, 'use_gl', lambda target: None)
+    monkeypatch.setattr(Canvas, 'size', property(lambda self: self._fakeSize), raising=False)
+    monkeypatch.setattr(Canvas, 'physical_size', property(lambda self: self._fakeSize), raising=False)
+    monkeypatch.setattr(Canvas, 'update', lambda self, event=None: None)
+    canvas = Canvas(show=False)
+    yield canvas
+    forget_canvas(canvas)
+
+
+def test_construct(canvas):
+    # settings read by setParticles() are defined before the example particles are set
+    assert canvas.particleCount == 9
+    assert canvas.trailMode is None and canvas.periodicBox is None
+    canvas.setParticles(np.zeros((4, 3), dtype=np.float32), scalar=np.ones(4, dtype=np.float32))
+    assert canvas.particleCount == 4
+
+
+def _imageOffsets(canvas):
+    # vispy matrices act on row vectors, the translation is in the last row
+    return [tuple(matrix[3, :3]) for matrix in canvas._periodicImages()]
+
+
+def test_periodicImages(canvas):
+    assert len(canvas._periodicImages()) == 1 and canvas._periodicImages()[0] is canvas._model
+
+    # the particles lie in [-1, 1]^3, the camera at z=10 looks along -z and sees about x in [-4, 4]
+    canvas.cam.viewMatrix = glm.lookAt(glm.vec3(0, 0, 10), glm.vec3(0, 0, 0), glm.vec3(0, 1, 0))
+    canvas.periodicBox = (2, 2, 2)
+    canvas.periodicImages = (3, 0, 0)
+    assert sorted(offset[0] for offset in _imageOffsets(canvas)) == [-4, -2, 0, 2, 4]
+
+    # front to back without sorting, back to front for sorted transparency
+    canvas.periodicImages = (0, 0, 2)
+    assert [offset[2] for offset in _imageOffsets(canvas)] == [4, 2, 0, -2, -4]
+    canvas.sortTransparent = True
+    canvas._buildMissingIndexes()
+    assert [offset[2] for offset in _imageOffsets(canvas)] == [-4, -2, 0, 2, 4]
+
+
+def test_periodicImagesUseTheParticleBounds(canvas):
+    canvas.cam.viewMatrix = glm.lookAt(glm.vec3(0, 0, 10), glm.vec3(0, 0, 0), glm.vec3(0, 1, 0))
+    canvas.periodicBox = (2, 2, 2)
+    canvas.periodicImages = (3, 0, 0)
+    # particles at the far right of the box, so the images on the right leave the view first
+    canvas.setParticles(np.full((4, 3), (0.9, 0, 0), dtype=np.float32))
+    assert sorted(offset[0] for offset in _imageOffsets(canvas)) == [-4, -2, 0, 2]
+
+
+def _pickCenter(canvas):
+    # the first pick starts building the tree if there is none
+    canvas.pick(256, 256)
+    canvas._pickTree.result(timeout=10)
+    return canvas.pick(256, 256)
+
+
+def test_pickingTreeIsBuiltWhenEnabledLater(canvas):
+    canvas.cam.modelMatrix = glm.inverse(glm.lookAt(glm.vec3(0, 0, 10), glm.vec3(0, 0, 0), glm.vec3(0, 1, 0)))
+    assert canvas.pick(256, 256) is None and canvas._pickTree is None
+    canvas.enablePicking = True
+    assert _pickCenter(canvas)['index'] == 0
+
+    # scalars and vectors are not part of the tree
+    tree = canvas._pickTree
+    canvas.setParticles(scalar=np.full(2, 5.0, dtype=np.float32), offset=0)
+    assert canvas._pickTree is tree and _pickCenter(canvas)['scalar'] == 5.0
+
+    # moved particles are found at their new position
+    canvas.setParticles(np.array([(0, 0, 3), (1, 1, 1)], dtype=np.float32), offset=0)
+    assert canvas._pickTree is not tree
+    picked = _pickCenter(canvas)
+    assert picked['index'] == 0 and np.array_equal(picked['position'], (0, 0, 3))
+    canvas.setParticles(np.array([(5, 5, 5), (0, 0, 2)], dtype=np.float32), offset=0)
+    assert _pickCenter(canvas)['index'] == 1
+
+
+def test_partialUpdatesCopyOnlyWhatFeaturesRead(canvas):
+    scalar = np.zeros(9, dtype=np.float32)
+    canvas.setParticles(scalar=scalar)
+    canvas.setParticles(scalar=np.ones(2, dtype=np.float32), offset=3)
+    assert 'scalar' not in canvas._particleData and 'position' in canvas._particleData
+
+    canvas.enableFiltering = True
+    canvas.setParticles(scalar=scalar)
+    canvas.setParticles(scalar=np.ones(2, dtype=np.float32), offset=3)
+    assert np.array_equal(canvas._particleData['scalar'], [0, 0, 0, 1, 1, 0, 0, 0, 0]) and not scalar.any()
+
+
+def test_compactLayoutForgetsAttributesThatWereNotGiven(canvas):
+    canvas.enablePicking = canvas.enableFiltering = True
+    canvas.useCompactLayout(True)
+    position = np.zeros((5, 3), dtype=np.float32)
+    canvas.setParticles(position, scalar=np.ones(5, dtype=np.float32), radius=np.ones(5, dtype=np.float32))
+    canvas.setParticles(position, radius=np.ones(5, dtype=np.float32))
+    # the scalars were reset to zero on the gpu, so picking and filtering do not see the old ones either
+    assert set(canvas._particleData) == {'position', 'radius'}
+    canvas.setParticles(position[:2], offset=1)
+    assert set(canvas._particleData) == {'position'}
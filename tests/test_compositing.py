@@ -0,0 +1,140 @@
+import pickle
+import threading
+from multiprocessing import Pipe
+
+import numpy as np
+import pytest
+
+import compositing
+import headless
+from compositing import DepthCompositor, ParallelRenderer, compositeDepth
+
+
+def test_compositeDepth():
+    color = np.zeros((2, 2, 4), dtype=np.uint8)
+    depth = np.array([[0.5, 0.5], [0.5, 1.0]], dtype=np.float32)
+    otherColor = np.full((2, 2, 4), 7, dtype=np.uint8)
+    otherDepth = np.array([[0.4, 0.6], [0.5, 0.2]], dtype=np.float32)
+    compositeDepth(color, depth, otherColor, otherDepth)
+    # ties keep the image that was there first
+    assert color[..., 0].tolist() == [[7, 0], [0, 7]]
+    assert np.allclose(depth, [[0.4, 0.5], [0.5, 0.2]])
+
+
+def test_compositorMatchesASingleDepthTest():
+    rng = np.random.default_rng(0)
+    colors = [rng.integers(0, 255, (37, 20, 4), dtype=np.uint8) for _ in range(4)]
+    depths = [rng.random((37, 20), dtype=np.float32) for _ in range(4)]
+    compositor = DepthCompositor(threads=3)
+    compositor.begin()
+    for color, depth in zip(colors, depths):
+        compositor.add(color, depth)
+    closest = np.argmin(np.stack(depths), axis=0)
+    expected = np.take_along_axis(np.stack(colors), closest[np.newaxis, ..., np.newaxis], axis=0)[0]
+    assert np.array_equal(compositor.color, expected)
+    assert np.array_equal(compositor.depth, np.min(depths, axis=0))
+    compositor.close()
+
+
+class _FakeCanvas:
+    """renders a 2x2 image of its worker index at the depth of its particle count"""
+
+    def __init__(self):
+        self.count = 0
+        self.failing = False
+        self.statistics = None
+
+    def setParticles(self, position, **arrays):
+        self.count = len(position)
+
+    def setStatistics(self, statistics):
+        self.statistics = statistics
+
+    def renderOffscreen(self, depth):
+        if self.failing:
+            raise ValueError("render failed")
+        return np.full((2, 2, 4), self.index, dtype=np.uint8), np.full((2, 2), self.count, dtype=np.float32)
+
+
+def _remember(canvas, index, count):
+    canvas.index = index
+    return index, count
+
+
+def _failIn(canvas, index, count, failing):
+    canvas.failing = index == failing
+
+
+@pytest.fixture
+def renderer(monkeypatch):
+    monkeypatch.setattr(headless, 'applyFrameJob', lambda canvas, job: None)
+    renderer = ParallelRenderer.__new__(ParallelRenderer)
+    renderer._processes = []
+    renderer._connections = []
+    renderer._compositor = DepthCompositor(2)
+    for _ in range(3):
+        parent, child = Pipe()
+        threading.Thread(target=compositing._serve, args=(child, _FakeCanvas(), 0, 1), daemon=True).start()
+        renderer._connections.append(parent)
+    renderer._request([('assign', index, 3) for index in range(3)])
+    yield renderer
+    renderer.close()
+
+
+def test_workersRenderTheirPartition(renderer):
+    assert renderer.setup(_remember) == [(0, 3), (1, 3), (2, 3)]
+    # 10 particles are split into 3, 3 and 4, the worker with the fewest in front
+    renderer.setParticles(np.zeros((10, 3)), scalar=np.arange(10.0))
+    color, depth = renderer.render()
+    assert color[..., 0].tolist() == [[0, 0], [0, 0]] and depth.tolist() == [[3, 3], [3, 3]]
+    assert [index for index, _ in renderer.renderFrames([{}] * 5)] == [0, 1, 2, 3, 4]
+
+
+def test_jobsCanOnlyMoveTheCamera(renderer):
+    renderer.setup(_remember)
+    renderer.setParticles(np.zeros((10, 3)))
+    with pytest.raises(ValueError, match="snapshot"):
+        renderer.render({'snapshot': 3})
+    frames = renderer.renderFrames([{'position': (0, 0, 5)}, {'snapshot': 1}])
+    with pytest.raises(ValueError, match="snapshot"):
+        list(frames)
+    # nothing was sent for the rejected jobs, so the workers answer the next request
+    assert renderer.render({'view': np.eye(4)})[1].tolist() == [[3, 3], [3, 3]]
+
+
+def _scalarBounds(canvas, index, count):
+    return canvas.statistics.histogram('scalar').total, canvas.statistics.bounds('scalar', 0, 100)
+
+
+def test_workersShareTheStatistics(renderer):
+    renderer.setParticles(np.zeros((9, 3)), scalar=np.arange(9.0))
+    assert renderer.setup(_scalarBounds) == [(9, (0.0, 8.0))] * 3
+
+
+def test_aFailedWorkerLeavesNoAnswersBehind(renderer):
+    renderer.setup(_remember)
+    renderer.setParticles(np.zeros((10, 3)))
+    renderer.setup(_failIn, 1)
+    with pytest.raises(RuntimeError, match="render failed"):
+        renderer.render()
+    frames = renderer.renderFrames([{}] * 4)
+    with pytest.raises(RuntimeError, match="render failed"):
+        next(frames)
+    with pytest.raises((AttributeError, pickle.PicklingError)):
+        # lambdas can not be sent to the workers
+        renderer.setup(lambda canvas, index, count: None)
+
+    renderer.setup(_failIn, -1)
+    assert renderer.render()[0][0, 0, 0] == 0
+    frames = renderer.renderFrames([{}] * 4)
+    assert next(frames)[0] == 0
+    frames.close()
+    assert renderer.setup(_remember) == [(0, 3), (1, 3), (2, 3)]
+
+
+def test_remoteWorkersNeedAnAuthkey():
+    for authkey in (None, b''):
+        with pytest.raises(ValueError):
+            compositing.serveWorker(('localhost', 0), authkey)
+        with pytest.raises(ValueError):
+            ParallelRenderer(addresses=[('localhost', 6000)], authkey=authkey)
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from densitySplat import binParticles, colorize, densityImage, reductionSize, scaleDensity, scalingFromReduction
+
+
+def _reduce(values, filled, blockSize):
+    """reduce an image like densityReduce.frag does"""
+    height, width = values.shape
+    bx, by = blockSize
+    reduced = np.zeros((-(-height // by), -(-width // bx), 4))
+    reduced[..., 0], reduced[..., 1] = 3.4e38, -3.4e38
+    for y in range(reduced.shape[0]):
+        for x in range(reduced.shape[1]):
+            block = values[y * by:(y + 1) * by, x * bx:(x + 1) * bx][filled[y * by:(y + 1) * by, x * bx:(x + 1) * bx]]
+            if len(block):
+                reduced[y, x] = block.min(), block.max(), block[-1], len(block)
+    return reduced
+
+
+def test_binParticles():
+    # with the identity matrix positions are already in normalized device coordinates
+    position = np.array([(0.0, 0.0, 0.0), (-0.9, 0.9, 0.0), (-0.9, 0.9, 0.5), (2.0, 0.0, 0.0), (0.0, 0.0, -1.5)])
+    scalar = np.array([1.0, 2.0, 3.0, 4.0, 5.0])
+    count, scalarSum = binParticles(position, np.eye(4), (4, 2), scalar)
+    assert count.shape == (2, 4)
+    assert count[1, 2] == 1 and count[0, 0] == 2 and count.sum() == 3
+    assert scalarSum[1, 2] == 1.0 and scalarSum[0, 0] == 5.0 and scalarSum.sum() == 6.0
+    chunked, chunkedSum = binParticles(position, np.eye(4), (4, 2), scalar, chunkSize=2)
+    assert np.array_equal(chunked, count) and np.array_equal(chunkedSum, scalarSum)
+    assert binParticles(position, np.eye(4), (4, 2))[1] is None
+
+
+def test_scaleDensity():
+    count = np.array([[0.0, 1.0], [3.0, 5.0]])
+    scalarSum = np.array([[0.0, 4.0], [3.0, 10.0]])
+    assert np.allclose(scaleDensity(count, mode='count', scaling='linear'), [[-1, 0], [0.5, 1]])
+    assert np.allclose(scaleDensity(count, scalarSum, 'meanScalar', 'linear'), [[-1, 1], [0, 1 / 3]])
+    assert np.allclose(scaleDensity(count, mode='count', scaling='log'), [[-1, 0], [np.log(3) / np.log(5), 1]])
+    assert np.allclose(scaleDensity(count, scalarSum, 'scalar', 'equalize'), [[-1, 2 / 3], [1 / 3, 1]])
+    assert np.all(scaleDensity(np.zeros((2, 2))) == -1)
+    with pytest.raises(ValueError):
+        scaleDensity(count, mode='mean')
+    with pytest.raises(ValueError):
+        scaleDensity(count, scaling='sqrt')
+
+
+def test_colorize():
+    scaled = np.array([[-1.0, 0.0, 1.0]])
+    image = colorize(scaled, colors=[(1, 0, 0), (0, 0, 1)], background=(0, 1, 0, 1))
+    assert image.dtype == np.uint8 and image.shape == (1, 3, 4)
+    assert np.array_equal(image[0], [(0, 255, 0, 255), (255, 0, 0, 255), (0, 0, 255, 255)])
+
+
+def test_densityImage():
+    position = np.random.default_rng(0).uniform(-1, 1, (1000, 3))
+    image = densityImage(position, np.eye(4), (16, 8))
+    assert image.shape == (8, 16, 4) and np.all(image[..., 3] == 255)
+    with pytest.raises(ValueError):
+        densityImage(position, np.eye(4), (16, 8), mode='meanScalar')
+
+
+def test_reductionSize():
+    assert reductionSize((64, 10)) == ((1, 1), (64, 10))
+    assert reductionSize((1920, 1080)) == ((30, 17), (64, 64))
+    blockSize, reducedSize = reductionSize((1000, 129))
+    assert all(b * r >= s for b, r, s in zip(blockSize, reducedSize, (1000, 129)))
+    assert max(reducedSize) <= 64
+
+
+@pytest.mark.parametrize('mode', ['count', 'scalar', 'meanScalar'])
+def test_scalingFromReduction(mode):
+    rng = np.random.default_rng(1)
+    count = rng.poisson(0.7, (90, 130)).astype(np.float64)
+    scalarSum = count * rng.uniform(0, 10, count.shape)
+    filled = count > 0
+    values = {'count': count, 'scalar': scalarSum, 'meanScalar': scalarSum / np.maximum(count, 1)}[mode]
+    blockSize, _ = reductionSize((130, 90), maxSize=16)
+    low, high, table = scalingFromReduction(_reduce(values, filled, blockSize), tableSize=64)
+    assert (low, high) == (values[filled].min(), values[filled].max())
+    assert len(table) == 64 and np.all(np.diff(table) >= 0) and low <= table[0] and table[-1] <= high
+
+    # equalizing with the quantile table is close to equalizing with all pixels
+    approximated = np.searchsorted(table, values[filled], side='right') / len(table)
+    exact = scaleDensity(count, scalarSum, mode, 'equalize')[filled]
+    assert np.mean(np.abs(approximated - exact)) < 0.1
+
+
+def test_scalingWithoutParticles():
+    reduced = np.zeros((4, 4, 4))
+    reduced[..., 0], reduced[..., 1] = 3.4e38, -3.4e38
+    assert scalingFromReduction(reduced) is None
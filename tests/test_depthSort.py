@@ -0,0 +1,56 @@
+import glm
+import numpy as np
+
+from depthSort import DepthSorter, depthOrder
+
+
+def test_backToFront(camera):
+    view, _ = camera
+    position = np.array([(0, 0, 5), (0, 0, -5), (3, 0, 0), (0, 0, 1)], dtype=np.float32)
+    assert depthOrder(position, view).tolist() == [1, 2, 3, 0]
+    assert len(depthOrder(np.zeros((0, 3)), view)) == 0
+
+
+def test_orderIsAPermutationWithinTheQuantization(camera):
+    view, _ = camera
+    position = np.random.default_rng(0).uniform(-1, 1, (10000, 3))
+    order = depthOrder(position, view, chunkSize=1000)
+    assert np.array_equal(np.sort(order), np.arange(len(position)))
+    # depth is quantized to 16 bit, neighbors can be swapped by at most one step
+    z = position[order, 2]
+    assert np.all(np.diff(z) >= -2.0 / 65535 * 1.01)
+
+
+def _turn(view, degrees):
+    """turn the camera around its own y axis"""
+    return glm.rotate(glm.mat4(1.0), glm.radians(degrees), glm.vec3(0, 1, 0)) * view
+
+
+def test_sortsAgainOnlyAfterTheCameraMoved(camera):
+    view, _ = camera
+    position = np.random.default_rng(1).uniform(-1, 1, (1000, 3))
+    sorter = DepthSorter(position, threaded=False)
+    order, changed = sorter.order(view)
+    assert changed
+    again, changed = sorter.order(_turn(view, 1.0))
+    assert again is order and not changed
+    assert sorter.order(glm.translate(view, glm.vec3(0, 0, 0.01)))[1] is False
+
+    # looking the other way the particles further along +z are drawn first
+    reversed, changed = sorter.order(_turn(view, 180.0))
+    assert changed
+    assert np.all(np.diff(position[reversed, 2]) <= 2.0 / 65535 * 1.01)
+
+
+def test_threadedSortKeepsThePreviousOrderUntilReady(camera):
+    view, _ = camera
+    position = np.random.default_rng(2).uniform(-1, 1, (1000, 3))
+    sorter = DepthSorter(position)
+    first, changed = sorter.order(view)
+    assert changed
+    turned = _turn(view, 90.0)
+    assert sorter.order(turned)[0] is first
+    sorter._future.result()
+    second, changed = sorter.order(turned)
+    assert changed and second is not first
+    sorter.close()
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from fieldStatistics import FieldStatistics, Histogram
+
+
+def test_histogramPercentilesWithinOneBin():
+    values = np.random.default_rng(0).normal(size=100000)
+    histogram = Histogram(256)
+    histogram.add(values)
+    assert histogram.total == len(values)
+    assert (histogram.min, histogram.max) == (values.min(), values.max())
+    for q in (1, 50, 99):
+        assert abs(histogram.percentile(q) - np.percentile(values, q)) <= histogram.width
+
+
+def test_chunkedHistogramWithinOneBinOfTheFinalRange():
+    values = np.random.default_rng(1).exponential(size=100000)
+    chunked = Histogram(256)
+    # small values first, so the range has to grow several times
+    for chunk in np.array_split(np.sort(values), 10):
+        chunked.add(chunk)
+    assert chunked.total == len(values) and chunked.counts.sum() == len(values)
+    for q in (1, 50, 99):
+        assert abs(chunked.percentile(q) - np.percentile(values, q)) <= chunked.width
+
+
+def test_histogramIgnoresNonFiniteValues():
+    histogram = Histogram(16)
+    histogram.add([1.0, np.nan, np.inf, 2.0])
+    assert histogram.total == 2
+    assert np.isnan(Histogram(16).percentile(50))
+
+
+def test_mergeKeepsTotals():
+    a, b = Histogram(64), Histogram(64)
+    a.add(np.linspace(0, 1, 1000))
+    b.add(np.linspace(5, 6, 500))
+    a.merge(b)
+    assert a.total == 1500 and a.counts.sum() == 1500
+    assert (a.min, a.max) == (0.0, 6.0)
+
+
+def test_addWithKeyCountsOnce():
+    statistics = FieldStatistics(bins=64)
+    scalar = np.arange(100, dtype=np.float32)
+    statistics.add(scalar, key=3)
+    statistics.add(scalar, key=3)
+    assert statistics.histogram('scalar').total == 100
+    assert statistics.bounds('vectorMagnitude') is None
+    lower, upper = statistics.bounds('scalar', 0, 100)
+    assert (lower, upper) == (0.0, 99.0)
+
+
+def test_vectorMagnitude():
+    statistics = FieldStatistics(bins=64, chunkSize=7)
+    vector = np.tile([[3.0, 4.0, 0.0]], (50, 1))
+    statistics.add(vector=vector)
+    assert statistics.bounds('vectorMagnitude', 0, 100) == pytest.approx((5.0, 5.0))
+
+
+def test_saveWithoutPathDoesNothing(tmp_path):
+    statistics = FieldStatistics()
+    statistics.add(np.ones(10))
+    statistics.save()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_cacheRoundTrip(tmp_path):
+    path = str(tmp_path / 'stats.npz')
+    statistics = FieldStatistics(bins=64, cachePath=path)
+    statistics.add(np.arange(10.0), np.ones((10, 3)), key=0)
+    statistics.add(np.arange(20.0), key=1)
+    statistics.save()
+
+    cached = FieldStatistics(bins=64, cachePath=path)
+    assert cached.histogram('scalar', key=0).total == 10
+    assert cached.histogram('scalar').total == 30
+    assert cached.histogram('vectorMagnitude', key=1) is None
+    # the total is merged from the cached histograms, values are placed at the centers of their bins
+    width = cached.histogram('scalar').width
+    assert cached.bounds('scalar') == pytest.approx(statistics.bounds('scalar'), abs=width)
+
+
+def test_cacheOfAChangedSourceIsDiscarded(tmp_path):
+    source = tmp_path / 'particles.snap'
+    source.write_bytes(b'0' * 16)
+    path = str(tmp_path / 'stats.npz')
+    statistics = FieldStatistics(bins=64, cachePath=path, sourcePath=source)
+    statistics.add(np.arange(10.0), key=0)
+    statistics.save()
+    assert FieldStatistics(bins=64, cachePath=path, sourcePath=source).histogram('scalar').total == 10
+    # caches written without a source are not trusted
+    unchecked = str(tmp_path / 'unchecked.npz')
+    statistics = FieldStatistics(bins=64, cachePath=unchecked)
+    statistics.add(np.arange(10.0), key=0)
+    statistics.save()
+    assert FieldStatistics(bins=64, cachePath=unchecked).histogram('scalar').total == 10
+    assert FieldStatistics(bins=64, cachePath=unchecked, sourcePath=source).histogram('scalar').total == 0
+
+    source.write_bytes(b'0' * 32)
+    rewritten = FieldStatistics(bins=64, cachePath=path, sourcePath=source)
+    assert rewritten.histogram('scalar', key=0) is None and rewritten.histogram('scalar').total == 0
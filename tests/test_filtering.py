@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from filtering import ParticleFilter, filterKey, filterMask
+
+
+@pytest.fixture
+def particles():
+    rng = np.random.default_rng(0)
+    count = 10000
+    return rng.uniform(-1, 1, (count, 3)), rng.normal(size=(count, 3)), rng.uniform(0, 10, count)
+
+
+def test_filterKey():
+    assert filterKey() is None
+    assert filterKey(planes=[]) is None
+    assert filterKey(scalarRange=(1, None)) == ((1.0, None), None, None, None)
+    assert hash(filterKey(box=(np.zeros(3), np.ones(3)), planes=np.array([[1, 0, 0, 0]])))
+
+
+def test_masks(particles):
+    position, vector, scalar = particles
+    mask = filterMask(filterKey(scalarRange=(2, 5)), position, vector, scalar)
+    assert np.array_equal(mask, (scalar >= 2) & (scalar <= 5))
+
+    magnitude = np.linalg.norm(vector, axis=1)
+    mask = filterMask(filterKey(magnitudeRange=(None, 1.5)), vector=vector)
+    assert np.array_equal(mask, magnitude <= 1.5)
+
+    key = filterKey(box=((-0.5, -0.5, -0.5), (0.5, 0.5, 0.5)), planes=[(1, 0, 0, 0)])
+    mask = filterMask(key, position=position)
+    assert np.array_equal(mask, np.all(np.abs(position) <= 0.5, axis=1) & (position[:, 0] >= 0))
+
+
+def test_chunkedIndicesMatchTheMask(particles):
+    position, vector, scalar = particles
+    key = filterKey(scalarRange=(1, 9), planes=[(0, 1, 1, 0.2)])
+    particleFilter = ParticleFilter(position, vector, scalar, chunkSize=999)
+    indices = particleFilter.indices(key)
+    assert indices.dtype == np.uint32
+    assert np.array_equal(indices, np.flatnonzero(filterMask(key, position, vector, scalar)))
+
+
+def test_cacheKeepsTheLastFilters(particles):
+    particleFilter = ParticleFilter(*particles, cacheSize=2)
+    first = particleFilter.indices(filterKey(scalarRange=(0, 1)))
+    particleFilter.indices(filterKey(scalarRange=(0, 2)))
+    assert particleFilter.indices(filterKey(scalarRange=(0, 1))) is first
+    particleFilter.indices(filterKey(scalarRange=(0, 3)))
+    # (0, 2) was used least recently and is dropped
+    assert list(particleFilter._cache) == [filterKey(scalarRange=(0, 1)), filterKey(scalarRange=(0, 3))]
+
+
+def test_missingAttributes():
+    particleFilter = ParticleFilter(position=np.zeros((10, 3)))
+    with pytest.raises(ValueError):
+        particleFilter.indices(filterKey(scalarRange=(0, 1)))
+    assert len(particleFilter.indices(filterKey(box=((0, 0, 0), (1, 1, 1))))) == 10
+    assert len(ParticleFilter(position=np.zeros((0, 3))).indices(filterKey(planes=[(1, 0, 0, 0)]))) == 0
@@ -0,0 +1,184 @@
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import frameCapture
+from frameCapture import FrameCapture
+
+
+class _FakeGL:
+    """the pixel buffer and fence functions of PyOpenGL. glReadPixels copies framebuffer into the bound buffer,
+    fences signal when the test adds them to signaled or when they are waited for without timeout"""
+    GL_PIXEL_PACK_BUFFER = 1
+    GL_STREAM_READ = 2
+    GL_PACK_ALIGNMENT = 3
+    GL_RGBA = 4
+    GL_UNSIGNED_BYTE = 5
+    GL_SYNC_GPU_COMMANDS_COMPLETE = 6
+    GL_SYNC_FLUSH_COMMANDS_BIT = 7
+    GL_TIMEOUT_IGNORED = -1
+    GL_ALREADY_SIGNALED = 8
+    GL_CONDITION_SATISFIED = 9
+    GL_TIMEOUT_EXPIRED = 10
+    GL_MAP_READ_BIT = 11
+
+    def __init__(self):
+        self.framebuffer = None  # (height, width, 4) uint8, bottom row first like opengl
+        self.storage = {}  # buffer -> bytes
+        self.bound = 0
+        self.fences = []
+        self.signaled = set()
+        self.deletedBuffers = []
+        self.generated = 0
+
+    def glGenBuffers(self, count):
+        self.generated += 1
+        return self.generated
+
+    def glBindBuffer(self, target, buffer):
+        self.bound = buffer
+
+    def glBufferData(self, target, size, data, usage):
+        self.storage[self.bound] = np.zeros(size, dtype=np.uint8)
+
+    def glDeleteBuffers(self, count, buffers):
+        for buffer in buffers:
+            del self.storage[buffer]
+            self.deletedBuffers.append(buffer)
+
+    def glPixelStorei(self, name, value):
+        pass
+
+    def glReadPixels(self, x, y, width, height, layout, dtype, offset):
+        self.storage[self.bound][:] = self.framebuffer.reshape(-1)
+
+    def glFenceSync(self, condition, flags):
+        self.fences.append(len(self.fences) + 1)
+        return self.fences[-1]
+
+    def glFlush(self):
+        pass
+
+    def glClientWaitSync(self, fence, flags, timeout):
+        if fence in self.signaled:
+            return self.GL_ALREADY_SIGNALED
+        if timeout == 0:
+            return self.GL_TIMEOUT_EXPIRED
+        self.signaled.add(fence)
+        return self.GL_CONDITION_SATISFIED
+
+    def glDeleteSync(self, fence):
+        pass
+
+    def glMapBufferRange(self, target, offset, length, access):
+        return self.storage[self.bound].ctypes.data
+
+    def glUnmapBuffer(self, target):
+        pass
+
+
+@pytest.fixture
+def gl(monkeypatch):
+    gl = _FakeGL()
+    monkeypatch.setitem(sys.modules, 'OpenGL', SimpleNamespace(GL=gl))
+    return gl
+
+
+def _frame(value, size=(3, 2)):
+    """image of size (width, height) whose rows are value, value + 1, ... from the top"""
+    rows = np.arange(size[1], dtype=np.uint8)[:, None, None] + value
+    return np.broadcast_to(rows, (size[1], size[0], 4)).copy()
+
+
+def _draw(gl, image):
+    gl.framebuffer = image[::-1]
+
+
+@pytest.fixture
+def written(monkeypatch):
+    """frames written by the png path, in the order they were written"""
+    written = []
+    monkeypatch.setattr(frameCapture, '_writePng', lambda fileName, image: written.append((fileName, image)))
+    return written
+
+
+def test_framesKeepTheirOrderAndOrientation(gl, written):
+    capture = FrameCapture('frame_{}.png', buffers=2, workers=1)
+    for value in range(5):
+        _draw(gl, _frame(10 * value))
+        capture.capture((3, 2))
+        # fences of older frames signal late, frames are still handed out in capture order
+        assert len(capture._inFlight) <= 2
+    assert capture.close() is None
+    assert [fileName for fileName, _ in written] == ['frame_{}.png'.format(value) for value in range(5)]
+    for value, (_, image) in enumerate(written):
+        assert np.array_equal(image, _frame(10 * value))
+    assert sorted(gl.deletedBuffers) == [1, 2] and not gl.storage
+
+
+def test_finishedFramesAreCollectedWithoutWaiting(gl, written):
+    capture = FrameCapture('frame_{}.png', buffers=3, workers=1)
+    _draw(gl, _frame(0))
+    capture.capture((3, 2))
+    capture.capture((3, 2))
+    gl.signaled.add(gl.fences[0])
+    capture.capture((3, 2))
+    # only the first frame was finished, the others are still in flight
+    capture._executor.shutdown(wait=True)
+    assert [fileName for fileName, _ in written] == ['frame_0.png'] and len(capture._inFlight) == 2
+
+
+def test_pipedFramesCanNotChangeSize(gl):
+    capture = FrameCapture(command=[sys.executable, '-c', 'import sys; sys.stdin.buffer.read()'])
+    _draw(gl, _frame(0))
+    capture.capture((3, 2))
+    with pytest.raises(ValueError):
+        capture.capture((2, 3))
+    assert capture.close() == 0
+
+
+def test_pipeReceivesRawFramesInOrder(gl, tmp_path):
+    output = tmp_path / 'frames.raw'
+    copy = 'import shutil, sys; shutil.copyfileobj(sys.stdin.buffer, open(sys.argv[1], "wb"))'
+    capture = FrameCapture(command=[sys.executable, '-c', copy, str(output)], buffers=2, workers=4)
+    for value in range(6):
+        _draw(gl, _frame(value))
+        capture.capture((3, 2))
+    assert capture.close() == 0
+    frames = np.frombuffer(output.read_bytes(), dtype=np.uint8).reshape(6, 2, 3, 4)
+    assert all(np.array_equal(frames[value], _frame(value)) for value in range(6))
+
+
+def test_maxPendingBlocksUntilAnEncoderIsDone(gl, monkeypatch):
+    release = threading.Event()
+    written = []
+
+    def writePng(fileName, image):
+        release.wait(10)
+        written.append(fileName)
+    monkeypatch.setattr(frameCapture, '_writePng', writePng)
+
+    capture = FrameCapture('frame_{}.png', workers=1, maxPending=2)
+    capture._encode(0, _frame(0))
+    capture._encode(1, _frame(1))
+    encoding = threading.Thread(target=capture._encode, args=(2, _frame(2)))
+    encoding.start()
+    time.sleep(0.1)
+    # the encoder is blocked with two frames, the third one waits before it is queued
+    assert encoding.is_alive() and written == []
+    release.set()
+    encoding.join(10)
+    assert not encoding.is_alive()
+    assert capture.close() is None
+    assert written == ['frame_0.png', 'frame_1.png', 'frame_2.png']
+
+
+def test_outputPatternOrCommand():
+    with pytest.raises(ValueError):
+        FrameCapture()
+    with pytest.raises(ValueError):
+        FrameCapture('frame_{}.png', command=['true'])
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+import liveFeed
+from liveFeed import LiveFeedReader, LiveFeedWriter
+
+
+@pytest.fixture
+def writer():
+    with LiveFeedWriter(capacity=100) as writer:
+        yield writer
+
+
+def test_latestFrame(writer):
+    reader = LiveFeedReader(writer.name)
+    try:
+        assert reader.latest() is None
+        writer.write(np.ones((10, 3)), scalar=np.arange(10), time=2.5)
+        frame = reader.latest()
+        assert (frame.index, frame.time) == (1, 2.5)
+        assert np.array_equal(frame.position, np.ones((10, 3)))
+        assert np.array_equal(frame.scalar, np.arange(10))
+        assert frame.vector is None and frame.radius is None
+        assert reader.latest() is None
+    finally:
+        reader.close()
+
+
+def test_droppedFrames(writer):
+    reader = LiveFeedReader(writer.name)
+    try:
+        for step in range(5):
+            writer.write(np.full((3, 3), step))
+        frame = reader.latest()
+        assert frame.index == 5 and reader.droppedFrames == 4
+        assert np.array_equal(frame.position, np.full((3, 3), 4))
+    finally:
+        reader.close()
+
+
+def test_writerNeverOverwritesTheReadersFrame(writer):
+    reader = LiveFeedReader(writer.name)
+    try:
+        writer.write(np.zeros((4, 3)))
+        frame = reader.latest()
+        for step in range(1, 20):
+            writer.write(np.full((4, 3), step))
+            # frames belong to the caller, later frames never change them
+            assert np.array_equal(frame.position, np.zeros((4, 3)))
+        assert np.array_equal(reader.latest().position, np.full((4, 3), 19))
+    finally:
+        reader.close()
+
+
+def test_aSlotReusedWhileCopyingIsReadAgain(writer):
+    reader = LiveFeedReader(writer.name)
+    slotArrays = reader._slotArrays
+
+    class Racing(dict):
+        def __getitem__(self, name):
+            # the writer missed the reservation and reuses every slot before the copy
+            reader._slotArrays = slotArrays
+            reader._header[liveFeed._READER_WORD] = -1
+            for step in range(1, 4):
+                writer.write(np.full((4, 3), step))
+            return super().__getitem__(name)
+
+    try:
+        writer.write(np.zeros((4, 3)))
+        reader._slotArrays = [Racing(arrays) for arrays in slotArrays]
+        frame = reader.latest()
+        assert frame.index == 4 and np.array_equal(frame.position, np.full((4, 3), 3))
+    finally:
+        reader.close()
+
+
+def test_invalidFeeds(writer):
+    with pytest.raises(ValueError):
+        writer.write(np.zeros((101, 3)))
+    with pytest.raises(ValueError):
+        LiveFeedWriter(capacity=10, slots=2)
+
+
+def test_waitWithNotification(tmp_path):
+    notify = str(tmp_path / 'feed.socket')
+    with LiveFeedWriter(capacity=10, notify=notify) as writer:
+        reader = LiveFeedReader(writer.name, notify=notify)
+        try:
+            assert not reader.wait(timeout=0.01)
+            writer.write(np.zeros((1, 3)))
+            assert reader.wait(timeout=1.0)
+            assert reader.latest().index == 1
+        finally:
+            reader.close()
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from vispy.gloo import Program
+
+from packing import (PackedParticleBuffer, compactDtype, decodeWords, dequantizePositions, encodeWords, packAttributes,
+                     quantizePositions)
+from shaderCache import loadShader
+
+
+def _unpack(words, vectorScale):
+    """decode packAttributes() like the shader does"""
+    words = decodeWords(words)
+    snorm = np.stack([(words[:, 0] >> shift) & 0x3FF for shift in (0, 10, 20)], axis=1).astype(np.int32)
+    snorm = np.where(snorm >= 512, snorm - 1024, snorm)
+    vector = np.maximum(snorm / 511.0, -1.0) * vectorScale
+    scalar = (words[:, 1] & 0xFFFF).astype(np.uint16).view(np.float16)
+    radius = (words[:, 1] >> 16).astype(np.uint16).view(np.float16)
+    return vector, scalar, radius
+
+
+def test_quantizedPositionsRoundTrip():
+    position = np.random.default_rng(0).uniform(-50, 20, (1000, 3))
+    lower = position.min(axis=0)
+    extent = position.max(axis=0) - lower
+    restored = dequantizePositions(quantizePositions(position, lower, extent), lower, extent)
+    assert np.all(np.abs(restored - position) <= extent / (2 ** 20 - 1))
+
+
+def test_quantizeFlatBounds():
+    position = np.array([(1.0, 2.0, 3.0), (1.0, 5.0, 3.0)])
+    lower = position.min(axis=0)
+    extent = position.max(axis=0) - lower
+    assert np.allclose(dequantizePositions(quantizePositions(position, lower, extent), lower, extent), position)
+
+
+def test_packedAttributesRoundTrip():
+    rng = np.random.default_rng(1)
+    vector = rng.normal(size=(500, 3))
+    scalar = rng.uniform(-10, 10, 500)
+    radius = rng.uniform(0, 1, 500)
+    scale = float(np.max(np.linalg.norm(vector, axis=1)))
+    unpackedVector, unpackedScalar, unpackedRadius = _unpack(packAttributes(vector, scalar, radius, scale), scale)
+    assert np.all(np.abs(unpackedVector - vector) <= scale / 511)
+    assert np.allclose(unpackedScalar, scalar, rtol=1e-3)
+    assert np.allclose(unpackedRadius, radius, rtol=1e-3, atol=1e-4)
+
+
+def test_wordsAreNormalFloats():
+    # planar vectors and zero radius leave most of the payload bits zero
+    rng = np.random.default_rng(3)
+    position = rng.uniform(-1, 1, (5000, 3))
+    vector = np.concatenate([rng.normal(size=(5000, 2)), np.zeros((5000, 1))], axis=1)
+    lower = position.min(axis=0)
+    extent = position.max(axis=0) - lower
+    words = np.concatenate([quantizePositions(position, lower, extent),
+                            packAttributes(vector, rng.uniform(-5, 5, 5000), np.zeros(5000), 3.0),
+                            encodeWords(np.array([0, 2 ** 31 - 1]))[:, np.newaxis]], axis=None)
+    exponent = (words >> 23) & 0xFF
+    assert np.all((exponent != 0) & (exponent != 255))
+    assert np.all(np.isfinite(words.view(np.float32)))
+
+
+def test_wordsRoundTrip():
+    payload = np.random.default_rng(4).integers(0, 2 ** 31, 1000, dtype=np.uint32)
+    payload[:2] = 0, 2 ** 31 - 1
+    assert np.array_equal(decodeWords(encodeWords(payload)), payload)
+
+
+@pytest.mark.parametrize('quantize, itemsize', [(False, 20), (True, 16)])
+def test_compactSizes(quantize, itemsize):
+    assert compactDtype(quantize).itemsize == itemsize
+
+
+def test_bindingTwoProgramsKeepsDivisors():
+    particles = PackedParticleBuffer(quantizePositions=True)
+    particles.setData(np.random.default_rng(2).uniform(size=(8, 3)))
+    instanced = Program(loadShader('particleRenderer.vert', ['INSTANCED_QUADS']), loadShader('particleRenderer.frag'))
+    density = Program(loadShader('particleRenderer.vert', ['DENSITY_SPLAT']), loadShader('densityAccumulate.frag'))
+    particles.bind(instanced, divisor=1)
+    particles.bind(density)
+    for name in ('input_packed', 'input_quantizedPosition'):
+        assert instanced._user_variables[name].divisor == 1
+        assert density._user_variables[name].divisor is None
+
+
+def test_updatesNeedPositionsInRange():
+    particles = PackedParticleBuffer()
+    with pytest.raises(ValueError):
+        particles.setData(scalar=np.zeros(3))
+    particles.setData(np.zeros((10, 3)))
+    particles.setData(np.ones((2, 3)), offset=8)
+    with pytest.raises(ValueError):
+        particles.setData(np.ones((2, 3)), offset=9)
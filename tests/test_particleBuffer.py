@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from vispy import gloo
+from vispy.gloo import Program
+
+from particleBuffer import ParticleBuffer
+from shaderCache import loadShader
+
+
+def _programs():
+    instanced = Program(loadShader('particleRenderer.vert', ['INSTANCED_QUADS']), loadShader('particleRenderer.frag'))
+    density = Program(loadShader('particleRenderer.vert', ['DENSITY_SPLAT']), loadShader('densityAccumulate.frag'))
+    return instanced, density
+
+
+def _attributeSizes(program):
+    """sizes of the per vertex attributes and of the per instance attributes, like Program.draw() checks them"""
+    buffers = [value for value in program._user_variables.values() if isinstance(value, gloo.buffer.DataBuffer)]
+    perVertex = {buffer.size for buffer in buffers if getattr(buffer, 'divisor', None) is None}
+    perInstance = {buffer.size for buffer in buffers if getattr(buffer, 'divisor', None) is not None}
+    return perVertex, perInstance
+
+
+@pytest.mark.parametrize('count, capacity', [(9, 0), (9, 20)])
+def test_bindingTwoProgramsKeepsDivisors(count, capacity):
+    particles = ParticleBuffer(capacity)
+    particles.setData(np.zeros((count, 3)), np.zeros((count, 3)), np.zeros(count), np.ones(count))
+    instanced, density = _programs()
+    particles.bind(instanced, divisor=1)
+    instanced['input_corner'] = gloo.VertexBuffer(np.zeros((4, 2), dtype=np.float32))
+    particles.bind(density)
+
+    for name in ParticleBuffer.attributes:
+        assert instanced._user_variables[name].divisor == 1
+        assert density._user_variables[name].divisor is None
+    assert _attributeSizes(instanced) == ({4}, {count})
+    assert _attributeSizes(density) == ({count}, set())
+
+
+def test_partialUpdatesStayInRange():
+    particles = ParticleBuffer()
+    particles.setData(np.zeros((10, 3)))
+    particles.setData(scalar=np.ones(4), offset=6)
+    with pytest.raises(ValueError):
+        particles.setData(scalar=np.ones(4), offset=7)
+    with pytest.raises(ValueError):
+        particles.setData(np.zeros((3, 3)), scalar=np.zeros(4))
+
+
+def test_growingKeepsCapacityAhead():
+    particles = ParticleBuffer(growthFactor=2.0)
+    particles.setData(np.zeros((10, 3)))
+    assert (particles.count, particles.capacity) == (10, 10)
+    particles.setData(np.zeros((11, 3)))
+    assert (particles.count, particles.capacity) == (11, 20)
+    particles.setData(np.zeros((5, 3)))
+    assert (particles.count, particles.capacity) == (5, 20)
+
+
+def test_bindNextKeepsDivisors():
+    current, following = ParticleBuffer(), ParticleBuffer()
+    for particles in (current, following):
+        particles.setData(np.zeros((5, 3)), scalar=np.zeros(5))
+    instanced, density = _programs()
+    current.bind(instanced, divisor=1)
+    following.bindNext(instanced, divisor=1)
+    current.bind(density)
+    following.bindNext(density)
+    for name in ParticleBuffer.interpolated:
+        assert instanced._user_variables[name + 'Next'].divisor == 1
+        assert density._user_variables[name + 'Next'].divisor is None
+
+
+def test_attributesNotGivenAreZeroedWhenTheCountChanges():
+    particles = ParticleBuffer(capacity=20)
+    uploads = {}
+    for name in ParticleBuffer.attributes:
+        particles[name].set_subdata = lambda data, offset, name=name: uploads.__setitem__(name, data)
+    particles.setData(np.ones((10, 3)), radius=np.ones(10))
+    particles.setData(np.ones((5, 3)))
+    assert uploads['input_radius'].shape == (5,) and not uploads['input_radius'].any()
+    assert uploads['input_vector'].shape == (5, 3) and not uploads['input_vector'].any()
+
+    # with the same count they are left as they are
+    uploads.clear()
+    particles.setData(np.ones((5, 3)))
+    assert set(uploads) == {'input_position'}
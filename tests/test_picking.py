@@ -0,0 +1,62 @@
+import glm
+import numpy as np
+import pytest
+
+from picking import ParticleTree, buildInBackground, cursorRay
+
+
+def _bruteForce(position, radius, origin, direction):
+    offset = position - origin
+    along = offset @ direction
+    squaredDistance = np.einsum('ij,ij->i', offset, offset) - along * along
+    hit = (squaredDistance <= radius * radius) & (along > 0)
+    if not hit.any():
+        return None
+    distance = np.where(hit, along - np.sqrt(np.where(hit, radius * radius - squaredDistance, 0.0)), np.inf)
+    return int(np.argmin(distance)), float(distance.min())
+
+
+@pytest.mark.parametrize('perParticle', [False, True])
+def test_matchesBruteForce(perParticle):
+    rng = np.random.default_rng(0)
+    position = rng.uniform(-1, 1, (3000, 3))
+    radius = rng.uniform(0.005, 0.03, len(position)) if perParticle else np.full(len(position), 0.02)
+    tree = ParticleTree(position, radius if perParticle else None, leafSize=16, branching=4)
+    hits = 0
+    for _ in range(50):
+        origin = rng.normal(size=3) * 5
+        direction = rng.uniform(-0.5, 0.5, 3) - origin
+        direction /= np.linalg.norm(direction)
+        expected = _bruteForce(position, radius, origin, direction)
+        result = tree.intersect(origin, direction, None if perParticle else 0.02)
+        if expected is None:
+            assert result is None
+        else:
+            hits += 1
+            assert result[0] == expected[0] and result[1] == pytest.approx(expected[1])
+    assert hits > 10
+
+
+def test_missesAndEmptyTrees():
+    tree = ParticleTree(np.zeros((1, 3)))
+    assert tree.intersect((0, 0, 5), (0, 0, 1), 0.1) is None
+    assert tree.intersect((0, 0, 5), (0, 0, -1), 0.1) == (0, pytest.approx(4.9))
+    with pytest.raises(ValueError):
+        tree.intersect((0, 0, 5), (0, 0, -1))
+    assert ParticleTree(np.zeros((0, 3))).intersect((0, 0, 5), (0, 0, -1), 1.0) is None
+
+
+def test_buildInBackground():
+    position = np.random.default_rng(1).uniform(-1, 1, (500, 3))
+    tree = buildInBackground(position).result()
+    assert np.array_equal(np.sort(tree.order), np.arange(500))
+
+
+def test_cursorRayThroughTheCenter(camera):
+    view, projection = camera
+    origin, direction = cursorRay(320, 240, (640, 480), glm.inverse(view), projection)
+    assert np.allclose(origin[:2], 0.0, atol=1e-6) and origin[2] == pytest.approx(9.9, abs=1e-4)
+    assert np.allclose(direction, (0, 0, -1))
+    # pixels left of the center look to the left
+    _, direction = cursorRay(0, 240, (640, 480), glm.inverse(view), projection)
+    assert direction[0] < 0 and abs(direction[1]) < 1e-6
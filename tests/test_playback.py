@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+from vispy.gloo import Program
+
+from ParticleVis import Canvas
+from particleBuffer import ParticleBuffer
+from shaderCache import loadShader
+from snapshots import SnapshotSeries, SnapshotWriter
+
+
+class _FakePrefetcher:
+    """returns the snapshots in loaded, like a SnapshotPrefetcher whose other reads are still running"""
+
+    def __init__(self, series, loaded):
+        self.series = series
+        self.loaded = set(loaded)
+
+    def poll(self, index):
+        return self.series[index] if index in self.loaded else None
+
+
+@pytest.fixture
+def canvas(tmp_path):
+    """a canvas without window or gl context that plays a series of 3 snapshots, showing the first"""
+    path = tmp_path / 'series.pvs'
+    with SnapshotWriter(path) as writer:
+        for step in range(3):
+            writer.write(np.full((4, 3), step, dtype=np.float32), time=0.5 * step)
+    canvas = Canvas.__new__(Canvas)
+    canvas._snapshots = SnapshotSeries(path)
+    canvas._prefetcher = _FakePrefetcher(canvas._snapshots, range(3))
+    canvas._particles = ParticleBuffer()
+    canvas._particles.setData(**canvas._snapshots[0].arrays())
+    canvas._nextParticles = None
+    canvas._nextSnapshot = None
+    canvas._snapshotIndex = 0
+    canvas._snapshotTime = 0.0
+    canvas._playbackClock = 0.0
+    canvas._compactLayout = None
+    canvas.residency = None
+    canvas.playing = True
+    canvas.snapshotsPerSecond = 1.0
+    canvas.interpolateSnapshots = 'hermite'
+    canvas.program = Program(loadShader('particleRenderer.vert'), loadShader('particleRenderer.frag'))
+    canvas._densityProgram = Program(loadShader('particleRenderer.vert', ['DENSITY_SPLAT']),
+                                     loadShader('densityAccumulate.frag'))
+    canvas.changed = []
+    canvas._bindParticles = lambda: None
+    canvas._particlesChanged = lambda snapshot=None, **arrays: canvas.changed.append(snapshot)
+    canvas.setParticles = lambda snapshot=None, **arrays: canvas.changed.append(snapshot)
+    return canvas
+
+
+def test_nextSnapshotIsSwappedIn(canvas):
+    canvas._updatePlayback(0.25)
+    current, following = canvas._particles, canvas._nextParticles
+    assert canvas._nextSnapshot.index == 1 and canvas._interpolationReady()
+    canvas._setInterpolationUniforms()
+    assert canvas.program['interpolation'] == 2 and canvas.program['snapshotInterval'] == 0.5
+
+    canvas._updatePlayback(1.0)
+    # the buffers trade places, the old current one receives the snapshot after the new one
+    assert canvas._particles is following and canvas._nextParticles is current
+    assert (canvas._snapshotIndex, canvas._snapshotTime, canvas._nextSnapshot.index) == (1, 0.5, 2)
+    assert canvas._playbackClock == pytest.approx(0.25)
+    assert canvas.changed == [1]
+
+
+def test_noInterpolationAcrossTheLoop(canvas):
+    canvas._updatePlayback(1.0)
+    canvas._updatePlayback(1.0)
+    assert (canvas._snapshotIndex, canvas._nextSnapshot.index) == (2, 0)
+    assert canvas._interpolationReady()
+    canvas._setInterpolationUniforms()
+    assert canvas.program['interpolation'] == 0 and canvas.program['snapshotInterval'] == 0.0
+
+    canvas._updatePlayback(1.0)
+    assert canvas._snapshotIndex == 0 and canvas.changed == [1, 2, 0]
+
+
+def test_waitsForTheNextSnapshot(canvas):
+    canvas._prefetcher.loaded = {0}
+    canvas._updatePlayback(1.5)
+    assert canvas._snapshotIndex == 0 and canvas._playbackClock == 1.0 and not canvas._interpolationReady()
+    canvas._setInterpolationUniforms()
+    assert canvas.program['interpolation'] == 0
+
+    canvas._prefetcher.loaded.add(1)
+    canvas._updatePlayback(0.0)
+    assert canvas._snapshotIndex == 1 and canvas.changed == [1]
+
+
+def test_compactLayoutFallsBackToSetParticles(canvas):
+    canvas._compactLayout = object()
+    canvas._updatePlayback(1.0)
+    assert canvas._nextParticles is None and canvas._snapshotIndex == 1
+    # the snapshot is set like any other data instead of swapping buffers
+    assert canvas.changed == [1] and canvas._particles.count == 4
+
+
+def test_noCullingWhileInterpolating(canvas):
+    canvas.enableCulling, canvas._spatialIndex, canvas.periodicBox = True, object(), None
+    canvas.sortTransparent, canvas.depthSorter = False, None
+    canvas.enableFiltering, canvas._filterKey, canvas._particleData = False, None, {}
+    assert canvas._indexedDraw() == (True, False, False)
+    canvas._updatePlayback(0.25)
+    assert canvas._indexedDraw() == (False, False, False)
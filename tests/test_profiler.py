@@ -0,0 +1,103 @@
+import csv
+
+import numpy as np
+import pytest
+
+import profiler
+from profiler import FrameProfiler
+
+
+class _FakeGL:
+    """the timer query functions of PyOpenGL, every query takes 2 ms and is available one collect() after it ends"""
+    GL_TIME_ELAPSED = 1
+    GL_QUERY_RESULT_AVAILABLE = 2
+    GL_QUERY_RESULT = 3
+
+    def __init__(self):
+        self.nextQuery = 1
+        self.ended = set()
+        self.deleted = []
+
+    def glGenQueries(self, count):
+        self.nextQuery += count
+        return np.arange(self.nextQuery - count, self.nextQuery, dtype=np.uint32)
+
+    def glBeginQuery(self, target, query):
+        self.active = query
+
+    def glEndQuery(self, target):
+        self.ended.add(self.active)
+
+    def glGetQueryObjectiv(self, query, name, result):
+        result[0] = query in self.ended
+
+    def glGetQueryObjectui64v(self, query, name, result):
+        result[0] = 2000000
+
+    def glDeleteQueries(self, count, queries):
+        assert count == len(queries)
+        self.deleted.extend(int(query) for query in queries)
+
+
+@pytest.fixture
+def gl(monkeypatch):
+    gl = _FakeGL()
+    timersClass = profiler._GpuTimers
+
+    def gpuTimers():
+        timers = timersClass.__new__(timersClass)
+        timers._gl, timers._free, timers._pending = gl, [], []
+        return timers
+    monkeypatch.setattr(profiler, '_GpuTimers', gpuTimers)
+    return gl
+
+
+def _profile(frameProfiler, frames):
+    for _ in range(frames):
+        frameProfiler.beginFrame()
+        with frameProfiler.stage('draw', gpu=True):
+            pass
+        with frameProfiler.stage('upload'):
+            pass
+        frameProfiler.endFrame()
+
+
+def test_percentiles(gl):
+    frameProfiler = FrameProfiler(window=4)
+    frameProfiler._cpu['upload'].extend([5.0, 1.0, 2.0, 3.0, 4.0])
+    assert frameProfiler.percentiles((0, 50, 100))['upload']['cpu'] == [1.0, 2.5, 4.0]
+    _profile(frameProfiler, 3)
+    percentiles = frameProfiler.percentiles()
+    assert set(percentiles) == {'draw', 'upload', 'frame'}
+    assert percentiles['draw']['gpu'] == [2.0, 2.0, 2.0] and 'gpu' not in percentiles['upload']
+    assert len(percentiles['frame']['cpu']) == 3
+
+
+def test_writeCsv(gl, tmp_path):
+    frameProfiler = FrameProfiler(recordTrace=True)
+    _profile(frameProfiler, 2)
+    path = tmp_path / 'trace.csv'
+    frameProfiler.writeCsv(path)
+    with open(path, newline='') as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == ['frame', 'time', 'stage', 'cpu_ms', 'gpu_ms']
+    assert [(row[0], row[2]) for row in rows[1:]] == [('0', 'draw'), ('0', 'frame'), ('0', 'upload'),
+                                                      ('1', 'draw'), ('1', 'frame'), ('1', 'upload')]
+    assert [float(row[4]) for row in rows[1:] if row[2] == 'draw'] == [2.0, 2.0]
+    assert all(row[4] == '' for row in rows[1:] if row[2] != 'draw')
+
+
+def test_closeDeletesQueries(gl):
+    frameProfiler = FrameProfiler()
+    frameProfiler.beginFrame()
+    with frameProfiler.stage('draw', gpu=True):
+        pass
+    with frameProfiler.stage('trails', gpu=True):
+        pass
+    gl.ended.discard(gl.active)
+    frameProfiler.endFrame()
+    # the query of 'draw' is free again, the one of 'trails' still pending
+    frameProfiler.close()
+    assert sorted(gl.deleted) == [1, 2]
+    frameProfiler.close()
+    assert sorted(gl.deleted) == [1, 2]
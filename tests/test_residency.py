@@ -0,0 +1,71 @@
+import glm
+import numpy as np
+
+from residency import BYTES_PER_PARTICLE, ResidencyManager, _spatialChunks
+
+
+def test_spatialChunks():
+    position = np.random.default_rng(0).uniform(-1, 1, (5000, 3)).astype(np.float32)
+    order, start, count, lower, upper = _spatialChunks(position, particlesPerChunk=300, chunkSize=777)
+    assert np.array_equal(np.sort(order), np.arange(len(position)))
+    assert count.sum() == len(position) and count.max() <= 300
+    for chunk in range(len(start)):
+        members = position[order[start[chunk]:start[chunk] + count[chunk]]]
+        assert np.all(members >= lower[chunk]) and np.all(members <= upper[chunk])
+
+
+def _manager(budgetParticles, **kwargs):
+    rng = np.random.default_rng(1)
+    position = rng.uniform(-1, 1, (4000, 3)).astype(np.float32)
+    scalar = rng.uniform(size=len(position)).astype(np.float32)
+    manager = ResidencyManager(position, scalar=scalar, budgetBytes=budgetParticles * BYTES_PER_PARTICLE,
+                               particlesPerChunk=250, **kwargs)
+    return position, manager
+
+
+def test_everythingResidentWithinTheBudget(camera):
+    position, manager = _manager(10000)
+    assert manager.slotCount == manager.chunkCount
+    indices, changed = manager.update(*camera)
+    assert changed and len(indices) == len(position)
+    assert len(np.unique(indices)) == len(indices) and indices.max() < manager.slotCount * manager.slotSize
+    again, changed = manager.update(*camera)
+    assert again is indices and not changed
+    assert manager.statistics()['residentParticles'] == len(position)
+
+
+def test_smallBudgetEvictsChunksOutOfView(camera):
+    view, projection = camera
+    position, manager = _manager(1000)
+    assert manager.slotCount * manager.slotSize <= 1000
+    manager.update(view, projection)
+    assert manager.statistics()['residentChunks'] == manager.slotCount
+    # look at the particles from behind, chunks far away before are close now
+    behind = glm.lookAt(glm.vec3(0, 0, -10), glm.vec3(0, 0, 0), glm.vec3(0, 1, 0))
+    manager.update(behind, projection)
+    assert manager.evictedChunks > 0
+    assert manager.statistics()['residentChunks'] == manager.slotCount
+
+
+def test_uploadsPerFrameAreLimited(camera):
+    position, manager = _manager(10000, uploadBytesPerFrame=1)
+    indices, _ = manager.update(*camera)
+    # one chunk per frame, the first upload is always allowed
+    assert manager.uploadedChunks == 1 and 0 < len(indices) <= manager.slotSize
+    for frame in range(manager.chunkCount):
+        indices, _ = manager.update(*camera)
+    assert len(indices) == len(position)
+
+
+def test_nothingVisible(camera):
+    _, projection = camera
+    position, manager = _manager(10000)
+    away = glm.lookAt(glm.vec3(0, 0, 10), glm.vec3(0, 0, 20), glm.vec3(0, 1, 0))
+    indices, _ = manager.update(away, projection)
+    assert len(indices) == 0 and manager.uploadedChunks == 0
+
+
+def test_bounds():
+    position, manager = _manager(1000)
+    lower, upper = manager.bounds()
+    assert np.array_equal(lower, position.min(axis=0)) and np.array_equal(upper, position.max(axis=0))
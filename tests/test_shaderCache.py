@@ -0,0 +1,65 @@
+import inspect
+import re
+from types import SimpleNamespace
+
+import pytest
+import vispy
+from vispy.gloo import glir
+
+import shaderCache
+from shaderCache import installProgramCache, loadShader, programCacheSupported, programKey
+
+
+def test_loadShaderDefines():
+    plain = loadShader('particleRenderer.vert')
+    source = loadShader('particleRenderer.vert', ['INSTANCED_QUADS', 'DENSITY_SPLAT'])
+    version, rest = plain.split('\n', 1)
+    assert source == version + '\n#define INSTANCED_QUADS\n#define DENSITY_SPLAT\n' + rest
+    assert loadShader('particleRenderer.vert', ()) == plain
+
+
+def test_programKeyChangesWithSourcesAndDriver():
+    shaders = [(1, 'void main() {}'), (2, 'void main() { discard; }')]
+    key = programKey(b'vendor\0renderer\0version', shaders)
+    assert key == programKey(b'vendor\0renderer\0version', list(shaders))
+    assert key != programKey(b'vendor\0renderer\0version 2', shaders)
+    assert key != programKey(b'vendor\0renderer\0version', [(1, 'void main() {}'), (2, 'void main() {} ')])
+    assert key != programKey(b'vendor\0renderer\0version', [(2, 'void main() {}'), (1, 'void main() { discard; }')])
+    assert key != programKey(b'vendor\0renderer\0version', shaders[:1])
+
+
+def test_programCacheSupported():
+    first, last = shaderCache.PROGRAM_CACHE_VISPY_VERSIONS
+    assert programCacheSupported('{}.{}.0'.format(*first))
+    assert programCacheSupported('{}.{}.2.dev0+g1234'.format(*first))
+    assert not programCacheSupported('{}.{}.0'.format(*last))
+    assert not programCacheSupported('0.5.3')
+    assert not programCacheSupported('unknown')
+
+
+def _canvas():
+    parser = SimpleNamespace(_classmap={'Program': glir.GlirProgram, 'VertexShader': glir.GlirVertexShader,
+                                        'FragmentShader': glir.GlirFragmentShader,
+                                        'GeometryShader': glir.GlirGeometryShader})
+    return SimpleNamespace(context=SimpleNamespace(shared=SimpleNamespace(parser=parser)))
+
+
+def test_installOnlyWithCheckedVispyVersions(monkeypatch, tmp_path):
+    canvas = _canvas()
+    monkeypatch.setattr(vispy, '__version__', '99.0.0')
+    assert not installProgramCache(canvas, str(tmp_path))
+    assert canvas.context.shared.parser._classmap['Program'] is glir.GlirProgram
+
+    monkeypatch.setattr(vispy, '__version__', '{}.{}.0'.format(*shaderCache.PROGRAM_CACHE_VISPY_VERSIONS[0]))
+    assert installProgramCache(canvas, str(tmp_path))
+    classmap = canvas.context.shared.parser._classmap
+    assert issubclass(classmap['Program'], glir.GlirProgram) and classmap['Program'].directory == str(tmp_path)
+    assert issubclass(classmap['VertexShader'], glir.GlirVertexShader)
+
+
+@pytest.mark.skipif(not programCacheSupported(), reason="program cache not checked against this vispy version")
+def test_linkBookkeepingMatchesVispy():
+    # a program loaded from the cache sets everything GlirProgram.link_program() sets after linking
+    def assigned(function):
+        return set(re.findall(r'self\.(\w+) =', inspect.getsource(function)))
+    assert assigned(glir.GlirProgram.link_program) <= assigned(shaderCache._CachedProgram.link_program)
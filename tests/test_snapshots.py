@@ -0,0 +1,63 @@
+import threading
+
+import numpy as np
+import pytest
+
+from snapshots import SnapshotPrefetcher, SnapshotSeries, SnapshotWriter
+
+
+@pytest.fixture
+def seriesPath(tmp_path):
+    path = tmp_path / 'series.pvs'
+    with SnapshotWriter(path) as writer:
+        for step in range(5):
+            position = np.full((7, 3), step, dtype=np.float32)
+            writer.write(position, scalar=np.arange(7) * step, time=0.5 * step)
+    return path
+
+
+def test_roundTrip(seriesPath):
+    series = SnapshotSeries(seriesPath)
+    assert len(series) == 5
+    assert series.times() == [0.0, 0.5, 1.0, 1.5, 2.0]
+    snapshot = series[-1]
+    assert snapshot.index == 4
+    assert np.array_equal(snapshot.position, np.full((7, 3), 4))
+    assert np.array_equal(snapshot.scalar, np.arange(7) * 4)
+    assert snapshot.vector is None and set(snapshot.arrays()) == {'position', 'scalar'}
+    with pytest.raises(IndexError):
+        series[5]
+
+
+def test_notASnapshotFile(tmp_path):
+    path = tmp_path / 'other'
+    path.write_bytes(b'x' * 64)
+    with pytest.raises(ValueError):
+        SnapshotSeries(path)
+
+
+def test_prefetcherDoesNotWaitForOnLoad(seriesPath):
+    release = threading.Event()
+    loaded = []
+
+    def onLoad(snapshot):
+        release.wait(5)
+        loaded.append(snapshot.index)
+
+    prefetcher = SnapshotPrefetcher(SnapshotSeries(seriesPath), lookahead=2, onLoad=onLoad)
+    try:
+        # onLoad blocks, the snapshots are available anyway
+        assert prefetcher.get(0).index == 0
+        assert prefetcher.get(1).index == 1
+        assert loaded == []
+    finally:
+        release.set()
+        prefetcher.close()
+
+
+def test_prefetcherWindowWraps(seriesPath):
+    prefetcher = SnapshotPrefetcher(SnapshotSeries(seriesPath), lookahead=2)
+    assert prefetcher._window(4) == [4, 0, 1]
+    prefetcher.loop = False
+    assert prefetcher._window(4) == [4]
+    prefetcher.close()
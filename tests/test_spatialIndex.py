@@ -0,0 +1,56 @@
+import numpy as np
+
+from spatialIndex import GridIndex, boxesInFrustum, frustumPlanes
+from transform import glmToNumpy
+
+
+def _planes(camera):
+    view, projection = camera
+    return frustumPlanes(glmToNumpy(view) @ glmToNumpy(projection))
+
+
+def test_boxesInFrustum(camera):
+    planes = _planes(camera)
+    lower = np.array([(-1, -1, -1), (-1, -1, 20), (50, 0, 0), (-1, -1, -200)], dtype=np.float64)
+    upper = lower + 2
+    # in front of the camera, behind it, far to the side, beyond the far plane
+    assert boxesInFrustum(planes, lower, upper).tolist() == [True, False, False, False]
+    # a box reaching into the frustum is kept
+    assert boxesInFrustum(planes, np.array([[-100.0, -1, -1]]), np.array([[0.0, 1, 1]])).tolist() == [True]
+
+
+def test_allParticlesInView(camera):
+    position = np.random.default_rng(0).uniform(-1, 1, (5000, 3)).astype(np.float32)
+    index = GridIndex(position, particlesPerCell=100)
+    assert np.array_equal(np.sort(index.order), np.arange(len(position)))
+    indices, changed = index.visibleIndices(*camera)
+    assert changed and np.array_equal(np.sort(indices), np.arange(len(position)))
+    again, changed = index.visibleIndices(*camera)
+    assert not changed and again is indices
+
+
+def test_cellsBehindTheCameraAreCulled(camera):
+    rng = np.random.default_rng(1)
+    front = rng.uniform(-1, 1, (1000, 3))
+    behind = rng.uniform(-1, 1, (1000, 3)) + (0, 0, 20)
+    index = GridIndex(np.concatenate([front, behind]), particlesPerCell=50)
+    indices, _ = index.visibleIndices(*camera)
+    assert np.all(indices < 1000)
+    # all particles in front are drawn, cells are culled as a whole
+    assert np.array_equal(np.sort(indices), np.arange(1000))
+
+
+def test_levelOfDetailSubsamplesDistantCells(camera):
+    position = np.random.default_rng(2).uniform(-1, 1, (8000, 3))
+    index = GridIndex(position, particlesPerCell=100)
+    everything, _ = index.visibleIndices(*camera)
+    reduced, changed = index.visibleIndices(*camera, lodDistance=2.0, minFraction=0.05)
+    assert changed
+    assert 0.05 * len(everything) <= len(reduced) < 0.1 * len(everything)
+    assert np.all(np.isin(reduced, everything))
+
+
+def test_emptyIndex(camera):
+    index = GridIndex(np.zeros((0, 3)))
+    indices, _ = index.visibleIndices(*camera)
+    assert len(indices) == 0
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from vispy.gloo import Program
+
+from shaderCache import loadShader
+from trails import ParticleTrails
+
+
+def _uploads(buffer):
+    """data of the uploads queued for a vertex buffer, as flat float32 arrays"""
+    return [np.ascontiguousarray(command[3]).view(np.float32).reshape(-1)
+            for command in buffer.glir.clear() if command[0] == 'DATA']
+
+
+def test_ringAdvances():
+    trails = ParticleTrails(length=3)
+    assert (trails.head, trails.filled) == (-1, 0)
+    for step in range(4):
+        trails.push(np.full((5, 3), step))
+    assert (trails.count, trails.head, trails.filled) == (5, 0, 3)
+    trails.push(np.zeros((6, 3)))
+    # a different particle count starts new trails
+    assert (trails.count, trails.head, trails.filled) == (6, 0, 1)
+    with pytest.raises(ValueError):
+        ParticleTrails(length=2)
+
+
+def test_pushCopiesTheArrays():
+    trails = ParticleTrails(length=4)
+    position = np.zeros((5, 3), dtype=np.float32)
+    scalar = np.zeros(5, dtype=np.float32)
+    _uploads(trails._position)
+    trails.push(position, scalar)
+    position[:] = 1
+    scalar[:] = 1
+    # the caller changed its arrays before the queued uploads ran
+    assert not _uploads(trails._position)[-1].any()
+    assert not _uploads(trails._scalar)[-1].any()
+
+
+def test_pushReusesTheLastScalars():
+    trails = ParticleTrails(length=4)
+    trails.push(np.zeros((3, 3)), np.arange(3))
+    _uploads(trails._scalar)
+    trails.push(np.zeros((3, 3)))
+    assert np.array_equal(_uploads(trails._scalar)[-1], np.arange(3))
+
+
+def test_bindingKeepsTheRingDivisors():
+    trails = ParticleTrails(length=4)
+    trails.push(np.zeros((5, 3)))
+    instanced = Program(loadShader('particleRenderer.vert', ['INSTANCED_QUADS']), loadShader('particleRenderer.frag'))
+    lines = Program(loadShader('trail.vert'), loadShader('trail.frag'))
+    trails.bindSpheres(instanced, 0.1, divisor=1)
+    trails.bindLines(lines)
+    for name in ('input_position', 'input_scalar'):
+        assert instanced._user_variables[name].divisor == 1
+        assert instanced._user_variables[name].size == 20
+        assert lines._user_variables[name].divisor is None
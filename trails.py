@@ -0,0 +1,95 @@
+import numpy as np
+from vispy import gloo
+
+
+class ParticleTrails:
+    """Keeps the last length positions (and scalars) of every particle in a ring buffer on the gpu. Slot s of the
+    ring holds the particles of one frame at [s*count, (s+1)*count), so adding a frame is a single sub range
+    upload at the ring head and the memory traffic per frame is O(count), independent of the trail length.
+    The shaders compute the age of a position from its index into the ring (see trail.vert)."""
+
+    def __init__(self, length=32):
+        if length < 3:
+            raise ValueError("trails need a length of at least 3, got " + str(length))
+        self.length = length  # number of positions per particle
+
+        # internal state (DO NOT WRITE, only read)
+        self.count = 0  # number of particles
+        self.head = -1  # ring slot of the newest positions
+        self.filled = 0  # number of slots written since the last reset
+        self._position = gloo.VertexBuffer(np.zeros((0, 3), dtype=np.float32))
+        self._scalar = gloo.VertexBuffer(np.zeros(0, dtype=np.float32))
+        self._lastScalar = None
+        self._lineIndices = None
+
+    def reset(self, count=None):
+        """forget all positions, count changes the number of particles"""
+        if count is not None and count != self.count:
+            self.count = count
+            self._position.resize_bytes(self.length * count * 3 * 4)
+            self._scalar.resize_bytes(self.length * count * 4)
+            self._lineIndices = None
+        self.head = -1
+        self.filled = 0
+
+    def push(self, position, scalar=None):
+        """Add the positions (n,3) of the next frame. Without scalar the last scalars are used again.
+        A different particle count starts new trails."""
+        position = np.ascontiguousarray(position, dtype=np.float32).reshape(-1, 3)
+        if len(position) != self.count:
+            self.reset(len(position))
+            self._lastScalar = None
+        if scalar is None:
+            scalar = self._lastScalar if self._lastScalar is not None else np.zeros(self.count, dtype=np.float32)
+        scalar = np.ascontiguousarray(scalar, dtype=np.float32).reshape(self.count)
+        self._lastScalar = scalar
+        if self.count == 0:
+            return
+        self.head = (self.head + 1) % self.length
+        self.filled = min(self.filled + 1, self.length)
+        # uploads are deferred until the next draw, the caller may reuse its arrays (eg live feed slots) before
+        self._position.set_subdata(position, offset=self.head * self.count, copy=True)
+        self._scalar.set_subdata(scalar, offset=self.head * self.count, copy=True)
+
+    def lineIndices(self):
+        """index buffer with a line between the positions of consecutive slots for every particle,
+        it only depends on length and count so it is uploaded once"""
+        if self._lineIndices is None:
+            first = np.arange(self.length * self.count, dtype=np.uint32)
+            second = (first + self.count) % np.uint32(self.length * self.count)
+            self._lineIndices = gloo.IndexBuffer(np.stack([first, second], axis=1).reshape(-1))
+        return self._lineIndices
+
+    def _views(self, divisor):
+        """views of the ring with their own divisor, the particle program and the line program share the buffers"""
+        size = self.length * self.count
+        position, scalar = self._position[:size], self._scalar[:size]
+        position.divisor = scalar.divisor = divisor
+        return position, scalar
+
+    def _setUniforms(self, program):
+        program['trailHead'] = self.head
+        program['trailLength'] = self.length
+        program['trailFilled'] = self.filled
+        program['trailParticles'] = self.count
+
+    def bindLines(self, program):
+        """bind the ring to a program with the shaders trail.vert and trail.frag"""
+        program['input_position'], program['input_scalar'] = self._views(None)
+        self._setUniforms(program)
+
+    def bindSpheres(self, program, radius, divisor=None):
+        """Bind the ring to the particle program, which then draws length * count spheres that shrink with their
+        age (see particleRenderer.vert). radius is used for all particles, vectors are zero.
+        With divisor 1 the positions advance once per instance, for instanced rendering."""
+        program['input_position'], program['input_scalar'] = self._views(divisor)
+        program['input_vector'] = (0, 0, 0)
+        program['input_radius'] = radius
+        program['input_positionNext'] = (0, 0, 0)
+        program['input_vectorNext'] = (0, 0, 0)
+        program['input_scalarNext'] = 0
+        program['input_packed'] = (0, 0)
+        program['input_quantizedPosition'] = (0, 0)
+        program['vertexLayout'] = 0
+        program['interpolation'] = 0
+        self._setUniforms(program)
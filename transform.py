@@ -1,4 +1,5 @@
 import glm
+import numpy as np
 
 class Transform:
     """Class represents a full 3d transformation including scale,
@@ -30,3 +31,16 @@ class Transform:
     def lookAt(self, target, up):
         """set orientation to look at the target, target and up are expected to be glm.vec3"""
         self.orientation = glm.quatLookAt(glm.normalize(target-self.position), up)
+
+
+def glmToNumpy(matrix):
+    """convert a glm.mat4 to a 4x4 numpy array in the layout vispy uses (row vectors, p' = p @ m),
+    numpy arrays are returned unchanged"""
+    if isinstance(matrix, np.ndarray):
+        return matrix
+    return np.array([list(matrix[i]) for i in range(4)], dtype=np.float64)
+
+
+def numpyToGlm(matrix):
+    """convert a 4x4 numpy array in vispy layout to a glm.mat4"""
+    return glm.mat4(*np.asarray(matrix, dtype=np.float64).reshape(-1))